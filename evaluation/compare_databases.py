@@ -1,12 +1,9 @@
 from cdedatabase import CDEDatabase, JSONCoder
-from cdedatabase.results import Results
-from photocatalyst_models import ApparentQuantumYield, SolarToHydrogen, HydrogenEvolution, HydrogenEvolution2, HydrogenEvolution3, Additive
 from e2e_workflow.evaluation.compare_records import compare_records, Statistics
 from pprint import pprint
 import sys
 import os
 import copy
-import wandb
 
 
 def papers_list(directory):
@@ -152,6 +149,7 @@ class Comparer:
             print("  -F1:", stat.f1())
 
         if _log_to_wandb:
+            import wandb
             lax_string = "lax-" if is_lax else ""
             stats_dict = {
                 f"all_models/{lax_string}precision": all_models_stats.precision(),
@@ -34,28 +34,29 @@ matscholar_archive_package = Package(
 # Append to PACKAGES so that find_data works
 PACKAGES.append(matscholar_archive_package)
 
-indexers = {
-    "bert": PretrainedBertIndexer(
-        do_lowercase=False,
-        use_starting_offsets=True,
-        truncate_long_sequences=False,
-        pretrained_model=find_data("models/scibert_cased_vocab-1.0.txt")
-    ),
-}
-
 
 class MatscholarTagger(AllenNlpWrapperTagger):
     overrides = {"model.text_field_embedder.token_embedders.bert.pretrained_model": find_data("models/scibert_cased_weights-1.0.tar.gz")}
 
 
-allenwrappertagger = MatscholarTagger(
-    tag_type=tag_type,
-    archive_location=find_data("models/bert_matscholar"),
-    indexers=indexers
-)
-
-
-Sentence.taggers.extend([allenwrappertagger, _AllenNlpTokenTagger(), ProcessedTextTagger(), LemmaTagger()])
+def load_taggers():
+    # Passed to the extractor as model_loader rather than run at import time, so
+    # that with workers_per_rank the BERT model is only loaded once per node and
+    # shared between the workers forked there.
+    indexers = {
+        "bert": PretrainedBertIndexer(
+            do_lowercase=False,
+            use_starting_offsets=True,
+            truncate_long_sequences=False,
+            pretrained_model=find_data("models/scibert_cased_vocab-1.0.txt")
+        ),
+    }
+    allenwrappertagger = MatscholarTagger(
+        tag_type=tag_type,
+        archive_location=find_data("models/bert_matscholar"),
+        indexers=indexers
+    )
+    Sentence.taggers.extend([allenwrappertagger, _AllenNlpTokenTagger(), ProcessedTextTagger(), LemmaTagger()])
 
 
 extractor = CDEDatabaseExtractor(
@@ -69,6 +70,7 @@ extractor = CDEDatabaseExtractor(
     filter_results=None,
     is_valid_document=None,
     cache_dir=cache_dir,
+    model_loader=load_taggers,
 )
 
 all_start_time = datetime.datetime.now()
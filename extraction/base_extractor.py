@@ -1,46 +1,312 @@
-from cdedatabase import CDEDatabase, JSONCoder
-from photocatalyst_models import filter_results, is_valid_document, adjascent_sections
-
 from chemdataextractor import Document
-from chemdataextractor.doc.text import Citation, Footnote
 from chemdataextractor.model.base import ModelList
-from chemdataextractor.doc.document_cacher import PlainTextCacher
 
-import wandb
+from e2e_workflow.extraction.batch_tagging import BatchTaggedExtraction, BatchTagger
+from e2e_workflow.extraction.corpus import DocumentSource, document_name
+from e2e_workflow.extraction.dedup import DEDUPLICATION_MODES, find_duplicates
+from e2e_workflow.extraction.doc_cache import DocumentCache, tag_document
+from e2e_workflow.extraction.dispatch import ChunkDispatcher
+from e2e_workflow.extraction.instrumentation import (
+    MemoryTracker,
+    MetricsWriter,
+    StageTimer,
+    memory_usage,
+    peak_rss_bytes,
+    process_start_time,
+    records_by_model,
+    rss_bytes,
+)
+from e2e_workflow.extraction.pipeline import DocumentPipeline
+from e2e_workflow.extraction.profiling import DocumentProfiler
+from e2e_workflow.extraction.progress import JsonlProgressSink, ProgressAggregator, WandbProgressSink
+from e2e_workflow.extraction.journal import RunJournal, STARTED, COMPLETED, FAILED, TIMED_OUT
+from e2e_workflow.extraction.run_report import build_run_report, print_run_report
+from e2e_workflow.extraction.scheduling import (
+    SCHEDULING_POLICIES,
+    CostEstimator,
+    order_largest_first,
+    print_run_prediction,
+    scheduling_summary,
+)
+from e2e_workflow.extraction.writer import BackgroundWriter
+from e2e_workflow.extraction.watchdog import TIMEOUT_POLICIES, DocumentTimeout, time_limit
+from e2e_workflow.extraction.work_queue import DEFAULT_LEASE_SECONDS, FileWorkQueue
+from e2e_workflow.extraction.worker_pool import RecyclingPool, WorkerLost, report_progress, worker_index
+
+import contextlib
 import datetime
+import functools
+import itertools
+import json
+import multiprocessing
 import os
-from pprint import pprint
-
-print(wandb.__path__)
+import queue
+import time
+from collections import defaultdict, deque
 
 AWAITING_DATA_TAG = 111
 RETURNING_DATA_TAG = 222
 # is_main_thread = (rank == 0)
 
+BACKENDS = ["single", "mpi", "processes", "file_queue"]
+
+# The extractor used by workers in the process pool. This is set before the
+# pool is forked so that each worker inherits it (and its models, taggers and
+# cacher) instead of having to pickle it.
+_pool_extractor = None
+
+
+def _pool_worker_rank(index, parent_rank):
+    # Workers forked from an MPI rank are numbered within that rank. Recycled
+    # workers are replaced by workers with new numbers.
+    return index if parent_rank is None else f"{parent_rank}.{index}"
+
+
+def _init_pool_worker(parent_rank):
+    _pool_extractor.rank = _pool_worker_rank(worker_index(), parent_rank)
+    _pool_extractor.memory_tracker = MemoryTracker()
+    fork_time = process_start_time()
+    _pool_extractor._report_worker_ready(None if fork_time is None else time.time() - fork_time, forked=True)
+
+
+def _extract_in_pool_worker(task):
+    # Each document's summary is also sent back as soon as it's finished, so that
+    # if the worker dies later in the chunk, the documents it finished still count
+    return _pool_extractor._extract_papers_in_worker(_pool_extractor._start_task(task), report_progress)
+
+
+def _pool_worker_recycle_reason(summaries):
+    return _pool_extractor._recycle_reason(summaries)
+
+
+def _finish_pool_worker(reason):
+    _pool_extractor._finish_worker(reason)
+
+
+def _lost_pool_task(parent_rank, task, exitcode, finished_summaries, index):
+    # Called in the process that owns the pool, so the lost documents are
+    # recorded under the rank the worker had rather than the owner's
+    return _pool_extractor._lost_document_summaries(
+        task["document_paths"], exitcode, finished_summaries, _pool_worker_rank(index, parent_rank)
+    )
+
+
+def _chunked(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
 
 class BaseExtractor:
     def __init__(
         self,
         cache_dir=None,
+        cache_max_bytes=None,
+        cache_fingerprint=None,
         use_mpi=True,
+        backend=None,
+        workers=None,
+        queue_dir=None,
+        lease_seconds=DEFAULT_LEASE_SECONDS,
+        chunk_size=1,
+        prefetch_chunks=1,
+        master_does_work=False,
+        pipeline_depth=0,
+        workers_per_rank=1,
+        model_loader=None,
+        max_worker_rss_bytes=None,
+        max_documents_per_worker=None,
+        tagging_batch_size=None,
+        tagging_batch_documents=8,
+        batch_tag_types=None,
+        scheduling=None,
+        cost_history_path=None,
+        deduplicate=None,
+        journal_dir=None,
+        retry_failed=False,
+        document_timeout=None,
+        timeout_policy="quarantine",
+        timeout_retries=1,
+        write_behind=False,
+        max_pending_writes=16,
+        write_batch_size=8,
+        metrics_dir=None,
+        profile_dir=None,
+        profile_sample_rate=0.,
+        profile_slow_threshold=None,
+        progress_interval=30.,
+        progress_path=None,
+        run_summary_path=None,
         use_wandb=False,
         wandb_project=None,
         wandb_config=None,
         wandb_run_name=None,
         wandb_save_files=None,
+        wandb_mode=None,
     ):
+        # cache_fingerprint is added to the cache key, e.g. to invalidate the cache
+        # when a model that isn't loaded by the taggers themselves changes
         self.cache_dir = cache_dir
+        self.document_cache = None
         if self.cache_dir is not None:
-            self.cacher = PlainTextCacher(cache_dir)
+            self.document_cache = DocumentCache(cache_dir, cache_max_bytes, cache_fingerprint)
+        self._warming_cache = False
+        # The cache counters of this process when it last finished a document,
+        # and the counters added up from the summaries recorded on the master,
+        # as each worker process counts its own
+        self._reported_cache_stats = {}
+        self._cache_stats = {}
+
+        if backend is None:
+            backend = "mpi" if use_mpi else "single"
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, should be one of {BACKENDS}")
+        self.backend = backend
+
+        self.workers = workers
+        if workers is None:
+            self.workers = os.cpu_count()
+
+        self.chunk_size = chunk_size
+        self.prefetch_chunks = prefetch_chunks
+        self.master_does_work = master_does_work
+        self.pipeline_depth = pipeline_depth
 
-        self.use_mpi = use_mpi
-        if use_mpi:
+        # With workers_per_rank, each MPI rank forks that many workers, which
+        # share the models the rank has loaded. Run one rank per node to only
+        # load them once per node. Each chunk is shared between a rank's workers,
+        # so chunks are at least that big.
+        self.workers_per_rank = max(workers_per_rank, 1)
+        if self.workers_per_rank > 1:
+            self.chunk_size = max(self.chunk_size, self.workers_per_rank)
+
+        # With tagging_batch_size, workers load up to tagging_batch_documents
+        # documents at a time and tag their sentences together, in batches of up
+        # to tagging_batch_size sentences, before extracting their records.
+        self.batch_tagger = None
+        self.tagging_batch_documents = tagging_batch_documents
+        if tagging_batch_size is not None:
+            if pipeline_depth:
+                raise ValueError("tagging_batch_size can't be used with pipeline_depth")
+            self.batch_tagger = BatchTagger(tagging_batch_size, batch_tag_types)
+
+        # model_loader is called once in each process that extracts (or that
+        # forks workers), before extracting, so that models can be loaded there
+        # rather than at import time.
+        self.model_loader = model_loader
+        self.model_load_seconds = None
+
+        # Forked workers are recycled (replaced by freshly forked ones) once their
+        # resident memory goes over max_worker_rss_bytes or they've extracted
+        # max_documents_per_worker documents. With MPI, this means each rank forks
+        # its workers, even without workers_per_rank.
+        self.max_worker_rss_bytes = max_worker_rss_bytes
+        self.max_documents_per_worker = max_documents_per_worker
+        self.memory_tracker = MemoryTracker()
+
+        if scheduling is not None and scheduling not in SCHEDULING_POLICIES:
+            raise ValueError(f"Unknown scheduling policy {scheduling}, should be one of {SCHEDULING_POLICIES}")
+        self.scheduling = scheduling
+        # The cost estimator learns how long documents take from past runs (saved
+        # to cost_history_path), and predicts how long the run will take, which
+        # is also used for the ETA. With a scheduling policy, it orders dispatch.
+        self.cost_estimator = None
+        if scheduling is not None or cost_history_path is not None:
+            self.cost_estimator = CostEstimator(cost_history_path)
+        self._predicted_costs = {}
+        self._document_timings = {}
+        self._document_statuses = {}
+
+        # With deduplicate, only the first of each group of duplicate documents is
+        # extracted, and the others are given its output with link_duplicate_outputs.
+        if deduplicate is not None and deduplicate not in DEDUPLICATION_MODES:
+            raise ValueError(f"Unknown deduplication mode {deduplicate}, should be one of {DEDUPLICATION_MODES}")
+        self.deduplicate = deduplicate
+        self._duplicates = {}
+
+        self.journal = None
+        if journal_dir is not None:
+            self.journal = RunJournal(journal_dir)
+        # The output fingerprints of the papers being extracted again because
+        # they were completed with a different one. They're found from the
+        # journal on the master and sent out with each chunk, so that the
+        # workers don't all read the journal.
+        self._journalled_fingerprints = {}
+        self.retry_failed = retry_failed
+
+        if timeout_policy not in TIMEOUT_POLICIES:
+            raise ValueError(f"Unknown timeout policy {timeout_policy}, should be one of {TIMEOUT_POLICIES}")
+        self.document_timeout = document_timeout
+        self.timeout_policy = timeout_policy
+        self.timeout_retries = timeout_retries
+        self._timeout_counts = {}
+        self._quarantined = []
+
+        # With write_behind, outputs are written in a background thread while the
+        # next document in the chunk is extracted. Each chunk's summaries are only
+        # sent back once all of its writes are durable, so the writer is flushed
+        # at the end of every chunk, and only overlaps with extraction if chunks
+        # have more than one document (or with the single backend, which extracts
+        # everything as one chunk).
+        self.write_behind = write_behind
+        if write_behind and self.chunk_size == 1 and backend != "single":
+            print("write_behind only overlaps writing with extraction within a chunk, so pass a chunk_size above 1")
+        self.max_pending_writes = max_pending_writes
+        self.write_batch_size = write_batch_size
+        self._writer = None
+        self._writer_pid = None
+        self._finished_documents = queue.Queue()
+
+        self.stage_timer = StageTimer()
+        self.metrics_writer = None
+        if metrics_dir is not None:
+            self.metrics_writer = MetricsWriter(metrics_dir)
+
+        # Outputs are named after each document's path relative to this, if it's
+        # set, rather than its filename. extract sets it when the documents
+        # aren't all in one directory (see DocumentSource.names_dir).
+        self.document_names_dir = None
+
+        self.profiler = None
+        if profile_dir is not None:
+            self.profiler = DocumentProfiler(profile_dir, profile_sample_rate, profile_slow_threshold)
+
+        # Progress is logged to wandb (if use_wandb) and to the JSONL file at
+        # progress_path (if given) at most every progress_interval seconds
+        self.progress_interval = progress_interval
+        self.progress_path = progress_path
+        self.progress = None
+
+        # The summaries of every document in the last run, collected on the
+        # master, and reported at the end of the run (and saved to
+        # run_summary_path, if given)
+        self.run_summaries = []
+        self.run_summary_path = run_summary_path
+
+        self.use_mpi = (backend == "mpi")
+        self.rank = 0
+        self.size = 1
+        self.is_main_thread = True
+        if self.use_mpi:
             from mpi4py import MPI
             self.comm = MPI.COMM_WORLD
             self.rank = self.comm.Get_rank()
             self.size = self.comm.Get_size()
             self.is_main_thread = (self.rank == 0)
 
+        # With the file_queue backend, any number of processes started separately
+        # (e.g. on different nodes) with the same queue_dir share the work. Each
+        # process is its own rank, named after its host and pid.
+        self.work_queue = None
+        if backend == "file_queue":
+            if queue_dir is None:
+                raise ValueError("The file_queue backend needs a queue_dir")
+            self.work_queue = FileWorkQueue(queue_dir, lease_seconds)
+            self.rank = self.work_queue.owner
+
         self.use_wandb = use_wandb
         self.wandb_project = wandb_project
         self.wandb_config = wandb_config
@@ -48,9 +314,13 @@ class BaseExtractor:
         self.wandb_save_files = wandb_save_files
         if wandb_save_files is None:
             self.wandb_save_files = []
+        # e.g. "offline" on nodes without network access, to sync afterwards
+        self.wandb_mode = wandb_mode
 
     def will_start_extraction(self):
         if self.use_wandb:
+            # wandb is only imported when it's used, as it takes a while to import
+            import wandb
             if wandb.run is None:
                 self.create_wandb_run()
             else:
@@ -60,11 +330,13 @@ class BaseExtractor:
                 wandb.save(file)
 
     def create_wandb_run(self):
+        import wandb
         print("WANDB CONFIG:", self.wandb_config)
         return wandb.init(
             project=self.wandb_project,
             config=self.wandb_config,
-            name=self.wandb_run_name
+            name=self.wandb_run_name,
+            mode=self.wandb_mode
         )
 
     def should_open_file(self, file):
@@ -79,129 +351,1034 @@ class BaseExtractor:
     def postprocess_records(self, records, filename):
         pass
 
+    def discard_partial_output(self, filename):
+        # Called before re-extracting a document that a previous run started but
+        # never finished, e.g. because the job was killed.
+        pass
+
+    def output_fingerprint(self):
+        # A fingerprint of whatever determines the output (e.g. the models), or
+        # None. It's journalled with each completed document, and documents
+        # completed with a different fingerprint are extracted again.
+        return None
+
+    def is_output_up_to_date(self, output_fingerprint):
+        # Whether a document completed with output_fingerprint can be skipped
+        return output_fingerprint == self.output_fingerprint()
+
+    def journalled_output_fingerprint(self, document_path):
+        # The output fingerprint the document was journalled with, if it was
+        # completed with a different one from the current one. Papers completed
+        # with the current one are never dispatched.
+        return self._journalled_fingerprints.get(document_path)
+
+    def link_duplicate_outputs(self, duplicates):
+        # Called at the end of a run with deduplicate, with the path of each
+        # duplicate document and the path of the document extracted in its place.
+        pass
+
     def extract_paper(self, document_path):
         doc_start_time = datetime.datetime.now()
 
-        if self.should_open_file(document_path):
-            did_use_cache = False
+        loaded = self._load_document(document_path)
+        if loaded is not None:
+            doc, cache_key = loaded
+            document_records = self._extract_document_records(doc, document_path)
+            self._save_document(doc, document_records, document_path, cache_key)
+
+        doc_end_time = datetime.datetime.now()
+
+        print(f"{document_path} took:", doc_end_time - doc_start_time)
+
+    # extract_paper is split into the following stages so that the pipelined
+    # workers can run them for different documents at the same time.
+    def _load_document(self, document_path):
+        # Returns the document, and the key to cache it under if it should be
+        # cached once it's been extracted
+        # When warming the cache, documents are opened even if their records have
+        # already been extracted, but not if they're already cached
+        if self._warming_cache:
+            with self.stage_timer.stage("hydrate_cache"):
+                is_cached = self.document_cache.contains_document(document_path)
+            if is_cached:
+                self.stage_timer.set("used_cache", True)
+                return None
+        elif not self.should_open_file(document_path):
+            self.stage_timer.set("skipped", True)
+            return None
+
+        doc = self._open_document(document_path)
+        did_use_cache = False
+        cache_key = None
+        if self.document_cache is not None:
+            with self.stage_timer.stage("hydrate_cache"):
+                cache_key = self.document_cache.key_for(document_path, doc)
+                if cache_key is not None and self._warming_cache:
+                    # No need to read the entry back, or to tag the document again
+                    if self.document_cache.contains(cache_key):
+                        self.stage_timer.set("used_cache", True)
+                        return None
+                elif cache_key is not None:
+                    try:
+                        did_use_cache = self.document_cache.hydrate(doc, cache_key)
+                    except (AttributeError, OSError, ValueError) as e:
+                        # e.g. the entry was evicted while we were reading it
+                        print(f"COULD NOT HYDRATE {document_path} FROM CACHE DUE TO: {e}")
+                        doc = None
+            if doc is None:
+                doc = self._open_document(document_path)
+        self.stage_timer.set("used_cache", did_use_cache)
+        return doc, None if did_use_cache else cache_key
+
+    def _open_document(self, document_path):
+        with self.stage_timer.stage("open"):
             doc = Document.from_file(document_path)
+        with self.stage_timer.stage("configure"):
             self.configure_document(doc)
-            if self.cache_dir is not None:
-                try:
-                    self.cacher.hydrate_document(doc, document_path)
-                    did_use_cache = True
-                except AttributeError:
-                    pass
-
-            document_records = ModelList()
+        # For the cost estimator
+        self.stage_timer.set("num_tables", len(doc.tables))
+        self.stage_timer.set("num_paragraphs", len(doc.paragraphs))
+        return doc
+
+    def _extract_document_records(self, doc, document_path):
+        document_records = ModelList()
+        if self._warming_cache:
+            with self.stage_timer.stage("tag"):
+                tag_document(doc)
+            return document_records
+
+        with self.stage_timer.stage("records"):
             if self.should_process_document(doc):
                 document_records = doc.records
             else:
                 print(f"CANCELLED DOCUMENT {document_path}")
+        self.stage_timer.set("num_records", len(document_records))
+        self.stage_timer.set("records_by_model", records_by_model(document_records))
+        return document_records
 
-            self.postprocess_records(document_records, document_path)
+    def _save_document(self, doc, document_records, document_path, cache_key):
+        if not self._warming_cache:
+            with self.stage_timer.stage("postprocess"):
+                self.postprocess_records(document_records, document_path)
 
-            if not did_use_cache and self.cache_dir is not None:
-                self.cacher.cache_document(doc, document_path, overwrite_cache=True)
+        if cache_key is not None:
+            self.submit_write(lambda: self.document_cache.store(doc, cache_key), "cache_write")
 
-        doc_end_time = datetime.datetime.now()
+    def submit_write(self, write, stage):
+        # Persists data for the current document. write should return the paths it
+        # wrote to. With write_behind, this happens in a background thread, and the
+        # document is only reported as finished once the data has been fsynced.
+        writer = self._background_writer()
+        if writer is None:
+            with self.stage_timer.stage(stage):
+                write()
+            return
 
-        print(f"{document_path} took:", doc_end_time - doc_start_time)
+        summary = self.stage_timer.current_summary()
+
+        def on_error(e):
+            if summary is not None:
+                self._mark_document_failed(summary, stage, e)
+            else:
+                print(f"BACKGROUND WRITE FAILED DUE TO: {e}")
+
+        writer.submit(write, stage=stage, summary=summary, on_error=on_error)
+
+    def _background_writer(self):
+        if not self.write_behind:
+            return None
+        # Each process needs its own writer thread, e.g. after the process pool forks
+        if self._writer is None or self._writer_pid != os.getpid():
+            self._writer = BackgroundWriter(self.max_pending_writes, self.write_batch_size)
+            self._writer_pid = os.getpid()
+        return self._writer
+
+    def close_outputs(self):
+        # Called in each process once it has finished writing, after any
+        # background writes are done
+        pass
+
+    def _finish_writing(self):
+        self._close_background_writer()
+        self.close_outputs()
+
+    def _close_background_writer(self):
+        if self._writer is None or self._writer_pid != os.getpid():
+            return
+        self._writer.close()
+        print(
+            f"Background writer: {self._writer.num_writes} writes in {self._writer.num_batches} batches, "
+            f"blocked for {self._writer.time_blocked:.1f}s"
+        )
+        self._writer = None
+
+    def _document_paths(self, document_source, num_workers, num_papers=None, track_progress=True):
+        # Returns the paths in the order they'd be listed and the paths in the order
+        # they should be dispatched. Unless we need to see every path up front to
+        # schedule them or predict the cost of the run, the former is None and the
+        # latter is a lazy iterator. num_workers is None if we don't know how many
+        # workers there will be, and track_progress is False if this process will
+        # only extract some of the documents itself.
+        document_paths = iter(document_source)
+        if self.journal is not None:
+            document_paths = self._unfinished_document_paths(document_paths)
+        if num_papers is not None:
+            document_paths = itertools.islice(document_paths, num_papers)
+        if self.deduplicate is not None:
+            document_paths = self._find_duplicates(document_paths)
+        if self.cost_estimator is None:
+            if isinstance(document_paths, list) and track_progress:
+                self.progress.set_total_documents(len(document_paths))
+            return None, document_paths
+        original_order = list(document_paths)
+        if track_progress:
+            self.progress.set_total_documents(len(original_order))
+        if not self._warming_cache:
+            self._predict_costs(original_order, num_workers, track_progress)
+        return original_order, self._schedule_documents(original_order)
+
+    def _predict_costs(self, document_paths, num_workers, track_progress=True):
+        self._predicted_costs = {document_path: self.cost_estimator.estimate(document_path) for document_path in document_paths}
+        if track_progress:
+            self.progress.set_predicted_costs(self._predicted_costs)
+        print_run_prediction(self.cost_estimator.predict_run(document_paths, num_workers))
+
+    def _unfinished_document_paths(self, document_paths):
+        statuses = self.journal.read_statuses()
+        output_fingerprint = self.output_fingerprint()
+        n_completed = 0
+        n_stale = 0
+        n_failed = 0
+        n_interrupted = 0
+        for document_path in document_paths:
+            status = statuses.get(document_path, {}).get("status")
+            if status == COMPLETED:
+                journalled_fingerprint = statuses[document_path].get("output_fingerprint")
+                # Papers journalled before fingerprints were kept are left alone
+                if output_fingerprint is None or journalled_fingerprint is None or self.is_output_up_to_date(journalled_fingerprint):
+                    n_completed += 1
+                    continue
+                self._journalled_fingerprints[document_path] = journalled_fingerprint
+                n_stale += 1
+            elif status in (FAILED, TIMED_OUT):
+                n_failed += 1
+                if not self.retry_failed:
+                    continue
+            elif status == STARTED:
+                n_interrupted += 1
+                self.discard_partial_output(document_path)
+            yield document_path
+        print(
+            f"Journal: skipping {n_completed} completed papers, "
+            f"checking {n_stale} papers completed with different models, "
+            f"{'retrying' if self.retry_failed else 'skipping'} {n_failed} failed papers, "
+            f"restarting {n_interrupted} interrupted papers"
+        )
+
+    def _find_duplicates(self, document_paths):
+        start_time = time.perf_counter()
+        canonical_paths, self._duplicates = find_duplicates(document_paths, self.deduplicate)
+        num_duplicates = sum(len(duplicate_paths) for duplicate_paths in self._duplicates.values())
+        print(
+            f"Found {num_duplicates} duplicate papers in {len(self._duplicates)} groups "
+            f"({self.deduplicate} hashing took {time.perf_counter() - start_time:.1f}s)"
+        )
+        return canonical_paths
+
+    def _link_duplicates(self):
+        # Gives each duplicate the output of the paper that was extracted in its
+        # place, as long as that paper was extracted successfully
+        if not self._duplicates:
+            return
+        linked = {}
+        num_not_linked = 0
+        for canonical_path, duplicate_paths in self._duplicates.items():
+            if self._document_statuses.get(canonical_path) != COMPLETED:
+                num_not_linked += len(duplicate_paths)
+                continue
+            for duplicate_path in duplicate_paths:
+                linked[duplicate_path] = canonical_path
+        self._duplicates = {}
+
+        if self._warming_cache:
+            return
+        if linked:
+            self.link_duplicate_outputs(linked)
+        if self.journal is not None:
+            # With the canonical paper's fingerprint, so that duplicates are
+            # linked again when it's next re-extracted with different models
+            journal_info = {}
+            if self.output_fingerprint() is not None:
+                journal_info["output_fingerprint"] = self.output_fingerprint()
+            for duplicate_path, canonical_path in linked.items():
+                self.journal.record(duplicate_path, COMPLETED, self.rank, duplicate_of=canonical_path, **journal_info)
+
+        saved_time = sum(self._document_timings.get(canonical_path, 0.) for canonical_path in linked.values())
+        saved_bytes = 0
+        for duplicate_path in linked:
+            try:
+                saved_bytes += os.path.getsize(duplicate_path)
+            except OSError:
+                pass
+        print(
+            f"Skipped {len(linked)} duplicate papers ({saved_bytes / 2 ** 20:.1f}MB), "
+            f"saving an estimated {saved_time:.1f}s of extraction"
+        )
+        if num_not_linked:
+            print(f"{num_not_linked} duplicates of papers that weren't extracted successfully were not given any output")
+
+    def _schedule_documents(self, document_paths):
+        if self.scheduling == "largest_first":
+            return order_largest_first(document_paths, self.cost_estimator)
+        return document_paths
+
+    def _record_document_summary(self, summary):
+        # Returns whether the document should be dispatched again
+        should_requeue = self._should_requeue(summary)
+        for name, count in summary.get("cache_stats", {}).items():
+            self._cache_stats[name] = self._cache_stats.get(name, 0) + count
+        if self.progress is not None:
+            self.progress.record(summary, will_retry=should_requeue)
+        if not should_requeue:
+            self.run_summaries.append(summary)
+        return should_requeue
+
+    def _should_requeue(self, summary):
+        document_path = summary["document_path"]
+        self._document_timings[document_path] = summary["elapsed"]
+        self._document_statuses[document_path] = summary["status"]
+        if self.cost_estimator is not None:
+            parsed_features = {name: summary[name] for name in ["num_tables", "num_paragraphs"] if summary.get(name) is not None}
+            # Only the time it took to extract a document says how long it will
+            # take next time, not the time it took to find that it was already
+            # extracted, or to fail or time out. Warming the cache takes a
+            # different amount of time to extracting too, but we can still learn
+            # the features of the documents that were parsed.
+            if summary.get("skipped"):
+                pass
+            elif self._warming_cache or summary["status"] != COMPLETED:
+                if parsed_features:
+                    self.cost_estimator.record_features(document_path, parsed_features)
+            else:
+                self.cost_estimator.record(document_path, summary["elapsed"], parsed_features)
+
+        if summary["status"] == TIMED_OUT:
+            n_timeouts = self._timeout_counts.get(document_path, 0) + 1
+            self._timeout_counts[document_path] = n_timeouts
+            if self.timeout_policy == "requeue" and n_timeouts <= self.timeout_retries:
+                print(f"Requeueing {document_path}, which timed out during {summary['stage']}")
+                return True
+            self._quarantined.append(summary)
+        return False
+
+    def _report_quarantined(self):
+        if not self._quarantined:
+            return
+        print(f"{len(self._quarantined)} papers timed out and were quarantined:")
+        for summary in self._quarantined:
+            print(f"  {summary['document_path']} (during {summary['stage']})")
+
+    def _report_scheduling(self, original_order, scheduled_order, num_workers):
+        if self.cost_estimator is None:
+            return
+        self.cost_estimator.save()
+        self._report_cost_predictions()
+        if self.scheduling is None or original_order is None:
+            return
+        summary = scheduling_summary(original_order, scheduled_order, self._document_timings, num_workers)
+        print(
+            f"Scheduling ({self.scheduling}) saved an estimated {summary['idle_time_saved']:.1f}s of worker idle time "
+            f"({summary['original_idle_time']:.1f}s -> {summary['scheduled_idle_time']:.1f}s), "
+            f"makespan {summary['original_makespan']:.1f}s -> {summary['scheduled_makespan']:.1f}s"
+        )
+        if self.use_wandb:
+            import wandb
+            wandb.log({f"scheduling/{key}": value for key, value in summary.items()})
+
+    def _report_cost_predictions(self):
+        predicted_time = 0.
+        actual_time = 0.
+        for document_path, predicted_cost in self._predicted_costs.items():
+            if document_path in self._document_timings:
+                predicted_time += predicted_cost
+                actual_time += self._document_timings[document_path]
+        self._predicted_costs = {}
+        if not actual_time or self._warming_cache:
+            return
+        print(
+            f"Predicted {predicted_time:.1f}s of extraction, took {actual_time:.1f}s "
+            f"({(predicted_time - actual_time) / actual_time:+.0%})"
+        )
 
-    def _extract_single_threaded(self, document_dir, num_papers=None):
+    def _extract_single_threaded(self, document_source, num_papers=None):
 
         all_start_time = datetime.datetime.now()
 
-        filenames = [filename for filename in os.listdir(document_dir) if filename[0] != '.' and 'records.txt' not in filename]
+        original_order, document_paths = self._document_paths(document_source, 1, num_papers)
 
-        for index, filename in enumerate(filenames):
-            if num_papers is not None and index > num_papers:
-                break
+        n_finished = 0
+        to_process = document_paths
+        while to_process:
+            requeued = []
 
-            print(f"\n\n\nPaper {index + 1}/{len(filenames)}: {filename}")
-            if self.use_wandb:
-                wandb.log({"num_papers_processed": index})
-            full_path = os.path.join(document_dir, filename)
+            def on_document_finished(summary):
+                nonlocal n_finished
+                if self._record_document_summary(summary):
+                    requeued.append(summary["document_path"])
+                    return
+                n_finished += 1
+                print(f"\n\n\nPaper {n_finished} finished: {os.path.basename(summary['document_path'])}")
 
-            self.extract_paper(full_path)
+            self._extract_papers_in_worker(to_process, on_document_finished)
+            to_process = requeued
 
         print(f"Extraction as a whole took: {datetime.datetime.now() - all_start_time}")
+        self._link_duplicates()
+        self._report_scheduling(original_order, document_paths, 1)
+        self._report_quarantined()
 
-    def _extract_mpi(self, document_dir, num_papers=None):
+    def _extract_processes(self, document_source, num_papers=None):
+        global _pool_extractor
+
+        all_start_time = datetime.datetime.now()
+
+        original_order, document_paths = self._document_paths(document_source, self.workers, num_papers)
+
+        # Fork so that the workers share everything that has already been loaded
+        # (models, taggers etc.) rather than reloading it.
+        _pool_extractor = self
+        context = multiprocessing.get_context("fork")
+        n_finished = 0
+        with self._worker_pool(context, self.workers) as pool:
+            to_dispatch = document_paths
+            while to_dispatch:
+                requeued = []
+                tasks = (self._task_for_chunk(chunk) for chunk in _chunked(to_dispatch, self.chunk_size))
+                for summaries in pool.imap_unordered(_extract_in_pool_worker, tasks):
+                    for summary in summaries:
+                        if self._record_document_summary(summary):
+                            requeued.append(summary["document_path"])
+                            continue
+                        n_finished += 1
+                        print(f"Paper {n_finished} finished: {summary['document_path']}")
+                to_dispatch = requeued
+        _pool_extractor = None
+
+        print(f"Extraction as a whole took: {datetime.datetime.now() - all_start_time}")
+        self._link_duplicates()
+        self._report_scheduling(original_order, document_paths, self.workers)
+        self._report_quarantined()
+
+    def _extract_mpi(self, document_source, num_papers=None):
         from mpi4py import MPI
 
         if self.is_main_thread:
             all_start_time = datetime.datetime.now()
-            index = 0
             n_finished = 0
-            filenames = [filename for filename in os.listdir(document_dir) if filename[0] != '.' and 'records.txt' not in filename]
-            num_papers = len(filenames) if num_papers is None else num_papers
+            num_workers = self.size if self.master_does_work else self.size - 1
+            original_order, document_paths = self._document_paths(document_source, num_workers * self.workers_per_rank, num_papers)
+            dispatcher = ChunkDispatcher(
+                document_paths,
+                num_workers=num_workers,
+                chunk_size=self.chunk_size,
+                min_chunk_size=self.workers_per_rank,
+            )
+            self._pending_sends = []
+            chunks_in_flight = 0
 
-            while True:
+            # Each worker gets one chunk to work on, plus prefetch_chunks more that
+            # it keeps in its local queue, so it never has to wait for the master
+            # before starting its next document.
+            for _ in range(1 + self.prefetch_chunks):
+                for i in range(1, self.size):
+                    if self._send_chunk_to_worker(i, dispatcher):
+                        chunks_in_flight += 1
+
+            while chunks_in_flight or (self.master_does_work and dispatcher.has_work()):
                 status = MPI.Status()
-                if index == 0:
-                    for i in range(1, self.size):
-                        filename = filenames[index]
-                        full_path = os.path.join(document_dir, filename)
-                        self._send_to_worker(i, full_path)
-                        index += 1
-                else:
-                    _ = self.comm.recv(
-                        source=MPI.ANY_SOURCE,
-                        tag=MPI.ANY_TAG,
-                        status=status
-                    )
-                    finished_worker_index = status.Get_source()
-                    n_finished += 1
-                    if self.use_wandb:
-                        wandb.log({"num_papers_processed": n_finished})
+                if self.master_does_work and dispatcher.has_work():
+                    # Only block on the workers once there's nothing left for the
+                    # master to do itself; otherwise just check for finished
+                    # workers between documents. Workers have chunks queued up
+                    # locally, so they don't sit idle while the master is busy.
+                    if not self.comm.Iprobe(source=MPI.ANY_SOURCE, tag=RETURNING_DATA_TAG, status=status):
+                        document_path = dispatcher.next_chunk(max_size=1)[0]
+                        if self._record_document_summary(self._extract_papers_in_worker([document_path])[0]):
+                            dispatcher.requeue([document_path])
+                        else:
+                            n_finished += 1
+                        continue
 
-                    if n_finished == index and index >= num_papers:
-                        break
-                    elif index < num_papers:
-                        print(index, num_papers)
-                        filename = filenames[index]
-                        full_path = os.path.join(document_dir, filename)
-                        self._send_to_worker(finished_worker_index, full_path)
-                        index += 1
+                results = self.comm.recv(
+                    source=MPI.ANY_SOURCE,
+                    tag=RETURNING_DATA_TAG,
+                    status=status
+                )
+                finished_worker_index = status.Get_source()
+                chunks_in_flight -= 1
+                for summary in results:
+                    if self._record_document_summary(summary):
+                        dispatcher.requeue([summary["document_path"]])
+                    else:
+                        n_finished += 1
+                total_papers = dispatcher.total_documents()
+                print(f"Finished {n_finished}/{'?' if total_papers is None else total_papers} papers")
+                if total_papers is not None:
+                    self.progress.set_total_documents(total_papers)
+
+                if self._send_chunk_to_worker(finished_worker_index, dispatcher):
+                    chunks_in_flight += 1
+
+            MPI.Request.waitall(self._pending_sends)
             for i in range(1, self.size):
                 self._exit_worker(i)
             print(f"Extraction as a whole took: {datetime.datetime.now() - all_start_time}")
+            print(f"Dispatched {dispatcher.num_chunks_sent} chunks for {dispatcher.num_documents_seen} papers")
+            self._link_duplicates()
+            self._report_scheduling(original_order, document_paths, num_workers)
+            self._report_quarantined()
 
         else:
             self._start_worker()
 
-    def _send_to_worker(self, worker_index, document_path):
+    def _extract_file_queue(self, document_source, num_papers=None):
+        all_start_time = datetime.datetime.now()
+
+        def populate():
+            # Each task is a chunk of papers, along with their duplicates so that
+            # whoever extracts them can link them
+            _, document_paths = self._document_paths(document_source, None, num_papers, track_progress=False)
+            duplicates = self._duplicates
+            self._duplicates = {}
+            for chunk in _chunked(document_paths, self.chunk_size):
+                yield {
+                    **self._task_for_chunk(chunk),
+                    "duplicates": {document_path: duplicates[document_path] for document_path in chunk if document_path in duplicates},
+                }
+
+        if self.work_queue.join(populate):
+            print(f"Populated the work queue in {self.work_queue.queue_dir}: {self.work_queue.status()}")
+
+        n_finished = 0
+        node_pool = self._start_node_pool()
+        try:
+            while True:
+                claimed = self.work_queue.claim()
+                if claimed is None:
+                    if self.work_queue.is_finished():
+                        break
+                    num_reclaimed = self.work_queue.reclaim_expired()
+                    if num_reclaimed:
+                        print(f"Reclaimed {num_reclaimed} chunks whose leases had expired")
+                    else:
+                        # Wait for the other processes' chunks, in case their leases expire
+                        time.sleep(self.work_queue.poll_interval)
+                    continue
+
+                task_name, task = claimed
+                document_paths = self._start_task(task)
+                # So that papers requeued after timing out aren't retried forever
+                self._timeout_counts.update(task.get("timeout_counts", {}))
+                if node_pool is not None:
+                    summaries = self._extract_papers_in_node_pool(node_pool, document_paths)
+                else:
+                    summaries = self._extract_papers_in_worker(document_paths)
+
+                requeued = []
+                for summary in summaries:
+                    if self._record_document_summary(summary):
+                        requeued.append(summary["document_path"])
+                    else:
+                        n_finished += 1
+                # Requeued before the chunk is completed, so the queue never looks finished in between
+                duplicates = task.get("duplicates", {})
+                if requeued:
+                    # Along with the rest of the task, e.g. the requeued papers'
+                    # duplicates, so that they're linked once the papers are done.
+                    # The new task's lease hasn't expired yet, though.
+                    requeued_task = {key: value for key, value in task.items() if key != "num_reclaims"}
+                    requeued_task.update({
+                        "document_paths": requeued,
+                        "duplicates": {document_path: duplicates[document_path] for document_path in requeued if document_path in duplicates},
+                        "timeout_counts": {document_path: self._timeout_counts[document_path] for document_path in requeued},
+                    })
+                    self.work_queue.add(requeued_task)
+                self._duplicates = {document_path: duplicate_paths for document_path, duplicate_paths in duplicates.items() if document_path not in requeued}
+                self._link_duplicates()
+                self.work_queue.complete(task_name)
+                print(f"Finished {n_finished} papers in this process, queue: {self.work_queue.status()}")
+        finally:
+            if node_pool is not None:
+                node_pool.close()
+                node_pool.join()
+            self.work_queue.close()
+
+        print(f"Extraction as a whole took: {datetime.datetime.now() - all_start_time}")
+        print(
+            f"Work queue: this process completed {self.work_queue.num_completed} of the "
+            f"{self.work_queue.num_claimed} chunks it claimed, and reclaimed {self.work_queue.num_reclaimed}"
+        )
+        self._report_scheduling(None, None, None)
+        self._report_quarantined()
+
+    def _send_chunk_to_worker(self, worker_index, dispatcher):
+        if not dispatcher.has_work():
+            return False
+        self._send_to_worker(worker_index, dispatcher.next_chunk())
+        return True
+
+    def _send_to_worker(self, worker_index, document_paths):
         data = {
             "exit": False,
-            "document_path": document_path
+            **self._task_for_chunk(document_paths),
         }
-        self.comm.send(data, dest=worker_index, tag=AWAITING_DATA_TAG)
+        # Non-blocking, as the worker may be busy with a document and only pick
+        # this up once it next checks for new work.
+        self._pending_sends = [request for request in self._pending_sends if not request.Test()]
+        self._pending_sends.append(self.comm.isend(data, dest=worker_index, tag=AWAITING_DATA_TAG))
 
     def _exit_worker(self, worker_index):
         data = {"exit": True}
         self.comm.send(data, dest=worker_index, tag=AWAITING_DATA_TAG)
 
-    def _start_worker(self):
+    def _task_for_chunk(self, document_paths):
+        # What's sent to whoever extracts a chunk of papers
+        return {
+            "document_paths": document_paths,
+            "journalled_fingerprints": {
+                document_path: self._journalled_fingerprints[document_path]
+                for document_path in document_paths if document_path in self._journalled_fingerprints
+            },
+        }
+
+    def _start_task(self, task):
+        # Returns the paths of the papers to extract for a task from _task_for_chunk
+        self._journalled_fingerprints.update(task.get("journalled_fingerprints", {}))
+        return task["document_paths"]
+
+    def _receive_pending_chunks(self, local_queue):
+        while self.comm.Iprobe(source=0, tag=AWAITING_DATA_TAG):
+            local_queue.append(self.comm.recv(source=0, tag=AWAITING_DATA_TAG))
+
+    def _start_document_summary(self, document_path, rank=None):
+        # rank is that of the worker the document was extracted by, if that's
+        # not this process
+        if rank is None:
+            rank = self.rank
+        if self.journal is not None:
+            self.journal.record(document_path, STARTED, rank)
+        try:
+            size_bytes = os.path.getsize(document_path)
+        except OSError:
+            size_bytes = None
+        return {
+            "document_path": document_path,
+            "status": COMPLETED,
+            "stage": None,
+            "rank": rank,
+            "size_bytes": size_bytes,
+            "used_cache": False,
+            "num_records": 0,
+            "stages": {},
+            "start_time": time.time(),
+        }
+
+    def _mark_document_timed_out(self, summary, stage):
+        print(f"TIMED OUT FOR {summary['document_path']} DURING {stage}")
+        summary["status"] = TIMED_OUT
+        summary["stage"] = stage
+        summary["error_type"] = DocumentTimeout.__name__
+        writer = self._background_writer()
+        if writer is not None:
+            # Don't let anything already submitted for the document be written after we've discarded it
+            writer.flush()
+        self.discard_partial_output(summary["document_path"])
+
+    def _mark_document_failed(self, summary, stage, e):
+        print(f"EXITED FOR {summary['document_path']} DUE TO: {e}")
+        summary["status"] = FAILED
+        summary["stage"] = stage
+        summary["error"] = f"{type(e).__name__}: {e}"
+        summary["error_type"] = type(e).__name__
+
+    def _finish_document_summary(self, summary, elapsed):
+        summary["elapsed"] = elapsed
+        summary["end_time"] = time.time()
+        if self.document_cache is not None:
+            summary["cache_stats"] = self._take_cache_stats()
+        if self.metrics_writer is not None:
+            self.metrics_writer.write(summary)
+        if self.journal is not None:
+            journal_info = {key: value for key, value in summary.items() if key not in ["document_path", "status", "rank"]}
+            if summary["status"] == COMPLETED and self.output_fingerprint() is not None:
+                journal_info["output_fingerprint"] = self.output_fingerprint()
+            self.journal.record(summary["document_path"], summary["status"], summary["rank"], **journal_info)
+        return summary
+
+    def _take_cache_stats(self):
+        # How much the cache counters of this process have changed since it last
+        # finished a document. Cache writes are finished before the document is,
+        # so every count ends up in some document's summary.
+        stats = self.document_cache.stats()
+        last_stats = self._reported_cache_stats
+        self._reported_cache_stats = stats
+        return {name: count - last_stats.get(name, 0) for name, count in stats.items()}
+
+    def document_name(self, document_path):
+        # The name the document's outputs are saved under
+        return document_name(document_path, self.document_names_dir)
+
+    def _profile_document(self, document_path, summary):
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.profile(document_path, summary, self.document_names_dir)
+
+    def _extract_paper_in_worker(self, document_path):
+        start_time = time.perf_counter()
+        summary = self._start_document_summary(document_path)
+        with self.stage_timer.document(summary):
+            try:
+                with self._profile_document(document_path, summary), time_limit(self.document_timeout):
+                    self.extract_paper(document_path)
+            except DocumentTimeout:
+                self._mark_document_timed_out(summary, self.stage_timer.current_stage())
+            except Exception as e:
+                self._mark_document_failed(summary, self.stage_timer.current_stage(), e)
+        self._document_done(summary, time.perf_counter() - start_time)
+
+    def _document_done(self, summary, elapsed):
+        # The summary is only finished off (journalled, written to the metrics and
+        # reported back) once everything written for the document is durable.
+        summary["rss_bytes"] = rss_bytes()
+        summary["peak_rss_bytes"] = peak_rss_bytes()
+        self.memory_tracker.record(summary["rss_bytes"])
+        writer = self._background_writer()
+        if writer is None:
+            self._finished_documents.put(self._finish_document_summary(summary, elapsed))
+        else:
+            writer.submit(on_done=lambda: self._finished_documents.put(self._finish_document_summary(summary, elapsed)))
+
+    def _collect_finished_documents(self, summaries, on_document_finished=None):
         while True:
-            data = self.comm.recv(source=0, tag=AWAITING_DATA_TAG)
-            if data["exit"]:
-                break
+            try:
+                summary = self._finished_documents.get_nowait()
+            except queue.Empty:
+                return
+            summaries.append(summary)
+            if on_document_finished is not None:
+                on_document_finished(summary)
+
+    def _wait_for_finished_documents(self, summaries, on_document_finished=None):
+        # At the end of a chunk, for its writes to be durable (see write_behind)
+        writer = self._background_writer()
+        if writer is not None:
+            writer.flush()
+        self._collect_finished_documents(summaries, on_document_finished)
+
+    def _extract_papers_in_worker(self, document_paths, on_document_finished=None):
+        if self.pipeline_depth:
+            return DocumentPipeline(self, self.pipeline_depth).run(document_paths, on_document_finished)
+        if self.batch_tagger is not None:
+            return BatchTaggedExtraction(self, self.batch_tagger, self.tagging_batch_documents).run(
+                document_paths,
+                on_document_finished
+            )
+
+        summaries = []
+        for document_path in document_paths:
+            self._extract_paper_in_worker(document_path)
+            self._collect_finished_documents(summaries, on_document_finished)
+        self._wait_for_finished_documents(summaries, on_document_finished)
+        return summaries
+
+    def _start_worker(self):
+        local_queue = deque()
+        node_pool = self._start_node_pool()
+        try:
+            if node_pool is not None:
+                self._extract_chunks_in_node_pool(node_pool, local_queue)
             else:
-                document_path = data["document_path"]
-                try:
-                    result = self.extract_paper(document_path)
-                    self.comm.send(result, dest=0, tag=RETURNING_DATA_TAG)
-                except Exception as e:
-                    print(f"EXITED FOR {document_path} DUE TO: {e}")
+                while True:
+                    if not local_queue:
+                        local_queue.append(self.comm.recv(source=0, tag=AWAITING_DATA_TAG))
+                    data = local_queue.popleft()
+                    if data["exit"]:
+                        break
+                    results = self._extract_papers_in_worker(
+                        self._start_task(data),
+                        on_document_finished=lambda summary: self._receive_pending_chunks(local_queue)
+                    )
+                    self.comm.send(results, dest=0, tag=RETURNING_DATA_TAG)
+        finally:
+            if node_pool is not None:
+                node_pool.close()
+                node_pool.join()
+        self._finish_writing()
+
+    def _start_node_pool(self):
+        # Forked from this rank after it has loaded its models, so that the
+        # workers share them copy-on-write rather than each loading their own.
+        global _pool_extractor
+        if not self._uses_node_pool():
+            return None
+        _pool_extractor = self
+        context = multiprocessing.get_context("fork")
+        return self._worker_pool(context, self.workers_per_rank, self.rank)
+
+    def _worker_pool(self, context, num_workers, parent_rank=None):
+        return RecyclingPool(
+            context,
+            num_workers,
+            initializer=_init_pool_worker,
+            initargs=(parent_rank,),
+            should_recycle=_pool_worker_recycle_reason,
+            finalizer=_finish_pool_worker,
+            on_lost_task=functools.partial(_lost_pool_task, parent_rank),
+        )
+
+    def _recycles_workers(self):
+        return self.max_worker_rss_bytes is not None or self.max_documents_per_worker is not None
+
+    def _uses_node_pool(self):
+        return self.workers_per_rank > 1 or self._recycles_workers()
+
+    def _recycle_reason(self, summaries):
+        # Called by forked workers after each chunk. The reason is also added to
+        # the worker's last summary, for the run report.
+        reason = None
+        current_rss = rss_bytes()
+        if self.max_worker_rss_bytes is not None and current_rss is not None and current_rss > self.max_worker_rss_bytes:
+            reason = "memory"
+        elif self.max_documents_per_worker is not None and self.memory_tracker.num_documents >= self.max_documents_per_worker:
+            reason = "documents"
+        if reason is not None and summaries:
+            summaries[-1]["worker_recycled"] = reason
+        return reason
+
+    def _finish_worker(self, reason):
+        self._finish_writing()
+        tracker = self.memory_tracker
+        memory = ""
+        if tracker.peak_rss_bytes is not None:
+            memory = f", peak RSS {tracker.peak_rss_bytes / 2 ** 20:.0f}MB, mean RSS {tracker.mean_rss_bytes() / 2 ** 20:.0f}MB"
+        print(f"Worker {self.rank} exiting ({reason}) after {tracker.num_documents} papers{memory}")
+
+    def _lost_document_summaries(self, document_paths, exitcode, finished_summaries, rank):
+        # For the documents a forked worker was working on when it died, e.g.
+        # because the OOM killer got it before it could be recycled. Those it had
+        # already finished are kept, and the output of the others is discarded,
+        # as it may be incomplete.
+        summaries = list(finished_summaries)
+        finished_paths = {summary["document_path"] for summary in summaries}
+        for document_path in document_paths:
+            if document_path in finished_paths:
+                continue
+            summary = self._start_document_summary(document_path, rank)
+            self._mark_document_failed(summary, None, WorkerLost(f"Worker {rank} exited with code {exitcode}"))
+            self.discard_partial_output(document_path)
+            summaries.append(self._finish_document_summary(summary, 0.))
+        return summaries
+
+    def _extract_papers_in_node_pool(self, node_pool, document_paths):
+        results = []
+        for summaries in node_pool.imap_unordered(_extract_in_pool_worker, (self._task_for_chunk([document_path]) for document_path in document_paths)):
+            results.extend(summaries)
+        return results
+
+    def _extract_chunks_in_node_pool(self, node_pool, local_queue):
+        # Each paper is a task of its own, and the next chunk's papers are
+        # submitted as soon as the pool has none left waiting, so the workers
+        # don't sit idle at the end of a chunk while the slowest of its papers
+        # finishes. A chunk's summaries are sent back once all of its papers are
+        # done, in case several chunks are in flight.
+        chunks = {}
+        chunk_ids = defaultdict(deque)
+        next_chunk_id = 0
+        is_exiting = False
+        while True:
+            self._receive_pending_chunks(local_queue)
+            while not is_exiting and node_pool.num_pending() == 0 and (local_queue or node_pool.num_unfinished() == 0):
+                if not local_queue:
+                    local_queue.append(self.comm.recv(source=0, tag=AWAITING_DATA_TAG))
+                data = local_queue.popleft()
+                if data["exit"]:
+                    is_exiting = True
+                    break
+                document_paths = self._start_task(data)
+                if not document_paths:
                     self.comm.send([], dest=0, tag=RETURNING_DATA_TAG)
-                    # break
+                    continue
+                chunks[next_chunk_id] = (len(document_paths), [])
+                for document_path in document_paths:
+                    chunk_ids[document_path].append(next_chunk_id)
+                    node_pool.submit(_extract_in_pool_worker, self._task_for_chunk([document_path]))
+                next_chunk_id += 1
+
+            if node_pool.num_unfinished() == 0:
+                return
+            for summaries in node_pool.collect():
+                for summary in summaries:
+                    chunk_id = chunk_ids[summary["document_path"]].popleft()
+                    num_documents, chunk_summaries = chunks[chunk_id]
+                    chunk_summaries.append(summary)
+                    if len(chunk_summaries) == num_documents:
+                        del chunks[chunk_id]
+                        self.comm.send(chunk_summaries, dest=0, tag=RETURNING_DATA_TAG)
+
+    def _load_models(self):
+        if self.model_loader is None or self.model_load_seconds is not None:
+            return
+        start_time = time.perf_counter()
+        self.model_loader()
+        self.model_load_seconds = time.perf_counter() - start_time
+        print(f"Loading models on rank {self.rank} took {self.model_load_seconds:.1f}s")
+
+    def _report_worker_ready(self, startup_seconds, forked=False):
+        # Forked workers report the time since they were forked, and other
+        # workers the time since their process started, including loading models.
+        worker_info = {
+            "rank": self.rank,
+            "pid": os.getpid(),
+            "forked": forked,
+            "startup_seconds": startup_seconds,
+            "model_load_seconds": self.model_load_seconds,
+            **memory_usage(),
+        }
+        startup = "?" if startup_seconds is None else f"{startup_seconds:.1f}s"
+        memory = f"{worker_info['peak_rss_bytes'] / 2 ** 20:.0f}MB peak resident"
+        if worker_info.get("private_bytes") is not None:
+            memory += f", {worker_info['private_bytes'] / 2 ** 20:.0f}MB private"
+        print(f"Worker {self.rank} ready after {startup} ({memory})")
+        if self.metrics_writer is not None:
+            self.metrics_writer.write_worker(worker_info)
+
+    def _prepare_to_extract(self):
+        is_mpi_master = self.use_mpi and self.size > 1 and self.is_main_thread
+        # The MPI master only needs models if it's also extracting
+        if is_mpi_master and not self.master_does_work:
+            return
+        self._load_models()
+
+        # Workers forked from here report when they're ready themselves
+        forks_from_rank = self._uses_node_pool() and (self.backend == "file_queue" or (not is_mpi_master and self.size > 1))
+        if self.backend == "processes" or forks_from_rank:
+            return
+        start_time = process_start_time()
+        self._report_worker_ready(None if start_time is None else time.time() - start_time)
+
+    def extract(
+        self,
+        document_dir=None,
+        num_papers=None,
+        manifest=None,
+        recursive=False,
+        include=None,
+        exclude=None,
+    ):
+        # Documents are either listed from document_dir (recursively if asked to),
+        # or read from a manifest file with one path per line. include and exclude
+        # are lists of glob patterns to match filenames against.
+        document_source = DocumentSource(
+            document_dir=document_dir,
+            manifest=manifest,
+            recursive=recursive,
+            include=include,
+            exclude=exclude,
+        )
+        # Every rank and worker calls extract, or is forked after it's called
+        self.document_names_dir = document_source.names_dir()
 
-    def extract(self, document_dir, num_papers=None):
         if not self.use_mpi or self.is_main_thread:
             self.will_start_extraction()
+            self.progress = ProgressAggregator(self._progress_sinks(), self.progress_interval)
+            self.run_summaries = []
+            self._cache_stats = {}
+        self._prepare_to_extract()
 
-        if not self.use_mpi or self.size == 1:
-            self._extract_single_threaded(document_dir, num_papers)
+        if self.backend == "processes":
+            self._extract_processes(document_source, num_papers)
+        elif self.backend == "file_queue":
+            self._extract_file_queue(document_source, num_papers)
+        elif not self.use_mpi or self.size == 1:
+            self._extract_single_threaded(document_source, num_papers)
         else:
-            self._extract_mpi(document_dir, num_papers)
+            self._extract_mpi(document_source, num_papers)
+        self._finish_writing()
+        if self.progress is not None:
+            self.progress.close()
+            self.progress = None
+            self._report_run_summary()
+        self._report_cache_stats()
+        self._report_batch_tagging()
+
+    def _report_run_summary(self):
+        if not self.run_summaries:
+            return
+        report = build_run_report(self.run_summaries)
+        print("\nRun summary:")
+        print_run_report(report)
+        if self.run_summary_path is not None:
+            with open(self.run_summary_path, "w") as f:
+                json.dump(report, f, indent=2)
+
+    def _progress_sinks(self):
+        sinks = []
+        if self.use_wandb:
+            sinks.append(WandbProgressSink())
+        if self.progress_path is not None:
+            sinks.append(JsonlProgressSink(self.progress_path))
+        return sinks
+
+    def warm_cache(
+        self,
+        document_dir=None,
+        num_papers=None,
+        manifest=None,
+        recursive=False,
+        include=None,
+        exclude=None,
+    ):
+        # Only loads and tags the documents, and stores them in the cache, across
+        # all the workers as in extract. Later runs, e.g. with different parsers or
+        # models, can then hydrate every document from the cache. Documents that
+        # are already cached are skipped, and the journal isn't used, as nothing
+        # is extracted.
+        if self.document_cache is None:
+            raise ValueError("warm_cache needs the extractor to have a cache_dir")
+
+        journal = self.journal
+        self.journal = None
+        self._warming_cache = True
+        try:
+            self.extract(
+                document_dir=document_dir,
+                num_papers=num_papers,
+                manifest=manifest,
+                recursive=recursive,
+                include=include,
+                exclude=exclude,
+            )
+        finally:
+            self._warming_cache = False
+            self.journal = journal
+
+    def _report_batch_tagging(self):
+        if self.batch_tagger is None or not self.batch_tagger.batch_sizes:
+            return
+        stats = self.batch_tagger.stats()
+        print(
+            f"Batch tagging on rank {self.rank}: {stats['num_sentences']} sentences in {stats['num_batches']} batches "
+            f"(mean size {stats['mean_batch_size']:.1f}, max {stats['max_batch_size']}), "
+            f"{stats['sentences_per_second'] or 0:.1f} sentences/s"
+        )
+
+    def _report_cache_stats(self):
+        # Only where the summaries were recorded, so the counts are those of all
+        # the workers the summaries came from
+        if self.document_cache is None or not self._cache_stats:
+            return
+        stats = self._cache_stats
+        print(
+            f"Document cache on rank {self.rank}: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['writes']} written, {stats['evictions']} evicted"
+        )
@@ -0,0 +1,214 @@
+import time
+
+from e2e_workflow.extraction.watchdog import DocumentTimeout, time_limit
+
+
+def _batch_tagger_for(sentence, tag_type):
+    # The tagger CDE would use for this tag type (see Sentence._assign_tags), if
+    # it can tag in batches
+    for tagger in reversed(sentence.taggers):
+        if tagger.can_tag(tag_type):
+            if hasattr(tagger, "batch_tag_for_type") and tagger.can_batch_tag(tag_type):
+                return tagger
+            if not hasattr(tagger, "tag_for_type") and hasattr(tagger, "batch_tag"):
+                return tagger
+            return None
+    return None
+
+
+def _batchable_tag_types(sentence):
+    tag_types = []
+    for tagger in sentence.taggers:
+        # Ensemble taggers can tag for each of the taggers they're made up of
+        for tag_type in getattr(tagger, "taggers_dict", {tagger.tag_type: tagger}).keys():
+            if tag_type not in tag_types and _batch_tagger_for(sentence, tag_type) is not None:
+                tag_types.append(tag_type)
+    return tag_types
+
+
+# Tags the sentences of several documents together, in batches of up to
+# batch_size sentences, for the taggers that can tag in batches (e.g. the
+# AllenNLP and BERT taggers). Other tags are left to be tagged lazily as usual.
+#
+# By default, every tag type that a batch tagger can tag is tagged. Pass
+# tag_types to only tag some of them, e.g. if some are never used.
+class BatchTagger:
+    def __init__(self, batch_size, tag_types=None):
+        self.batch_size = max(batch_size, 1)
+        self.tag_types = tag_types
+        self.batch_sizes = []
+        self.num_sentences = 0
+        self.tagging_time = 0.
+
+    def tag(self, docs):
+        # Returns, for each document, how many sentences were tagged, the mean
+        # size of the batches they were tagged in, and its share of the time
+        sentences_by_tagger = {}
+        for doc_index, doc in enumerate(docs):
+            for sentence in doc.sentences:
+                tokens = sentence.tokens
+                if not tokens or not hasattr(tokens[0], "_tags"):
+                    continue
+                tag_types = self.tag_types if self.tag_types is not None else _batchable_tag_types(sentence)
+                for tag_type in tag_types:
+                    if tag_type in tokens[0]._tags:
+                        continue
+                    tagger = _batch_tagger_for(sentence, tag_type)
+                    if tagger is None:
+                        continue
+                    key = (id(tagger), tag_type)
+                    if key not in sentences_by_tagger:
+                        sentences_by_tagger[key] = (tagger, tag_type, [])
+                    sentences_by_tagger[key][2].append((doc_index, tokens))
+
+        num_sentences = [0] * len(docs)
+        total_batch_size = [0] * len(docs)
+        tagging_time = [0.] * len(docs)
+        for tagger, tag_type, sentences in sentences_by_tagger.values():
+            for batch_start in range(0, len(sentences), self.batch_size):
+                batch = sentences[batch_start:batch_start + self.batch_size]
+                start_time = time.perf_counter()
+                self._tag_batch(tagger, tag_type, [tokens for _, tokens in batch])
+                elapsed = time.perf_counter() - start_time
+
+                self.batch_sizes.append(len(batch))
+                self.num_sentences += len(batch)
+                self.tagging_time += elapsed
+                for doc_index, _ in batch:
+                    num_sentences[doc_index] += 1
+                    total_batch_size[doc_index] += len(batch)
+                    tagging_time[doc_index] += elapsed / len(batch)
+
+        return [
+            {
+                "num_sentences": num_sentences[doc_index],
+                "mean_batch_size": total_batch_size[doc_index] / num_sentences[doc_index] if num_sentences[doc_index] else None,
+                "tagging_time": tagging_time[doc_index],
+            }
+            for doc_index in range(len(docs))
+        ]
+
+    def _tag_batch(self, tagger, tag_type, batch):
+        if hasattr(tagger, "batch_tag_for_type") and tagger.can_batch_tag(tag_type):
+            tag_results = tagger.batch_tag_for_type(batch, tag_type)
+        else:
+            tag_results = tagger.batch_tag(batch)
+        for tag_result in tag_results:
+            for token, tag in tag_result:
+                token._tags[tag_type] = tag
+
+    def stats(self):
+        return {
+            "num_batches": len(self.batch_sizes),
+            "num_sentences": self.num_sentences,
+            "mean_batch_size": self.num_sentences / len(self.batch_sizes) if self.batch_sizes else None,
+            "max_batch_size": max(self.batch_sizes) if self.batch_sizes else None,
+            "sentences_per_second": self.num_sentences / self.tagging_time if self.tagging_time else None,
+        }
+
+
+class _InFlightDocument:
+    def __init__(self, summary):
+        self.summary = summary
+        self.doc = None
+        self.cache_key = None
+        self.elapsed = 0.
+
+
+# Runs extract_paper for a list of documents, loading up to max_documents at a
+# time (or until there are enough sentences for a full batch), tagging them all
+# together with a BatchTagger, and then extracting their records one by one.
+#
+# Tagging a group of documents can take up to document_timeout for each of them,
+# after which every document in the group times out.
+class BatchTaggedExtraction:
+    def __init__(self, extractor, batch_tagger, max_documents):
+        self.extractor = extractor
+        self.batch_tagger = batch_tagger
+        self.max_documents = max(max_documents, 1)
+
+    def run(self, document_paths, on_document_finished=None):
+        summaries = []
+        document_paths = iter(document_paths)
+        while True:
+            in_flight, is_exhausted = self._load_documents(document_paths)
+            if in_flight:
+                self._tag_documents(in_flight)
+                for item in in_flight:
+                    if item.doc is not None:
+                        self._extract_document(item)
+            self.extractor._collect_finished_documents(summaries, on_document_finished)
+            if is_exhausted:
+                break
+        self.extractor._wait_for_finished_documents(summaries, on_document_finished)
+        return summaries
+
+    def _load_documents(self, document_paths):
+        # Returns the loaded documents, and whether there are any more to load
+        in_flight = []
+        num_sentences = 0
+        for document_path in document_paths:
+            item = _InFlightDocument(self.extractor._start_document_summary(document_path))
+            start_time = time.perf_counter()
+            with self.extractor.stage_timer.document(item.summary):
+                try:
+                    with time_limit(self.extractor.document_timeout):
+                        loaded = self.extractor._load_document(document_path)
+                    if loaded is not None:
+                        item.doc, item.cache_key = loaded
+                except DocumentTimeout:
+                    self.extractor._mark_document_timed_out(item.summary, self.extractor.stage_timer.current_stage())
+                except Exception as e:
+                    self.extractor._mark_document_failed(item.summary, self.extractor.stage_timer.current_stage(), e)
+            item.elapsed += time.perf_counter() - start_time
+
+            if item.doc is None:
+                self.extractor._document_done(item.summary, item.elapsed)
+                continue
+            in_flight.append(item)
+            num_sentences += len(item.doc.sentences)
+            if num_sentences >= self.batch_tagger.batch_size or len(in_flight) >= self.max_documents:
+                return in_flight, False
+        return in_flight, True
+
+    def _tag_documents(self, in_flight):
+        document_timeout = self.extractor.document_timeout
+        start_time = time.perf_counter()
+        try:
+            with time_limit(None if document_timeout is None else document_timeout * len(in_flight)):
+                tagging_info = self.batch_tagger.tag([item.doc for item in in_flight])
+        except DocumentTimeout:
+            elapsed = time.perf_counter() - start_time
+            for item in in_flight:
+                self.extractor._mark_document_timed_out(item.summary, "tag")
+                item.elapsed += elapsed / len(in_flight)
+                item.doc = None
+                self.extractor._document_done(item.summary, item.elapsed)
+            return
+        except Exception as e:
+            # Anything that wasn't tagged will be tagged lazily during extraction
+            print(f"BATCH TAGGING FAILED DUE TO: {e}")
+            return
+
+        for item, info in zip(in_flight, tagging_info):
+            stages = item.summary.setdefault("stages", {})
+            stages["tag"] = stages.get("tag", 0.) + info["tagging_time"]
+            item.summary["tagged_sentences"] = info["num_sentences"]
+            item.summary["tag_batch_size"] = info["mean_batch_size"]
+            item.elapsed += info["tagging_time"]
+
+    def _extract_document(self, item):
+        document_path = item.summary["document_path"]
+        start_time = time.perf_counter()
+        with self.extractor.stage_timer.document(item.summary):
+            try:
+                with self.extractor._profile_document(document_path, item.summary), time_limit(self.extractor.document_timeout):
+                    records = self.extractor._extract_document_records(item.doc, document_path)
+                    self.extractor._save_document(item.doc, records, document_path, item.cache_key)
+            except DocumentTimeout:
+                self.extractor._mark_document_timed_out(item.summary, self.extractor.stage_timer.current_stage())
+            except Exception as e:
+                self.extractor._mark_document_failed(item.summary, self.extractor.stage_timer.current_stage(), e)
+        item.elapsed += time.perf_counter() - start_time
+        print(f"{document_path} took: {item.elapsed:.3f}s of work (batch tagged)")
+        self.extractor._document_done(item.summary, item.elapsed)
@@ -0,0 +1,473 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+from e2e_workflow.extraction.run_report import build_run_report, load_metrics, load_worker_metrics
+
+# Runs extraction over a synthetic corpus in each of a set of configurations
+# and writes the results (papers per second, time per stage, worker idle time
+# and peak memory) to a JSON file, which compare can diff against the results
+# from another commit:
+#
+#   python -m e2e_workflow.extraction.benchmark run --modes single,processes,mpi --output after.json
+#   python -m e2e_workflow.extraction.benchmark compare before.json after.json
+#
+# Each configuration runs in its own processes (under mpirun for mpi), and the
+# results are built from the metrics they write, so every mode is measured the
+# same way. Only the stub model can run without CDE's models downloaded.
+#
+# The imports subcommand times importing each entry point in a fresh process,
+# and fails if that takes longer than --max-seconds or loads any of the
+# optional dependencies, which should only be imported by the features that use them:
+#
+#   python -m e2e_workflow.extraction.benchmark imports --max-seconds 5
+BENCHMARK_MODES = ["single", "processes", "file_queue", "mpi"]
+LENGTH_DISTRIBUTIONS = ["fixed", "uniform", "lognormal"]
+# Starts with a dot so that it isn't listed as a document
+CORPUS_INFO_FILE_NAME = ".corpus.json"
+LOGNORMAL_SIGMA = 0.8
+IMPORT_ENTRY_POINTS = [
+    "e2e_workflow.extraction.extractor",
+    "e2e_workflow.extraction.run_report",
+    "e2e_workflow.extraction.scheduling",
+    "e2e_workflow.evaluation.compare_databases",
+]
+LAZY_MODULES = ["wandb", "mpi4py", "photocatalyst_models", "bert_paper"]
+
+_COMPOUNDS = [
+    "TiO2", "ZnO", "CdS", "g-C3N4", "BiVO4", "WO3", "SrTiO3", "Fe2O3",
+    "2,4-dinitrotoluene", "benzoic acid", "naphthalene", "acetanilide",
+]
+_SENTENCES = [
+    "The melting point of {compound} was found to be {value} °C.",
+    "{compound} (m.p. {value}–{value2} °C) was prepared as described previously.",
+    "The samples were annealed at {value} °C for {number} h under nitrogen.",
+    "A {number} mg portion of {compound} was dispersed in {number} mL of water.",
+    "The hydrogen evolution rate of {compound} reached {number} μmol h−1 g−1.",
+    "XRD patterns of {compound} show peaks that can be indexed to the anatase phase.",
+    "The band gap of {compound} was estimated to be {decimal} eV from the Tauc plot.",
+    "All reagents were of analytical grade and used without further purification.",
+]
+
+
+def _sentence(rng):
+    value = rng.randint(40, 400)
+    return rng.choice(_SENTENCES).format(
+        compound=rng.choice(_COMPOUNDS),
+        value=value,
+        value2=value + rng.randint(1, 5),
+        number=rng.randint(1, 500),
+        decimal=round(rng.uniform(1.5, 3.5), 2),
+    )
+
+
+def _table(rng):
+    rows = "".join(
+        f"<tr><td>{rng.choice(_COMPOUNDS)}</td><td>{rng.randint(40, 400)}</td><td>{rng.randint(1, 500)}</td></tr>"
+        for _ in range(rng.randint(3, 12))
+    )
+    return (
+        f"<table><caption>Table {rng.randint(1, 5)}. Properties of the samples.</caption>"
+        f"<tr><th>Compound</th><th>m.p. (°C)</th><th>Rate (μmol h−1 g−1)</th></tr>{rows}</table>"
+    )
+
+
+def _num_paragraphs(rng, length_distribution, mean_paragraphs):
+    if length_distribution == "fixed":
+        return mean_paragraphs
+    if length_distribution == "uniform":
+        return rng.randint(1, 2 * mean_paragraphs - 1)
+    # A long tail of very long papers, as in real corpora
+    mu = math.log(mean_paragraphs) - LOGNORMAL_SIGMA ** 2 / 2
+    return max(1, round(rng.lognormvariate(mu, LOGNORMAL_SIGMA)))
+
+
+def _document_html(rng, index, num_paragraphs, num_tables):
+    body = [f"<h1>Synthetic paper {index}</h1>", "<h2>Experimental</h2>"]
+    table_positions = set(rng.sample(range(num_paragraphs), min(num_tables, num_paragraphs)))
+    for paragraph_index in range(num_paragraphs):
+        body.append("<p>" + " ".join(_sentence(rng) for _ in range(rng.randint(3, 8))) + "</p>")
+        if paragraph_index in table_positions:
+            body.append(_table(rng))
+    return f"<html><head><title>Synthetic paper {index}</title></head><body>{''.join(body)}</body></html>"
+
+
+def generate_corpus(corpus_dir, num_documents, length_distribution="lognormal", mean_paragraphs=20, table_fraction=0.3, seed=0):
+    # Reuses the corpus already in corpus_dir if it was generated with the same settings
+    if length_distribution not in LENGTH_DISTRIBUTIONS:
+        raise ValueError(f"Unknown length distribution {length_distribution}, should be one of {LENGTH_DISTRIBUTIONS}")
+    settings = {
+        "num_documents": num_documents,
+        "length_distribution": length_distribution,
+        "mean_paragraphs": mean_paragraphs,
+        "table_fraction": table_fraction,
+        "seed": seed,
+    }
+    info_path = os.path.join(corpus_dir, CORPUS_INFO_FILE_NAME)
+    if os.path.exists(info_path):
+        with open(info_path) as f:
+            if json.load(f).get("settings") == settings:
+                return settings
+
+    shutil.rmtree(corpus_dir, ignore_errors=True)
+    os.makedirs(corpus_dir)
+    rng = random.Random(seed)
+    total_bytes = 0
+    for index in range(num_documents):
+        num_tables = rng.randint(1, 3) if rng.random() < table_fraction else 0
+        html = _document_html(rng, index, _num_paragraphs(rng, length_distribution, mean_paragraphs), num_tables)
+        with open(os.path.join(corpus_dir, f"paper{index:06d}.html"), "w") as f:
+            f.write(html)
+        total_bytes += len(html.encode("utf-8"))
+    # Written last, so that a corpus that was only partly generated is generated again
+    with open(info_path, "w") as f:
+        json.dump({"settings": settings, "total_bytes": total_bytes}, f)
+    return settings
+
+
+def _num_workers(config):
+    # How many workers extract at once, for the idle time
+    workers_per_rank = config["extractor_args"].get("workers_per_rank", 1)
+    if config["mode"] == "single":
+        return 1
+    if config["mode"] == "processes":
+        return config["workers"]
+    if config["mode"] == "file_queue":
+        return config["workers"] * workers_per_rank
+    num_ranks = config["mpi_ranks"] if config["extractor_args"].get("master_does_work") else config["mpi_ranks"] - 1
+    return max(num_ranks, 1) * workers_per_rank
+
+
+def _commands(config, mpirun):
+    command = [sys.executable, "-m", "e2e_workflow.extraction.benchmark", "_extract", json.dumps(config)]
+    if config["mode"] == "mpi":
+        return [shlex.split(mpirun) + ["-n", str(config["mpi_ranks"])] + command]
+    if config["mode"] == "file_queue":
+        return [command] * config["workers"]
+    return [command]
+
+
+def _run_commands(commands):
+    # Returns the wall time, the exit codes, and the peak RSS of the largest
+    # process (including any they started, e.g. the ranks under mpirun)
+    env = _package_env()
+    start_time = time.perf_counter()
+    processes = [subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL) for command in commands]
+    exit_codes = []
+    peak_rss_bytes = 0
+    for process in processes:
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        exit_codes.append(process.returncode)
+        peak_rss_bytes = max(peak_rss_bytes, rusage.ru_maxrss * 1024)
+    return time.perf_counter() - start_time, exit_codes, peak_rss_bytes
+
+
+def run_configuration(config, work_dir, mpirun="mpirun"):
+    run_dir = os.path.join(work_dir, "runs", config["name"].replace("/", "-"))
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    config = {**config, "run_dir": run_dir}
+    print(f"Running {config['name']}...")
+    wall_time, exit_codes, peak_rss_bytes = _run_commands(_commands(config, mpirun))
+
+    metrics_dir = os.path.join(run_dir, "metrics")
+    report = build_run_report(load_metrics(metrics_dir), workers=load_worker_metrics(metrics_dir)) if os.path.isdir(metrics_dir) else None
+    result = {
+        "name": config["name"],
+        "model": config["model"],
+        "mode": config["mode"],
+        "num_workers": _num_workers(config),
+        "extractor_args": config["extractor_args"],
+        "exit_codes": exit_codes,
+        "wall_time": wall_time,
+        "peak_rss_bytes": peak_rss_bytes,
+    }
+    if report is None or not report["num_documents"]:
+        result["num_documents"] = 0
+        return result
+
+    extraction_time = report["wall_time"]
+    result.update({
+        "num_documents": report["num_documents"],
+        "status_counts": report["status_counts"],
+        "records_by_model": report["records_by_model"],
+        "extraction_time": extraction_time,
+        # Not counting startup (e.g. importing and loading models)
+        "docs_per_second": report["num_documents"] / extraction_time if extraction_time else None,
+        "docs_per_second_including_startup": report["num_documents"] / wall_time,
+        "document_time": report["document_time"],
+        "stages": {
+            stage: {key: info[key] for key in ["total", "share", "p50", "p90"]}
+            for stage, info in report["stages"].items()
+        },
+        # The time workers weren't working on a document while the run was going
+        "idle_time": max(result["num_workers"] * extraction_time - report["total_document_time"], 0.) if extraction_time else None,
+        "utilization": report["total_document_time"] / (result["num_workers"] * extraction_time) if extraction_time else None,
+        "peak_rss_bytes_per_worker": max((info["peak_rss_bytes"] or 0 for info in report["ranks"].values()), default=None),
+    })
+    return result
+
+
+def _git_commit():
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=package_dir, capture_output=True, text=True, check=True).stdout.strip()
+        is_dirty = bool(subprocess.run(["git", "status", "--porcelain"], cwd=package_dir, capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, is_dirty
+
+
+def _environment():
+    commit, is_dirty = _git_commit()
+    return {
+        "time": datetime.datetime.now().isoformat(),
+        "git_commit": commit,
+        "git_dirty": is_dirty,
+        "hostname": socket.gethostname(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _format_result(result):
+    if not result["num_documents"]:
+        return f"{result['name']:<28} failed (exit codes {result['exit_codes']})"
+    shares = sorted(result["stages"].items(), key=lambda item: item[1]["total"], reverse=True)[:3]
+    return (
+        f"{result['name']:<28} {result['docs_per_second']:8.2f} papers/s, idle {result['idle_time']:.1f}s, "
+        f"peak RSS {result['peak_rss_bytes'] / 2 ** 20:.0f}MB, "
+        + ", ".join(f"{stage} {100 * (info['share'] or 0):.0f}%" for stage, info in shares)
+    )
+
+
+def run(args):
+    work_dir = os.path.abspath(args.work_dir)
+    corpus_dir = os.path.join(work_dir, "corpus")
+    corpus = generate_corpus(corpus_dir, args.num_documents, args.length_distribution, args.mean_paragraphs, args.table_fraction, args.seed)
+    extractor_args = json.loads(args.extractor_args) if args.extractor_args else {}
+
+    results = []
+    for model in args.models.split(","):
+        for mode in args.modes.split(","):
+            if mode not in BENCHMARK_MODES:
+                raise ValueError(f"Unknown benchmark mode {mode}, should be one of {BENCHMARK_MODES}")
+            config = {
+                "name": f"{model}/{mode}",
+                "model": model,
+                "mode": mode,
+                "workers": args.workers,
+                "mpi_ranks": args.mpi_ranks if args.mpi_ranks is not None else args.workers + 1,
+                "corpus_dir": corpus_dir,
+                "extractor_args": extractor_args,
+            }
+            result = run_configuration(config, work_dir, args.mpirun)
+            print(_format_result(result))
+            results.append(result)
+
+    output = {"environment": _environment(), "corpus": corpus, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+    return 0 if all(result["num_documents"] for result in results) else 1
+
+
+def _change(before, after):
+    if not before or after is None:
+        return "-"
+    return f"{100 * (after - before) / before:+.1f}%"
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"Before: {before['environment']['git_commit']}, after: {after['environment']['git_commit']}")
+    if before["corpus"] != after["corpus"]:
+        print(f"WARNING: the corpora differ: {before['corpus']} vs {after['corpus']}")
+
+    before_results = {result["name"]: result for result in before["results"]}
+    for result in after["results"]:
+        previous = before_results.get(result["name"])
+        if previous is None or not result["num_documents"] or not previous["num_documents"]:
+            print(f"{result['name']:<28} not comparable")
+            continue
+        print(
+            f"{result['name']:<28} papers/s {previous['docs_per_second']:.2f} -> {result['docs_per_second']:.2f} "
+            f"({_change(previous['docs_per_second'], result['docs_per_second'])}), "
+            f"idle {previous['idle_time']:.1f}s -> {result['idle_time']:.1f}s, "
+            f"peak RSS {_change(previous['peak_rss_bytes'], result['peak_rss_bytes'])}"
+        )
+        for stage, info in result["stages"].items():
+            previous_total = previous["stages"].get(stage, {}).get("total")
+            print(f"    {stage:<15} {_change(previous_total, info['total'])}")
+    return 0
+
+
+def _package_env():
+    env = dict(os.environ)
+    package_parent_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [package_parent_dir, env.get("PYTHONPATH")]))
+    return env
+
+
+def _import_times(code):
+    # The time each module imported while running code took to import itself
+    # (not counting the modules it imported), in seconds, from -X importtime
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], env=_package_env(), capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+    import_times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+        self_time, _, name = line[len("import time:"):].split("|")
+        if self_time.strip().isdigit():
+            import_times[name.strip()] = int(self_time) / 1e6
+    return completed.stdout, import_times
+
+
+def time_import(module_name, repeats=5):
+    # Imports module_name in a fresh process repeats times, and returns the
+    # fastest time, the packages that took longest to import and which of
+    # LAZY_MODULES were loaded
+    setup = "import json, sys, time\n"
+    _, baseline_times = _import_times(setup)
+    code = (
+        setup
+        + "start_time = time.perf_counter()\n"
+        + f"import {module_name}\n"
+        + "print(json.dumps([time.perf_counter() - start_time, sorted(sys.modules)]))"
+    )
+    best = None
+    for _ in range(repeats):
+        stdout, import_times = _import_times(code)
+        seconds, modules = json.loads(stdout.strip().splitlines()[-1])
+        if best is not None and seconds >= best["seconds"]:
+            continue
+        package_times = {}
+        for name, self_time in import_times.items():
+            if name not in baseline_times:
+                package_name = name.split(".")[0]
+                package_times[package_name] = package_times.get(package_name, 0.) + self_time
+        best = {
+            "module": module_name,
+            "seconds": seconds,
+            "slowest_packages": sorted(package_times.items(), key=lambda item: item[1], reverse=True)[:10],
+            "lazy_modules_loaded": [name for name in LAZY_MODULES if name in modules],
+        }
+    return best
+
+
+def imports(args):
+    results = []
+    is_ok = True
+    for module_name in args.modules.split(",") if args.modules else IMPORT_ENTRY_POINTS:
+        try:
+            result = time_import(module_name, args.repeats)
+        except RuntimeError as e:
+            # e.g. a dependency of the entry point itself isn't installed
+            print(f"{module_name:<45} could not be imported: {e}")
+            is_ok = False
+            continue
+        results.append(result)
+        problems = []
+        if result["lazy_modules_loaded"]:
+            problems.append(f"loaded {', '.join(result['lazy_modules_loaded'])}")
+        if args.max_seconds is not None and result["seconds"] > args.max_seconds:
+            problems.append(f"took longer than {args.max_seconds}s")
+        is_ok = is_ok and not problems
+        print(f"{module_name:<45} {result['seconds']:6.2f}s{'  FAILED: ' + '; '.join(problems) if problems else ''}")
+        for name, seconds in result["slowest_packages"][:5]:
+            print(f"    {name:<41} {seconds:6.2f}s")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"environment": _environment(), "imports": results}, f, indent=2)
+    return 0 if is_ok else 1
+
+
+def _extract(config):
+    # Runs in the processes started by run_configuration
+    from e2e_workflow.extraction.benchmark_models import benchmark_models
+    from e2e_workflow.extraction.extractor import CDEDatabaseExtractor
+
+    models, model_loader = benchmark_models(config["model"])
+    run_dir = config["run_dir"]
+    extractor_args = dict(config["extractor_args"])
+    if config["mode"] == "processes":
+        extractor_args["workers"] = config["workers"]
+    if config["mode"] == "file_queue":
+        extractor_args["queue_dir"] = os.path.join(run_dir, "queue")
+        # The processes all start together, so they don't need to wait long for whoever populates the queue
+        extractor_args.setdefault("lease_seconds", 60)
+    extractor = CDEDatabaseExtractor(
+        models=models,
+        save_root_dir=os.path.join(run_dir, "output"),
+        backend=config["mode"],
+        model_loader=model_loader,
+        metrics_dir=os.path.join(run_dir, "metrics"),
+        **extractor_args
+    )
+    extractor.extract(config["corpus_dir"])
+    return 0
+
+
+def main(args=None):
+    if args is None:
+        args = sys.argv[1:]
+    if args and args[0] == "_extract":
+        return _extract(json.loads(args[1]))
+
+    parser = argparse.ArgumentParser(prog="python -m e2e_workflow.extraction.benchmark")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--output", required=True, help="Where to write the results (JSON)")
+    run_parser.add_argument("--work-dir", default="benchmark", help="Where to put the corpus and the output of each run")
+    run_parser.add_argument("--num-documents", type=int, default=200)
+    run_parser.add_argument("--length-distribution", choices=LENGTH_DISTRIBUTIONS, default="lognormal")
+    run_parser.add_argument("--mean-paragraphs", type=int, default=20)
+    run_parser.add_argument("--table-fraction", type=float, default=0.3, help="The fraction of papers with tables")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--models", default="stub", help="Comma separated: stub, melting_point")
+    run_parser.add_argument("--modes", default="single,processes", help=f"Comma separated: {', '.join(BENCHMARK_MODES)}")
+    run_parser.add_argument("--workers", type=int, default=4, help="Workers for processes, and processes for file_queue")
+    run_parser.add_argument("--mpi-ranks", type=int, help="Ranks for mpi (by default, one more than --workers)")
+    run_parser.add_argument("--mpirun", default="mpirun", help="The command to start MPI jobs with")
+    run_parser.add_argument("--extractor-args", help="Extra arguments for the extractor, as JSON")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare the results of two runs")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare)
+
+    imports_parser = subparsers.add_parser("imports", help="Time importing each entry point")
+    imports_parser.add_argument("--modules", help="Comma separated modules to import, rather than the entry points")
+    imports_parser.add_argument("--repeats", type=int, default=5)
+    imports_parser.add_argument("--max-seconds", type=float, help="Fail if importing any of them takes longer")
+    imports_parser.add_argument("--output", help="Where to write the results (JSON)")
+    imports_parser.set_defaults(func=imports)
+
+    parsed = parser.parse_args(args)
+    return parsed.func(parsed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
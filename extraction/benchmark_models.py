@@ -0,0 +1,59 @@
+from chemdataextractor.doc.text import Sentence, Text
+from chemdataextractor.model import BaseModel, MeltingPoint, StringType
+from chemdataextractor.nlp.subsentence import NoneSubsentenceExtractor
+from chemdataextractor.nlp.tag import BaseTagger
+from chemdataextractor.nlp.tokenize import SentenceTokenizer, regex_span_tokenize
+from chemdataextractor.parse import BaseSentenceParser, R
+from chemdataextractor.utils import first
+
+# The models the benchmark can extract with. stub only needs CDE itself, as it
+# uses a stub sentence tokenizer and stub taggers. melting_point is a real CDE
+# model, which needs CDE's models to be downloaded.
+BENCHMARK_MODELS = ["stub", "melting_point"]
+
+
+class StubTagger(BaseTagger):
+    # Gives every token the same tag, so that tagging costs next to nothing
+    def __init__(self, tag_type, tag):
+        self.tag_type = tag_type
+        self.fixed_tag = tag
+
+    def tag(self, tokens):
+        return [(token, self.fixed_tag) for token in tokens]
+
+
+class StubSentenceTokenizer(SentenceTokenizer):
+    # Splits after full stops, rather than with a Punkt model
+    def span_tokenize(self, s):
+        return list(regex_span_tokenize(s, r"(?<=[.!?])\s+"))
+
+
+class _StubValueParser(BaseSentenceParser):
+    root = R(r"^\d+$")("value")
+
+    def interpret(self, result, start, end):
+        yield self.model(value=first(result.xpath("./text()")))
+
+
+class StubValue(BaseModel):
+    # A record for every whole number in a sentence
+    value = StringType()
+    parsers = [_StubValueParser()]
+
+
+def load_stub_taggers():
+    taggers = [StubTagger("pos_tag", "NN"), StubTagger("ner_tag", "O")]
+    Text.sentence_tokenizer = StubSentenceTokenizer()
+    Text.taggers = taggers
+    Sentence.taggers = taggers
+    Text.subsentence_extractor = NoneSubsentenceExtractor()
+    Sentence.subsentence_extractor = NoneSubsentenceExtractor()
+
+
+def benchmark_models(model_name):
+    # The models to extract, and the model_loader to pass to the extractor
+    if model_name == "stub":
+        return [StubValue], load_stub_taggers
+    if model_name == "melting_point":
+        return [MeltingPoint], None
+    raise ValueError(f"Unknown benchmark model {model_name}, should be one of {BENCHMARK_MODELS}")
@@ -0,0 +1,96 @@
+import fnmatch
+import os
+
+# Replaces the old hard-coded check for 'records.txt' in the filename
+DEFAULT_EXCLUDE = ["*records.txt*"]
+
+
+def _is_wanted(filename, include, exclude):
+    if filename[0] == '.':
+        return False
+    if include is not None and not any(fnmatch.fnmatch(filename, pattern) for pattern in include):
+        return False
+    return not any(fnmatch.fnmatch(filename, pattern) for pattern in exclude)
+
+
+def document_name(document_path, document_dir=None):
+    # The name a document's outputs are saved under: its filename without the
+    # extension, or, if document_dir is given (see DocumentSource.names_dir),
+    # its path relative to document_dir, so that a/paper.html and b/paper.html
+    # don't overwrite each other's outputs. The separators in a relative path
+    # are escaped (and so is %, so that different paths always give different
+    # names).
+    if document_dir is None:
+        return os.path.splitext(os.path.basename(document_path))[0]
+    name = os.path.splitext(os.path.relpath(document_path, document_dir))[0]
+    return name.replace("%", "%25").replace(os.sep, "%2F")
+
+
+def iter_directory(document_dir, recursive=False, include=None, exclude=None):
+    if exclude is None:
+        exclude = DEFAULT_EXCLUDE
+    dirs_to_scan = [document_dir]
+    while dirs_to_scan:
+        with os.scandir(dirs_to_scan.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive and entry.name[0] != '.':
+                        dirs_to_scan.append(entry.path)
+                elif _is_wanted(entry.name, include, exclude):
+                    yield entry.path
+
+
+def iter_manifest(manifest_path, document_dir=None, include=None, exclude=None):
+    # One path per line. Blank lines and lines starting with # are ignored, and
+    # relative paths are taken relative to document_dir if it's given.
+    if exclude is None:
+        exclude = DEFAULT_EXCLUDE
+    with open(manifest_path) as f:
+        for line in f:
+            document_path = line.strip()
+            if not document_path or document_path[0] == '#':
+                continue
+            if not _is_wanted(os.path.basename(document_path), include, exclude):
+                continue
+            if document_dir is not None:
+                document_path = os.path.join(document_dir, document_path)
+            yield document_path
+
+
+def manifest_root(manifest_path, include=None, exclude=None):
+    # The deepest directory that every document in the manifest is in, or None
+    # if it's empty
+    root = None
+    for document_path in iter_manifest(manifest_path, include=include, exclude=exclude):
+        document_dir = os.path.dirname(os.path.abspath(document_path))
+        root = document_dir if root is None else os.path.commonpath([root, document_dir])
+    return root
+
+
+class DocumentSource:
+    # Where the documents for a run come from. Iterating over it lazily yields
+    # paths, so that dispatch can start before the whole corpus has been listed.
+    def __init__(self, document_dir=None, manifest=None, recursive=False, include=None, exclude=None):
+        if document_dir is None and manifest is None:
+            raise ValueError("Either a document directory or a manifest must be given")
+        self.document_dir = document_dir
+        self.manifest = manifest
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+
+    def names_dir(self):
+        # What the documents' outputs are named relative to (see document_name).
+        # Documents in a flat directory are named after their filenames, which
+        # are unique. Manifest entries are named relative to document_dir, or if
+        # it isn't given, to the deepest directory they're all in.
+        if self.manifest is not None:
+            if self.document_dir is not None:
+                return self.document_dir
+            return manifest_root(self.manifest, self.include, self.exclude)
+        return self.document_dir if self.recursive else None
+
+    def __iter__(self):
+        if self.manifest is not None:
+            return iter_manifest(self.manifest, self.document_dir, self.include, self.exclude)
+        return iter_directory(self.document_dir, self.recursive, self.include, self.exclude)
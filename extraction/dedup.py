@@ -0,0 +1,43 @@
+import hashlib
+import html
+import re
+
+from e2e_workflow.extraction.doc_cache import content_hash
+
+# content finds byte-identical documents. text also finds documents whose text
+# is the same once markup, case, punctuation and whitespace are ignored, e.g.
+# the same article in a publisher's HTML and in a preprint server's.
+DEDUPLICATION_MODES = ["content", "text"]
+
+_MARKUP_RE = re.compile(r"<[^>]*>")
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def normalized_text_hash(document_path):
+    with open(document_path, encoding="utf-8", errors="ignore") as f:
+        text = f.read()
+    text = html.unescape(_MARKUP_RE.sub(" ", text))
+    text = _NON_WORD_RE.sub("", text.lower())
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def find_duplicates(document_paths, mode="content"):
+    # Returns the first path in each group of duplicates, in the order they were
+    # listed, and the rest of each group, keyed by the first path.
+    hash_document = content_hash if mode == "content" else normalized_text_hash
+    canonical_paths = []
+    duplicates = {}
+    canonical_path_for_hash = {}
+    for document_path in document_paths:
+        try:
+            document_hash = hash_document(document_path)
+        except OSError:
+            # Leave it to extraction to report the problem
+            canonical_paths.append(document_path)
+            continue
+        if document_hash in canonical_path_for_hash:
+            duplicates.setdefault(canonical_path_for_hash[document_hash], []).append(document_path)
+        else:
+            canonical_path_for_hash[document_hash] = document_path
+            canonical_paths.append(document_path)
+    return canonical_paths, duplicates
@@ -0,0 +1,66 @@
+import math
+from collections import deque
+
+
+# Hands out document paths in chunks so that the number of messages the master
+# deals with scales with the number of chunks rather than the number of documents.
+# Chunks shrink towards the end of the run (guided self-scheduling) so that the
+# workers finish at roughly the same time.
+#
+# The paths are pulled lazily from the iterable passed in, only reading far
+# enough ahead to know whether we're near the end of the run.
+class ChunkDispatcher:
+    def __init__(self, document_paths, num_workers, chunk_size=1, min_chunk_size=1, tail_factor=2):
+        self._document_iterator = iter(document_paths)
+        self._is_exhausted = False
+        self.document_paths = deque()
+        self.num_workers = max(num_workers, 1)
+        self.chunk_size = max(chunk_size, 1)
+        self.min_chunk_size = max(min(min_chunk_size, self.chunk_size), 1)
+        self.tail_factor = tail_factor
+        self.num_chunks_sent = 0
+        self.num_documents_seen = 0
+
+    def _lookahead(self):
+        return self.chunk_size * self.tail_factor * self.num_workers + self.chunk_size
+
+    def _fill(self, num_documents):
+        while not self._is_exhausted and len(self.document_paths) < num_documents:
+            try:
+                self.document_paths.append(next(self._document_iterator))
+                self.num_documents_seen += 1
+            except StopIteration:
+                self._is_exhausted = True
+
+    def total_documents(self):
+        # None until we've seen every document
+        if not self._is_exhausted:
+            return None
+        return self.num_documents_seen
+
+    def remaining(self):
+        self._fill(self._lookahead())
+        return len(self.document_paths)
+
+    def has_work(self):
+        self._fill(1)
+        return len(self.document_paths) > 0
+
+    def requeue(self, document_paths):
+        self.document_paths.extend(document_paths)
+
+    def next_chunk_size(self):
+        remaining = self.remaining()
+        if not self._is_exhausted:
+            return self.chunk_size
+        guided_size = math.ceil(remaining / (self.tail_factor * self.num_workers))
+        return max(min(self.chunk_size, guided_size), self.min_chunk_size)
+
+    def next_chunk(self, max_size=None):
+        chunk_size = min(self.next_chunk_size(), self.remaining())
+        if max_size is not None:
+            chunk_size = min(chunk_size, max_size)
+        chunk = [self.document_paths.popleft() for _ in range(chunk_size)]
+        if chunk:
+            self.num_chunks_sent += 1
+        return chunk
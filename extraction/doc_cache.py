@@ -0,0 +1,276 @@
+import chemdataextractor
+from chemdataextractor.doc.document_cacher import PlainTextCacher
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+ENTRIES_DIR_NAME = "entries"
+TMP_DIR_NAME = "tmp"
+LOCK_FILE_NAME = ".lock"
+# When the cache grows past its cap, evict down to this fraction of it so that
+# we aren't evicting again after every document
+EVICT_TO_FRACTION = 0.9
+# Temporary directories older than this were left behind by crashed writers
+STALE_TMP_SECONDS = 60 * 60
+# The tags PlainTextCacher stores by default
+CACHED_TAGS = ["ner_tag", "pos_tag"]
+
+
+def content_hash(document_path):
+    # The extension is included as it decides which reader is used for the document
+    hasher = hashlib.sha256()
+    hasher.update(os.path.splitext(document_path)[1].lower().encode("utf-8") + b"\0")
+    with open(document_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def tag_document(doc, tags=CACHED_TAGS):
+    # Tagging is lazy in CDE, so we ask for each tag of the first token in each
+    # sentence, which tags the whole sentence (or the whole document at once, for
+    # taggers that can batch)
+    for sentence in doc.sentences:
+        tokens = sentence.tokens
+        if tokens:
+            for tag in tags:
+                tokens[0][tag]
+
+
+def _describe_component(component):
+    description = {"class": f"{type(component).__module__}.{type(component).__qualname__}"}
+    # Most of the CDE taggers and tokenizers take the path of their model as model
+    model = getattr(component, "model", None)
+    if isinstance(model, str):
+        description["model"] = model
+    sub_taggers = getattr(component, "taggers", None)
+    if isinstance(sub_taggers, (list, tuple)):
+        description["taggers"] = [_describe_component(tagger) for tagger in sub_taggers if tagger is not component]
+    return description
+
+
+def configuration_fingerprint(doc, extra=None):
+    # Like PlainTextCacher's document configuration, but also covers the models
+    # the taggers use and the CDE version, and anything passed as extra (e.g. the
+    # version of a model that's loaded some other way).
+    sentences = doc.sentences
+    if not sentences:
+        return None
+    configuration = {
+        "chemdataextractor": getattr(chemdataextractor, "__version__", None),
+        "tokenizer": _describe_component(sentences[0].word_tokenizer),
+        "taggers": [_describe_component(tagger) for tagger in sentences[0].taggers],
+        "extra": extra,
+    }
+    return hashlib.sha256(json.dumps(configuration, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _dir_size(path):
+    size = 0
+    for dir_path, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.path.getsize(os.path.join(dir_path, filename))
+            except OSError:
+                pass
+    return size
+
+
+# Caches the tokenisation and tags of documents with PlainTextCacher, keyed by
+# the content of the document and a fingerprint of the tokenizer and taggers,
+# so that a cached document is never used with a different configuration.
+#
+# Entries are written to a temporary directory and renamed into place, so many
+# ranks can share a cache: readers never see a half-written entry, and if two
+# ranks cache the same document, the first one wins. Hits update the entry's
+# mtime, and if max_size_bytes is set, the least recently used entries are
+# evicted once the cache grows past it. Each process only knows about what it
+# has written since it last looked, so the cache can overshoot the cap a little
+# when many ranks are writing to it.
+class DocumentCache:
+    def __init__(self, cache_dir, max_size_bytes=None, fingerprint_extra=None):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = max_size_bytes
+        self.fingerprint_extra = fingerprint_extra
+        os.makedirs(os.path.join(cache_dir, ENTRIES_DIR_NAME), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, TMP_DIR_NAME), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._estimated_size = None
+        self._lock = threading.Lock()
+        # The configuration fingerprints of the documents this process has keyed
+        self._fingerprints = set()
+
+    def key_for(self, document_path, doc):
+        fingerprint = configuration_fingerprint(doc, self.fingerprint_extra)
+        if fingerprint is None:
+            return None
+        self._fingerprints.add(fingerprint)
+        return fingerprint, content_hash(document_path)
+
+    def contains_document(self, document_path):
+        # Whether the document is cached with the configuration of a document this
+        # process has already keyed, which, unlike contains, doesn't need the
+        # document to be loaded. The tokenizer and taggers are set up once per
+        # process, so after the first document this is as good as contains.
+        if not self._fingerprints:
+            return False
+        document_hash = content_hash(document_path)
+        for fingerprint in self._fingerprints:
+            if os.path.isdir(self.entry_path((fingerprint, document_hash))):
+                self._count("hits")
+                return True
+        return False
+
+    def entry_path(self, key):
+        fingerprint, document_hash = key
+        return os.path.join(self.cache_dir, ENTRIES_DIR_NAME, fingerprint, document_hash)
+
+    def contains(self, key):
+        if os.path.isdir(self.entry_path(key)):
+            self._count("hits")
+            return True
+        self._count("misses")
+        return False
+
+    def hydrate(self, doc, key):
+        # Returns whether the document was in the cache. Can also raise if the
+        # entry is evicted while it's being read, in which case the document may
+        # have been partially hydrated and should be reloaded.
+        entry_path = self.entry_path(key)
+        if not os.path.isdir(entry_path):
+            self._count("misses")
+            return False
+        PlainTextCacher(os.path.dirname(entry_path)).hydrate_document(doc, key[1])
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        self._count("hits")
+        return True
+
+    def store(self, doc, key):
+        # Returns the paths written to
+        tmp_root = os.path.join(self.cache_dir, TMP_DIR_NAME, uuid.uuid4().hex)
+        try:
+            PlainTextCacher(tmp_root).cache_document(doc, key[1], overwrite_cache=True)
+            entry_path = self.entry_path(key)
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            try:
+                os.rename(os.path.join(tmp_root, key[1]), entry_path)
+            except OSError:
+                # Someone else has already cached this document
+                return []
+        finally:
+            shutil.rmtree(tmp_root, ignore_errors=True)
+
+        self._count("writes")
+        if self.max_size_bytes is not None:
+            self._add_to_size(_dir_size(entry_path))
+        return [entry_path]
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _add_to_size(self, size):
+        with self._lock:
+            if self._estimated_size is None:
+                self._estimated_size = sum(entry[1] for entry in self._entries())
+            else:
+                self._estimated_size += size
+            if self._estimated_size > self.max_size_bytes:
+                self._evict()
+
+    def _entries(self):
+        # (last used, size, path) for every entry in the cache
+        entries = []
+        entries_dir = os.path.join(self.cache_dir, ENTRIES_DIR_NAME)
+        for fingerprint_entry in os.scandir(entries_dir):
+            if not fingerprint_entry.is_dir():
+                continue
+            for entry in os.scandir(fingerprint_entry.path):
+                try:
+                    entries.append((entry.stat().st_mtime, _dir_size(entry.path), entry.path))
+                except OSError:
+                    pass
+        return entries
+
+    @contextlib.contextmanager
+    def _eviction_lock(self):
+        # Only one process needs to evict at a time, the others can get on with
+        # extracting. Yields whether we got the lock.
+        with open(os.path.join(self.cache_dir, LOCK_FILE_NAME), "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            except OSError:
+                # Some shared filesystems don't support locks. Eviction is still
+                # safe without one, as entries are removed by renaming them.
+                yield True
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict(self):
+        with self._eviction_lock() as got_lock:
+            if not got_lock:
+                return
+            entries = sorted(self._entries())
+            total_size = sum(entry[1] for entry in entries)
+            target_size = self.max_size_bytes * EVICT_TO_FRACTION
+            for _, size, entry_path in entries:
+                if total_size <= target_size:
+                    break
+                # Move the entry out of the way first so nobody starts reading it
+                # while it's being deleted
+                evicted_path = os.path.join(self.cache_dir, TMP_DIR_NAME, "evicted-" + uuid.uuid4().hex)
+                try:
+                    os.rename(entry_path, evicted_path)
+                except OSError:
+                    continue
+                shutil.rmtree(evicted_path, ignore_errors=True)
+                total_size -= size
+                self.evictions += 1
+            self._estimated_size = total_size
+            self._remove_empty_fingerprint_dirs()
+            self._remove_stale_tmp_dirs()
+
+    def _remove_empty_fingerprint_dirs(self):
+        # Entries for old configurations are never used, so they're the first to
+        # be evicted, which leaves their directories empty
+        for fingerprint_entry in os.scandir(os.path.join(self.cache_dir, ENTRIES_DIR_NAME)):
+            try:
+                os.rmdir(fingerprint_entry.path)
+            except OSError:
+                pass
+
+    def _remove_stale_tmp_dirs(self):
+        now = time.time()
+        for entry in os.scandir(os.path.join(self.cache_dir, TMP_DIR_NAME)):
+            try:
+                if now - entry.stat().st_mtime > STALE_TMP_SECONDS:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except OSError:
+                pass
@@ -1,8 +1,23 @@
 from e2e_workflow.extraction.base_extractor import BaseExtractor
+from e2e_workflow.extraction.fingerprint import FINGERPRINT_SUFFIX, extraction_fingerprint, stale_models
+from e2e_workflow.extraction.json_files import read_json, write_json_atomically
+from e2e_workflow.extraction.shards import (
+    OUTPUT_LAYOUTS,
+    ShardWriter,
+    ShardedStore,
+    add_duplicate_papers,
+    strip_ids,
+)
+from e2e_workflow.extraction.instrumentation import records_by_model
 from cdedatabase import CDEDatabase, JSONCoder
-import wandb
 
 import os
+import shutil
+import time
+import uuid
+
+
+DUPLICATE_OUTPUTS = ["link", "copy"]
 
 
 class CDEDatabaseExtractor(BaseExtractor):
@@ -13,12 +28,32 @@ class CDEDatabaseExtractor(BaseExtractor):
         document_args=None,
         filter_results=None,
         is_valid_document=None,
+        output_layout="per_paper",
+        papers_per_shard=None,
+        duplicate_output="link",
+        reextract_stale=True,
         **kwargs
     ):
         super().__init__(**kwargs)
         self.models = models
         self.save_root_dir = save_root_dir
 
+        # per_paper writes a CDEDatabase for each paper, which is what the labelling and
+        # evaluation tools expect. sharded writes to a few CDEDatabases per rank instead;
+        # see e2e_workflow.extraction.shards for reading them and converting between the two.
+        if output_layout not in OUTPUT_LAYOUTS:
+            raise ValueError(f"Unknown output layout {output_layout}, should be one of {OUTPUT_LAYOUTS}")
+        self.output_layout = output_layout
+        self.papers_per_shard = papers_per_shard
+        self._shard_writers = {}
+        self._sharded_store = None
+
+        # With deduplicate, each duplicate paper's database is either a symlink to
+        # (link) or a copy of (copy) the database of the paper extracted in its place
+        if duplicate_output not in DUPLICATE_OUTPUTS:
+            raise ValueError(f"Unknown duplicate output {duplicate_output}, should be one of {DUPLICATE_OUTPUTS}")
+        self.duplicate_output = duplicate_output
+
         self.document_args = {}
         if document_args is not None:
             self.document_args = document_args
@@ -26,17 +61,62 @@ class CDEDatabaseExtractor(BaseExtractor):
         self.filter_results = filter_results
         self.is_valid_document = is_valid_document
 
+        # Each output is saved with a fingerprint of the models (their source and
+        # parsers) and of everything else that affects the records. With
+        # reextract_stale, papers whose output has a different fingerprint are
+        # extracted again, with only the models that changed if nothing else did.
+        # Outputs from before fingerprints were kept are left alone.
+        self.reextract_stale = reextract_stale
+        self.fingerprint = extraction_fingerprint(
+            models,
+            document_args=self.document_args,
+            filter_results=filter_results,
+            is_valid_document=is_valid_document,
+        )
+
     def will_start_extraction(self):
         super().will_start_extraction()
         if not os.path.isdir(self.save_root_dir):
             os.mkdir(self.save_root_dir)
 
     def should_open_file(self, filename):
-        db_name = self.db_name_for_file(filename)
-        should_open = not os.path.exists(db_name)
-        if not should_open:
+        if self.journal is not None:
+            # Papers that are up to date have already been filtered out using the
+            # journal, and the fingerprints of those that were completed with
+            # different models are sent with each chunk, so the outputs don't
+            # need checking
+            stored_fingerprint = self.journalled_output_fingerprint(filename)
+            if stored_fingerprint is None:
+                return True
+        elif self.output_layout == "sharded":
+            paper_name = self.document_name(filename)
+            if not self._sharded_store_for_reading().has_paper(paper_name):
+                return True
+            stored_fingerprint = self._sharded_store.fingerprint_for_paper(paper_name)
+        else:
+            db_name = self.db_name_for_file(filename)
+            if not os.path.exists(db_name):
+                return True
+            stored_fingerprint = read_json(db_name + FINGERPRINT_SUFFIX)
+
+        if stored_fingerprint is None or not self.reextract_stale:
             print(f"Skipping {filename} as already exists")
-        return should_open
+            return False
+        reextracted_models = stale_models(stored_fingerprint, self.fingerprint)
+        if not reextracted_models:
+            print(f"Skipping {filename} as already extracted with the same models")
+            return False
+        print(f"Re-extracting {reextracted_models} for {filename}")
+        self.stage_timer.set("reextracted_models", reextracted_models)
+        return True
+
+    def output_fingerprint(self):
+        return self.fingerprint
+
+    def is_output_up_to_date(self, output_fingerprint):
+        # Not just whether the fingerprints are the same, as models that can't be
+        # fingerprinted are always out of date
+        return not stale_models(output_fingerprint, self.fingerprint)
 
     def should_process_document(self, document):
         if self.is_valid_document is None:
@@ -49,19 +129,147 @@ class CDEDatabaseExtractor(BaseExtractor):
     def configure_document(self, document):
         super().configure_document(document)
 
-        document.models = self.models
+        document.models = [model for model in self.models if model.__name__ in self._reextracted_models()] or self.models
 
         for key, value in self.document_args.items():
             setattr(document, key, value)
 
     def postprocess_records(self, records, filename):
         if self.filter_results is not None and len(records):
-            records = self.filter_results(records)
+            with self.stage_timer.stage("filter"):
+                records = self.filter_results(records)
+        self.stage_timer.set("num_records_saved", len(records))
+        self.stage_timer.set("records_saved_by_model", records_by_model(records))
+        # When only some models are re-extracted, the others' records are kept
+        reextracted_models = self._reextracted_models()
+        kept_models = [model for model in self.models if reextracted_models and model.__name__ not in reextracted_models]
+        if self.output_layout == "sharded":
+            shard_writer = self._shard_writer()
+            paper_name = self.document_name(filename)
+            sharded_store = self._sharded_store_for_reading() if kept_models else None
+
+            def write():
+                kept_records = []
+                for model in kept_models:
+                    kept_records.extend(sharded_store.records_for_paper(paper_name, model))
+                for record in kept_records:
+                    strip_ids(record)
+                return shard_writer.write(paper_name, kept_records + list(records), self.fingerprint)
+        else:
+            db_name = self.db_name_for_file(filename)
+
+            def write():
+                return self._write_paper_database(db_name, records, kept_models)
+
+        self.submit_write(write, "db_write")
+
+    def _reextracted_models(self):
+        # Set by should_open_file on the current document's summary
+        summary = self.stage_timer.current_summary()
+        if summary is None:
+            return []
+        return summary.get("reextracted_models", [])
+
+    def _write_paper_database(self, db_name, records, kept_models):
+        fingerprint_path = db_name + FINGERPRINT_SUFFIX
+        if not os.path.lexists(db_name):
+            db = CDEDatabase(db_name, coder=JSONCoder())
+            db.write(records)
+            write_json_atomically(fingerprint_path, self.fingerprint)
+            return [db_name, fingerprint_path]
+
+        # Re-extracting, so the new database is written next to the old one and swapped in
+        old_db = CDEDatabase(db_name, coder=JSONCoder())
+        kept_records = []
+        for model in kept_models:
+            kept_records.extend(old_db.records(model).all())
+        for record in kept_records:
+            strip_ids(record)
+        new_db_name = f"{db_name}.reextracted"
+        replaced_db_name = f"{db_name}.replaced"
+        shutil.rmtree(new_db_name, ignore_errors=True)
+        db = CDEDatabase(new_db_name, coder=JSONCoder())
+        db.write(kept_records + list(records))
+        os.rename(db_name, replaced_db_name)
+        os.rename(new_db_name, db_name)
+        if os.path.islink(replaced_db_name):
+            os.unlink(replaced_db_name)
+        else:
+            shutil.rmtree(replaced_db_name)
+        write_json_atomically(fingerprint_path, self.fingerprint)
+        return [db_name, fingerprint_path]
+
+    def _sharded_store_for_reading(self):
+        # The shard index is read once per process rather than checking each paper
+        if self._sharded_store is None:
+            self._sharded_store = ShardedStore(self.save_root_dir)
+        return self._sharded_store
+
+    def _shard_writer(self):
+        # One per process, as the process pool sets each worker's rank after forking.
+        # Each run gets new shards, rather than a resumed run appending to the
+        # shards of the run before it.
+        key = (self.rank, os.getpid())
+        if key not in self._shard_writers:
+            writer_id = f"rank{self.rank}-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            self._shard_writers[key] = ShardWriter(self.save_root_dir, writer_id, self.papers_per_shard)
+        return self._shard_writers[key]
+
+    def close_outputs(self):
+        super().close_outputs()
+        # Forked workers inherit their parent's writers, which are the parent's to close
+        for key in [key for key in self._shard_writers if key[1] == os.getpid()]:
+            self._shard_writers.pop(key).close()
+
+    def discard_partial_output(self, filename):
+        if self.output_layout == "sharded":
+            # Papers are only added to the shard index once they've been fully
+            # written, so there's nothing to remove
+            return
         db_name = self.db_name_for_file(filename)
-        db = CDEDatabase(db_name, coder=JSONCoder())
-        db.write(records)
+        if os.path.islink(db_name):
+            os.unlink(db_name)
+        elif os.path.isdir(db_name):
+            print(f"Removing partially written {db_name}")
+            shutil.rmtree(db_name)
+        if os.path.lexists(db_name + FINGERPRINT_SUFFIX):
+            os.unlink(db_name + FINGERPRINT_SUFFIX)
+
+    def link_duplicate_outputs(self, duplicates):
+        if self.output_layout == "sharded":
+            # Duplicates get their own index entries pointing at the original's records
+            add_duplicate_papers(
+                self.save_root_dir,
+                {
+                    self.document_name(duplicate_path): self.document_name(canonical_path)
+                    for duplicate_path, canonical_path in duplicates.items()
+                }
+            )
+            return
+
+        for duplicate_path, canonical_path in duplicates.items():
+            db_name = self.db_name_for_file(canonical_path)
+            duplicate_db_name = self.db_name_for_file(duplicate_path)
+            if not os.path.isdir(db_name) or db_name == duplicate_db_name:
+                continue
+            if os.path.lexists(duplicate_db_name):
+                # e.g. it was linked in a previous run. A copy is replaced if the
+                # original has been re-extracted since.
+                if os.path.islink(duplicate_db_name) or read_json(duplicate_db_name + FINGERPRINT_SUFFIX) == read_json(db_name + FINGERPRINT_SUFFIX):
+                    continue
+                shutil.rmtree(duplicate_db_name)
+            for source, destination in [(db_name, duplicate_db_name), (db_name + FINGERPRINT_SUFFIX, duplicate_db_name + FINGERPRINT_SUFFIX)]:
+                if not os.path.exists(source):
+                    continue
+                if os.path.lexists(destination):
+                    os.unlink(destination)
+                if self.duplicate_output == "copy":
+                    if os.path.isdir(source):
+                        shutil.copytree(source, destination)
+                    else:
+                        shutil.copy(source, destination)
+                else:
+                    os.symlink(os.path.relpath(source, os.path.dirname(destination)), destination)
 
     def db_name_for_file(self, filename):
-        only_filename = os.path.split(filename)[-1]
-        no_ext_filename = os.path.splitext(only_filename)[0]
-        return os.path.join(self.save_root_dir, no_ext_filename)
+        return os.path.join(self.save_root_dir, self.document_name(filename))
@@ -0,0 +1,126 @@
+import hashlib
+import inspect
+
+import chemdataextractor
+
+# Bump this if the way fingerprints are computed changes, so that everything
+# extracted before is treated as out of date
+FINGERPRINT_VERSION = 1
+# Each per_paper output's fingerprint is kept next to its database
+FINGERPRINT_SUFFIX = ".fingerprint.json"
+
+
+class SourceUnavailable(Exception):
+    pass
+
+
+def _source(obj):
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        # e.g. it was defined in an interactive session. Its name alone would
+        # stay the same when it's edited, so whatever it's part of can't be
+        # fingerprinted.
+        raise SourceUnavailable(f"{getattr(obj, '__module__', None)}.{getattr(obj, '__qualname__', type(obj).__qualname__)}")
+
+
+def _describe(value, containers=()):
+    # A description of value that's the same from run to run (so no memory
+    # addresses). Other than containers, objects without their own __repr__ are
+    # only described by their class (and __version__, if they have one), as
+    # their attributes can be huge (e.g. a tagger's lexicon) or refer back to them.
+    if inspect.isclass(value) or inspect.isfunction(value) or inspect.ismethod(value):
+        return _source(value)
+    if isinstance(value, (dict, list, tuple, set, frozenset)):
+        if id(value) in containers:
+            return "<cycle>"
+        containers = containers + (id(value),)
+        if isinstance(value, dict):
+            items = sorted(value.items(), key=lambda item: repr(item[0]))
+            return "{" + ", ".join(f"{_describe(key, containers)}: {_describe(item, containers)}" for key, item in items) + "}"
+        items = [_describe(item, containers) for item in value]
+        if isinstance(value, (set, frozenset)):
+            items = sorted(items)
+        return f"{type(value).__name__}[{', '.join(items)}]"
+    if type(value).__repr__ is object.__repr__:
+        version = getattr(value, "__version__", None)
+        return f"{type(value).__module__}.{type(value).__qualname__}" + (f"({version})" if version is not None else "")
+    return repr(value)
+
+
+def _hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _nested_models(field):
+    # The models in a ModelType field, or in a ListType/SetType of them
+    model_class = getattr(field, "model_class", None)
+    if model_class is not None:
+        yield model_class
+    inner_field = getattr(field, "field", None)
+    if inner_field is not None:
+        yield from _nested_models(inner_field)
+
+
+def _model_definition(model, seen):
+    # The source of the model, its parsers and its base classes (other than
+    # CDE's own, which are covered by the CDE version), and of any models
+    # nested in its fields
+    if model in seen:
+        return []
+    seen.add(model)
+    parts = [
+        _source(cls) for cls in inspect.getmro(model)
+        if cls is not object and not cls.__module__.startswith("chemdataextractor.")
+    ]
+    for parser in getattr(model, "parsers", []):
+        parts.append(_source(type(parser)))
+    for field_name, field in sorted(getattr(model, "fields", {}).items()):
+        for nested_model in _nested_models(field):
+            parts.extend(_model_definition(nested_model, seen))
+    return parts
+
+
+def model_fingerprint(model):
+    # None if the source of the model or of something it uses can't be found, in
+    # which case its records are always treated as out of date
+    try:
+        return _hash("\n".join(_model_definition(model, set())))
+    except SourceUnavailable as e:
+        print(f"WARNING: couldn't find the source of {e}, so {model.__name__} will be re-extracted every time")
+        return None
+
+
+def _settings_fingerprint(settings):
+    try:
+        return _hash(_describe({"cde_version": getattr(chemdataextractor, "__version__", None), **settings}))
+    except SourceUnavailable as e:
+        print(f"WARNING: couldn't find the source of {e}, so every model will be re-extracted every time")
+        return None
+
+
+def extraction_fingerprint(models, **settings):
+    # settings are whatever else affects the records of every model, e.g. the
+    # document args and the filter function
+    return {
+        "version": FINGERPRINT_VERSION,
+        "settings": _settings_fingerprint(settings),
+        "models": {model.__name__: model_fingerprint(model) for model in models},
+    }
+
+
+def stale_models(stored_fingerprint, fingerprint):
+    # The names of the models whose records in an output with stored_fingerprint
+    # are out of date. If anything other than the models has changed, or can't be
+    # fingerprinted, they all are.
+    if (
+        fingerprint["settings"] is None
+        or stored_fingerprint.get("version") != fingerprint["version"]
+        or stored_fingerprint.get("settings") != fingerprint["settings"]
+    ):
+        return list(fingerprint["models"])
+    stored_models = stored_fingerprint.get("models", {})
+    return [
+        model_name for model_name, model_hash in fingerprint["models"].items()
+        if model_hash is None or stored_models.get(model_name) != model_hash
+    ]
@@ -0,0 +1,164 @@
+from e2e_workflow.extraction.json_files import JsonlAppender
+
+import contextlib
+import os
+import resource
+import threading
+import time
+
+
+def process_start_time():
+    # As a unix timestamp, or None if we can't tell (this needs /proc)
+    try:
+        with open("/proc/self/stat") as f:
+            # The process name can contain spaces, so split after it
+            fields = f.read().rsplit(")", 1)[1].split()
+        start_ticks = int(fields[19])
+        with open("/proc/stat") as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith("btime"))
+    except (OSError, ValueError, IndexError, StopIteration):
+        return None
+    return boot_time + start_ticks / os.sysconf("SC_CLK_TCK")
+
+
+def peak_rss_bytes():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def rss_bytes():
+    # Cheaper than memory_usage, for checking after every document
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryTracker:
+    # The resident memory of a worker after each of its documents
+    def __init__(self):
+        self.num_documents = 0
+        self.peak_rss_bytes = None
+        self._total_rss_bytes = 0
+        self._num_samples = 0
+
+    def record(self, rss):
+        self.num_documents += 1
+        if rss is None:
+            return
+        self.peak_rss_bytes = max(self.peak_rss_bytes or 0, rss)
+        self._total_rss_bytes += rss
+        self._num_samples += 1
+
+    def mean_rss_bytes(self):
+        return self._total_rss_bytes / self._num_samples if self._num_samples else None
+
+
+def records_by_model(records):
+    counts = {}
+    for record in records:
+        model_name = type(record).__name__
+        counts[model_name] = counts.get(model_name, 0) + 1
+    return counts
+
+
+def memory_usage():
+    # In bytes. Where /proc is available, this also splits the resident memory
+    # into what's shared with other processes (e.g. model weights inherited
+    # copy-on-write from the process we were forked from) and what's private.
+    usage = {"peak_rss_bytes": peak_rss_bytes()}
+    try:
+        values = {}
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    values[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except (OSError, ValueError):
+        return usage
+    usage["rss_bytes"] = values.get("Rss")
+    usage["pss_bytes"] = values.get("Pss")
+    usage["shared_bytes"] = values.get("Shared_Clean", 0) + values.get("Shared_Dirty", 0)
+    usage["private_bytes"] = values.get("Private_Clean", 0) + values.get("Private_Dirty", 0)
+    return usage
+
+
+# Times the stages of extracting a document. The timings go into the summary of
+# whichever document the current thread is working on, so this also works when
+# the pipelined workers run different stages of different documents at once.
+#
+# Stages can be nested (e.g. filter inside postprocess), in which case the outer
+# stage is only credited with the time not spent in the inner one, so that the
+# stage timings add up to the total.
+class StageTimer:
+    def __init__(self):
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def document(self, summary):
+        previous_summary = getattr(self._local, "summary", None)
+        self._local.summary = summary
+        self._local.stack = []
+        self._local.last_stage = None
+        try:
+            yield summary
+        finally:
+            self._local.summary = previous_summary
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        summary = getattr(self._local, "summary", None)
+        if summary is None:
+            yield
+            return
+
+        # Stays set if the stage raises, so we can report where a document failed
+        self._local.last_stage = name
+        stack = self._local.stack
+        stack.append([name, time.perf_counter(), 0.])
+        try:
+            yield
+        finally:
+            _, start_time, time_in_children = stack.pop()
+            elapsed = time.perf_counter() - start_time
+            stages = summary.setdefault("stages", {})
+            stages[name] = stages.get(name, 0.) + elapsed - time_in_children
+            if stack:
+                stack[-1][2] += elapsed
+
+    def current_summary(self):
+        return getattr(self._local, "summary", None)
+
+    def current_stage(self):
+        return getattr(self._local, "last_stage", None)
+
+    def set(self, key, value):
+        summary = getattr(self._local, "summary", None)
+        if summary is not None:
+            summary[key] = value
+
+
+# Writes one JSON line per document to a per-rank file, which run_report can
+# then merge.
+class MetricsWriter:
+    def __init__(self, metrics_dir):
+        self.metrics_dir = metrics_dir
+        if not os.path.isdir(metrics_dir):
+            os.makedirs(metrics_dir, exist_ok=True)
+        self._appender = JsonlAppender()
+
+    def metrics_path_for_rank(self, rank):
+        return os.path.join(self.metrics_dir, f"metrics-rank{rank}.jsonl")
+
+    def workers_path_for_rank(self, rank):
+        return os.path.join(self.metrics_dir, f"workers-rank{rank}.jsonl")
+
+    def write(self, summary):
+        self._appender.append(self.metrics_path_for_rank(summary["rank"]), summary)
+
+    def write_worker(self, worker_info):
+        # Startup time and memory use of each worker, written once it's ready
+        self._appender.append(self.workers_path_for_rank(worker_info["rank"]), worker_info)
+
+    def close(self):
+        self._appender.close()
@@ -0,0 +1,46 @@
+from e2e_workflow.extraction.json_files import JsonlAppender, read_jsonl
+
+import glob
+import os
+import time
+
+STARTED = "started"
+COMPLETED = "completed"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+
+
+# An append-only record of what happened to each document, so that a run can
+# be resumed without having to check for every output on the filesystem. Each
+# rank appends to its own file so that ranks never write to the same file.
+class RunJournal:
+    def __init__(self, journal_dir):
+        self.journal_dir = journal_dir
+        if not os.path.isdir(journal_dir):
+            os.makedirs(journal_dir, exist_ok=True)
+        self._appender = JsonlAppender()
+
+    def journal_path_for_rank(self, rank):
+        return os.path.join(self.journal_dir, f"journal-rank{rank}.jsonl")
+
+    def read_statuses(self):
+        # The latest entry for each document wins
+        statuses = {}
+        entries = read_jsonl(glob.glob(os.path.join(self.journal_dir, "journal-rank*.jsonl")))
+        entries.sort(key=lambda entry: entry["time"])
+        for entry in entries:
+            statuses[entry["document_path"]] = entry
+        return statuses
+
+    def record(self, document_path, status, rank, **kwargs):
+        entry = {
+            "document_path": document_path,
+            "status": status,
+            "rank": rank,
+            "time": time.time(),
+        }
+        entry.update(kwargs)
+        self._appender.append(self.journal_path_for_rank(rank), entry)
+
+    def close(self):
+        self._appender.close()
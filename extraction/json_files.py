@@ -0,0 +1,89 @@
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import uuid
+
+
+def write_json_atomically(path, data, temp_dir=None):
+    # Written to a uniquely named temporary file and renamed into place, so that
+    # readers never see it half-written, even if several processes write it at
+    # once. temp_dir (by default, the directory of path) must be on the same
+    # filesystem as path.
+    if temp_dir is None:
+        temp_dir = os.path.dirname(path) or "."
+    temp_path = os.path.join(temp_dir, f"{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def read_json(path):
+    # None if it doesn't exist or can't be parsed, e.g. it was truncated
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_jsonl(paths):
+    # Every line of each of the files in turn. Lines that can't be parsed (e.g. a
+    # partially written last line from a job that was killed) are skipped.
+    entries = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+    return entries
+
+
+@contextlib.contextmanager
+def file_lock(lock_path):
+    # Holds an exclusive lock on lock_path, waiting for it if need be
+    with open(lock_path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except OSError:
+            # Some shared filesystems don't support locks
+            yield
+            return
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Appends JSON lines to files, keeping each file open between writes. Each line
+# is flushed as soon as it's written. Files are opened again in a process that
+# has been forked, so that it doesn't share a file object with its parent.
+class JsonlAppender:
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def append(self, path, data):
+        with self._lock:
+            key = (path, os.getpid())
+            if key not in self._files:
+                self._files[key] = open(path, "a")
+            jsonl_file = self._files[key]
+            jsonl_file.write(json.dumps(data) + "\n")
+            jsonl_file.flush()
+
+    def close(self):
+        with self._lock:
+            for jsonl_file in self._files.values():
+                jsonl_file.close()
+            self._files = {}
@@ -0,0 +1,113 @@
+import queue
+import threading
+import time
+
+from e2e_workflow.extraction.watchdog import DocumentTimeout, time_limit
+
+# Put on a queue to show that there are no more documents coming
+_FINISHED = object()
+
+
+class _PipelineItem:
+    def __init__(self, summary):
+        self.summary = summary
+        self.doc = None
+        self.cache_key = None
+        self.records = None
+        self.should_save = False
+        self.elapsed = 0.
+
+
+# Runs the stages of extract_paper for several documents at once: a prefetch
+# thread reads and parses the next documents, the calling thread extracts the
+# records, and a write-behind thread persists them. The calling thread should
+# then spend almost all of its time in doc.records.
+#
+# Only the records stage runs in the calling thread, so that's the only stage
+# that document_timeout applies to.
+class DocumentPipeline:
+    def __init__(self, extractor, depth):
+        self.extractor = extractor
+        self.depth = max(depth, 1)
+
+    def run(self, document_paths, on_document_finished=None):
+        load_queue = queue.Queue(maxsize=self.depth)
+        save_queue = queue.Queue(maxsize=self.depth)
+        summaries = []
+
+        loader = threading.Thread(target=self._load_documents, args=(document_paths, load_queue), daemon=True)
+        saver = threading.Thread(
+            target=self._save_documents,
+            args=(save_queue,),
+            daemon=True
+        )
+        loader.start()
+        saver.start()
+
+        while True:
+            item = load_queue.get()
+            if item is _FINISHED:
+                break
+            if item.should_save:
+                self._extract_records(item)
+            save_queue.put(item)
+            # Callbacks are made from the calling thread, as they might e.g. use MPI
+            self.extractor._collect_finished_documents(summaries, on_document_finished)
+
+        save_queue.put(_FINISHED)
+        loader.join()
+        saver.join()
+        self.extractor._wait_for_finished_documents(summaries, on_document_finished)
+        return summaries
+
+    def _load_documents(self, document_paths, load_queue):
+        try:
+            for document_path in document_paths:
+                item = _PipelineItem(self.extractor._start_document_summary(document_path))
+                start_time = time.perf_counter()
+                with self.extractor.stage_timer.document(item.summary):
+                    try:
+                        loaded = self.extractor._load_document(document_path)
+                        if loaded is not None:
+                            item.doc, item.cache_key = loaded
+                            item.should_save = True
+                    except Exception as e:
+                        self.extractor._mark_document_failed(item.summary, self.extractor.stage_timer.current_stage(), e)
+                item.elapsed += time.perf_counter() - start_time
+                load_queue.put(item)
+        finally:
+            load_queue.put(_FINISHED)
+
+    def _extract_records(self, item):
+        document_path = item.summary["document_path"]
+        start_time = time.perf_counter()
+        with self.extractor.stage_timer.document(item.summary):
+            try:
+                # Only the records stage is profiled, as the others run in other threads
+                with self.extractor._profile_document(document_path, item.summary), time_limit(self.extractor.document_timeout):
+                    item.records = self.extractor._extract_document_records(item.doc, document_path)
+            except DocumentTimeout:
+                self.extractor._mark_document_timed_out(item.summary, "records")
+                item.should_save = False
+            except Exception as e:
+                self.extractor._mark_document_failed(item.summary, "records", e)
+                item.should_save = False
+        item.elapsed += time.perf_counter() - start_time
+
+    def _save_documents(self, save_queue):
+        while True:
+            item = save_queue.get()
+            if item is _FINISHED:
+                break
+            document_path = item.summary["document_path"]
+            start_time = time.perf_counter()
+            if item.should_save:
+                with self.extractor.stage_timer.document(item.summary):
+                    try:
+                        self.extractor._save_document(item.doc, item.records, document_path, item.cache_key)
+                    except Exception as e:
+                        self.extractor._mark_document_failed(item.summary, self.extractor.stage_timer.current_stage(), e)
+            item.elapsed += time.perf_counter() - start_time
+            print(f"{document_path} took: {item.elapsed:.3f}s of work (pipelined)")
+
+            self.extractor._document_done(item.summary, item.elapsed)
@@ -0,0 +1,86 @@
+from e2e_workflow.extraction.corpus import document_name
+
+import contextlib
+import cProfile
+import glob
+import os
+import pstats
+import sys
+import time
+import zlib
+
+
+# Profiles a sample of documents, and any document that takes longer than
+# slow_threshold seconds, dumping a profile for each to profile_dir under the
+# document's name.
+#
+# We can't know in advance whether a document will be slow, so setting
+# slow_threshold means every document is profiled (which slows extraction down)
+# and the profile is only kept for the slow ones.
+class DocumentProfiler:
+    def __init__(self, profile_dir, sample_rate=0., slow_threshold=None):
+        self.profile_dir = profile_dir
+        if not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir, exist_ok=True)
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+
+    def is_sampled(self, document_path):
+        # Hash rather than random so the same documents are sampled on every rank and every run
+        return zlib.crc32(document_path.encode("utf-8")) % 10000 < self.sample_rate * 10000
+
+    def profile_path(self, document_path, document_dir=None):
+        return os.path.join(self.profile_dir, document_name(document_path, document_dir) + ".prof")
+
+    @contextlib.contextmanager
+    def profile(self, document_path, summary=None, document_dir=None):
+        is_sampled = self.is_sampled(document_path)
+        if not is_sampled and self.slow_threshold is None:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        start_time = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start_time
+            if is_sampled or elapsed > self.slow_threshold:
+                profile_path = self.profile_path(document_path, document_dir)
+                profiler.dump_stats(profile_path)
+                if summary is not None:
+                    summary["profile_path"] = profile_path
+
+
+def merge_profiles(profile_dir, output_path=None, num_functions=30, sort_by="tottime"):
+    profile_paths = sorted(glob.glob(os.path.join(profile_dir, "**", "*.prof"), recursive=True))
+    if not profile_paths:
+        print(f"No profiles found in {profile_dir}")
+        return None
+
+    stats = pstats.Stats(profile_paths[0])
+    for profile_path in profile_paths[1:]:
+        stats.add(profile_path)
+    if output_path is not None:
+        stats.dump_stats(output_path)
+
+    print(f"Hottest functions across {len(profile_paths)} profiled documents:")
+    stats.sort_stats(sort_by).print_stats(num_functions)
+    return stats
+
+
+def main(args=None):
+    # python -m e2e_workflow.extraction.profiling PROFILE_DIR [MERGED_PROFILE]
+    if args is None:
+        args = sys.argv[1:]
+    if not args:
+        print("Usage: python -m e2e_workflow.extraction.profiling PROFILE_DIR [MERGED_PROFILE]")
+        return 1
+    merge_profiles(args[0], args[1] if len(args) > 1 else None)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
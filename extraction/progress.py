@@ -0,0 +1,124 @@
+import datetime
+import json
+import os
+import time
+
+from e2e_workflow.extraction.journal import COMPLETED, FAILED, TIMED_OUT
+from e2e_workflow.extraction.run_report import percentile
+
+
+class JsonlProgressSink:
+    def __init__(self, path):
+        self.path = path
+        progress_dir = os.path.dirname(path)
+        if progress_dir and not os.path.isdir(progress_dir):
+            os.makedirs(progress_dir, exist_ok=True)
+
+    def write(self, metrics):
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"time": time.time(), **metrics}) + "\n")
+
+
+class WandbProgressSink:
+    def write(self, metrics):
+        import wandb
+        wandb.log(metrics)
+
+
+# Collects the summaries of finished documents on the master and only passes
+# metrics on to the sinks (wandb, or a JSONL file) every interval seconds, so
+# that logging doesn't slow the master down when papers finish quickly.
+#
+# Each update has the overall progress (papers finished, failures, throughput
+# and an ETA once we know how many papers there are), and for the documents
+# that finished since the last update, the throughput, how busy each rank was
+# and percentiles of the stage timings. If we have the predicted cost of each
+# document, the ETA is based on how much of the predicted cost is done rather
+# than how many papers are, so that a few large papers at the start or end of
+# the run don't throw it off.
+class ProgressAggregator:
+    def __init__(self, sinks, interval=30.):
+        self.sinks = sinks
+        self.interval = interval
+        self.start_time = time.time()
+        self.total_documents = None
+        self.predicted_costs = None
+        self.predicted_cost_total = 0.
+        self.predicted_cost_finished = 0.
+        self.num_finished = 0
+        self.status_counts = {}
+        self._last_update_time = self.start_time
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_num_finished = 0
+        self._window_busy_time = {}
+        self._window_stage_times = {}
+
+    def set_total_documents(self, total_documents):
+        self.total_documents = total_documents
+
+    def set_predicted_costs(self, predicted_costs):
+        # The predicted cost of each document, keyed by its path
+        self.predicted_costs = predicted_costs
+        self.predicted_cost_total = sum(predicted_costs.values())
+
+    def record(self, summary, will_retry=False):
+        if not will_retry:
+            if self.predicted_costs is not None:
+                self.predicted_cost_finished += self.predicted_costs.get(summary["document_path"], 0.)
+            self.num_finished += 1
+            self._window_num_finished += 1
+            self.status_counts[summary["status"]] = self.status_counts.get(summary["status"], 0) + 1
+        rank = str(summary.get("rank"))
+        self._window_busy_time[rank] = self._window_busy_time.get(rank, 0.) + summary.get("elapsed", 0.)
+        for stage, stage_time in summary.get("stages", {}).items():
+            self._window_stage_times.setdefault(stage, []).append(stage_time)
+
+        if time.time() - self._last_update_time >= self.interval:
+            self.update()
+
+    def update(self):
+        now = time.time()
+        window_time = max(now - self._last_update_time, 1e-9)
+        run_time = max(now - self.start_time, 1e-9)
+        docs_per_second = self.num_finished / run_time
+
+        metrics = {
+            "num_papers_processed": self.num_finished,
+            "num_papers_completed": self.status_counts.get(COMPLETED, 0),
+            "num_papers_failed": self.status_counts.get(FAILED, 0),
+            "num_papers_timed_out": self.status_counts.get(TIMED_OUT, 0),
+            "docs_per_second": docs_per_second,
+            "window_docs_per_second": self._window_num_finished / window_time,
+            "elapsed_seconds": run_time,
+        }
+        if self.total_documents is not None:
+            metrics["total_papers"] = self.total_documents
+            if self.predicted_costs and self.predicted_cost_finished > 0:
+                metrics["predicted_fraction_done"] = self.predicted_cost_finished / self.predicted_cost_total
+                metrics["eta_seconds"] = run_time * max(self.predicted_cost_total - self.predicted_cost_finished, 0.) / self.predicted_cost_finished
+            elif docs_per_second > 0:
+                metrics["eta_seconds"] = max(self.total_documents - self.num_finished, 0) / docs_per_second
+        for rank, busy_time in self._window_busy_time.items():
+            metrics[f"busy_fraction/rank{rank}"] = min(busy_time / window_time, 1.)
+        for stage, stage_times in self._window_stage_times.items():
+            metrics[f"stages/{stage}/p50"] = percentile(stage_times, 0.5)
+            metrics[f"stages/{stage}/p90"] = percentile(stage_times, 0.9)
+
+        eta = metrics.get("eta_seconds")
+        print(
+            f"Progress: {self.num_finished}/{'?' if self.total_documents is None else self.total_documents} papers, "
+            f"{docs_per_second:.2f} papers/s, {metrics['num_papers_failed']} failed, "
+            f"{metrics['num_papers_timed_out']} timed out, "
+            f"ETA {'?' if eta is None else datetime.timedelta(seconds=round(eta))}"
+        )
+        for sink in self.sinks:
+            sink.write(metrics)
+
+        self._last_update_time = now
+        self._reset_window()
+
+    def close(self):
+        if self._window_num_finished or self._window_busy_time:
+            self.update()
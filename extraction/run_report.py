@@ -0,0 +1,220 @@
+from e2e_workflow.extraction.json_files import read_jsonl
+
+import glob
+import json
+import os
+import sys
+
+
+def load_metrics(metrics_dir):
+    return read_jsonl(sorted(glob.glob(os.path.join(metrics_dir, "metrics-rank*.jsonl"))))
+
+
+def load_worker_metrics(metrics_dir):
+    return read_jsonl(sorted(glob.glob(os.path.join(metrics_dir, "workers-rank*.jsonl"))))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(int(round(fraction * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def percentiles(values):
+    return {
+        "p50": percentile(values, 0.5),
+        "p90": percentile(values, 0.9),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def build_run_report(summaries, num_slowest=10, workers=None):
+    report = {"num_documents": len(summaries)}
+
+    status_counts = {}
+    for summary in summaries:
+        status_counts[summary["status"]] = status_counts.get(summary["status"], 0) + 1
+    report["status_counts"] = status_counts
+    report["cache_hits"] = sum(1 for summary in summaries if summary.get("used_cache"))
+
+    error_types = {}
+    for summary in summaries:
+        if summary.get("error_type"):
+            error_types[summary["error_type"]] = error_types.get(summary["error_type"], 0) + 1
+    report["error_types"] = error_types
+
+    for key in ["records_by_model", "records_saved_by_model"]:
+        counts = {}
+        for summary in summaries:
+            for model_name, count in summary.get(key, {}).items():
+                counts[model_name] = counts.get(model_name, 0) + count
+        report[key] = counts
+
+    elapsed = [summary["elapsed"] for summary in summaries]
+    report["document_time"] = percentiles(elapsed)
+    report["total_document_time"] = sum(elapsed)
+
+    stage_times = {}
+    for summary in summaries:
+        for stage, stage_time in summary.get("stages", {}).items():
+            stage_times.setdefault(stage, []).append(stage_time)
+    total_stage_time = sum(sum(times) for times in stage_times.values())
+    report["stages"] = {
+        stage: {
+            "total": sum(times),
+            "share": sum(times) / total_stage_time if total_stage_time else None,
+            **percentiles(times),
+        }
+        for stage, times in sorted(stage_times.items(), key=lambda item: -sum(item[1]))
+    }
+
+    # Only documents tagged by the batch tagger have tagged_sentences
+    tagged = [summary for summary in summaries if summary.get("tagged_sentences")]
+    if tagged:
+        num_tagged_sentences = sum(summary["tagged_sentences"] for summary in tagged)
+        tagging_time = sum(summary.get("stages", {}).get("tag", 0.) for summary in tagged)
+        report["batch_tagging"] = {
+            "num_sentences": num_tagged_sentences,
+            "tagging_time": tagging_time,
+            "sentences_per_second": num_tagged_sentences / tagging_time if tagging_time else None,
+            "batch_size": percentiles([summary["tag_batch_size"] for summary in tagged if summary.get("tag_batch_size")]),
+        }
+
+    slowest = sorted(summaries, key=lambda summary: summary["elapsed"], reverse=True)[:num_slowest]
+    report["slowest_documents"] = [
+        {
+            "document_path": summary["document_path"],
+            "elapsed": summary["elapsed"],
+            "size_bytes": summary.get("size_bytes"),
+            "num_records": summary.get("num_records"),
+            "rank": summary.get("rank"),
+            "stages": summary.get("stages", {}),
+        }
+        for summary in slowest
+    ]
+
+    # Utilisation is the time a rank spent on documents over the wall time of the run
+    start_times = [summary["start_time"] for summary in summaries if "start_time" in summary]
+    end_times = [summary["end_time"] for summary in summaries if "end_time" in summary]
+    wall_time = max(end_times) - min(start_times) if start_times and end_times else None
+    report["wall_time"] = wall_time
+    ranks = {}
+    rss_samples = {}
+    for summary in summaries:
+        rank = ranks.setdefault(summary.get("rank"), {"num_documents": 0, "busy_time": 0., "peak_rss_bytes": None})
+        rank["num_documents"] += 1
+        rank["busy_time"] += summary["elapsed"]
+        if summary.get("peak_rss_bytes") is not None:
+            rank["peak_rss_bytes"] = max(rank["peak_rss_bytes"] or 0, summary["peak_rss_bytes"])
+        if summary.get("rss_bytes") is not None:
+            rss_samples.setdefault(summary.get("rank"), []).append(summary["rss_bytes"])
+            rank["peak_rss_bytes"] = max(rank["peak_rss_bytes"] or 0, summary["rss_bytes"])
+        if summary.get("worker_recycled") is not None:
+            rank["recycled"] = summary["worker_recycled"]
+    for rank_id, rank in ranks.items():
+        rank["utilization"] = rank["busy_time"] / wall_time if wall_time else None
+        samples = rss_samples.get(rank_id)
+        rank["mean_rss_bytes"] = sum(samples) / len(samples) if samples else None
+    report["ranks"] = {str(rank): info for rank, info in sorted(ranks.items(), key=lambda item: str(item[0]))}
+    worker_recycles = {}
+    for summary in summaries:
+        if summary.get("worker_recycled") is not None:
+            worker_recycles[summary["worker_recycled"]] = worker_recycles.get(summary["worker_recycled"], 0) + 1
+    report["worker_recycles"] = worker_recycles
+
+    if workers:
+        report["workers"] = {"num_workers": len(workers), "num_forked": sum(1 for worker in workers if worker.get("forked"))}
+        for key in ["startup_seconds", "model_load_seconds", "peak_rss_bytes", "private_bytes", "shared_bytes"]:
+            report["workers"][key] = percentiles([worker[key] for worker in workers if worker.get(key) is not None])
+
+    return report
+
+
+def _format_seconds(value):
+    return "-" if value is None else f"{value:.3f}s"
+
+
+def _format_megabytes(value):
+    return "-" if value is None else f"{value / 2 ** 20:.0f}MB"
+
+
+def print_run_report(report):
+    print(f"Documents: {report['num_documents']} {report['status_counts']}, cache hits: {report['cache_hits']}")
+    if report["error_types"]:
+        print(f"Errors: {report['error_types']}")
+    if report["records_by_model"]:
+        print(f"Records extracted: {report['records_by_model']}")
+    if report["records_saved_by_model"]:
+        print(f"Records saved: {report['records_saved_by_model']}")
+    print(f"Wall time: {_format_seconds(report['wall_time'])}, total document time: {_format_seconds(report['total_document_time'])}")
+    document_time = report["document_time"]
+    print(
+        "Per document: "
+        + ", ".join(f"{key} {_format_seconds(value)}" for key, value in document_time.items())
+    )
+
+    print("\nStages:")
+    for stage, info in report["stages"].items():
+        share = "-" if info["share"] is None else f"{100 * info['share']:.1f}%"
+        print(
+            f"  {stage:<15} {share:>6}  total {_format_seconds(info['total'])}, "
+            f"p50 {_format_seconds(info['p50'])}, p90 {_format_seconds(info['p90'])}, max {_format_seconds(info['max'])}"
+        )
+
+    if "batch_tagging" in report:
+        tagging = report["batch_tagging"]
+        sentences_per_second = "-" if tagging["sentences_per_second"] is None else f"{tagging['sentences_per_second']:.1f}"
+        batch_size = tagging["batch_size"]
+        print(
+            f"\nBatch tagging: {tagging['num_sentences']} sentences in {_format_seconds(tagging['tagging_time'])} "
+            f"({sentences_per_second} sentences/s), batch size p50 {batch_size['p50']}, p90 {batch_size['p90']}, max {batch_size['max']}"
+        )
+
+    print("\nSlowest documents:")
+    for summary in report["slowest_documents"]:
+        print(
+            f"  {_format_seconds(summary['elapsed'])}  {summary['document_path']} "
+            f"({summary['size_bytes']} bytes, {summary['num_records']} records, rank {summary['rank']})"
+        )
+
+    print("\nRanks:")
+    for rank, info in report["ranks"].items():
+        utilization = "-" if info["utilization"] is None else f"{100 * info['utilization']:.1f}%"
+        print(
+            f"  {rank:>5}: {info['num_documents']} documents, busy {_format_seconds(info['busy_time'])} ({utilization}), "
+            f"peak RSS {_format_megabytes(info['peak_rss_bytes'])}, mean RSS {_format_megabytes(info['mean_rss_bytes'])}"
+            + (f", recycled ({info['recycled']})" if info.get("recycled") else "")
+        )
+    if report["worker_recycles"]:
+        print(f"Workers recycled: {report['worker_recycles']}")
+
+    if "workers" in report:
+        workers = report["workers"]
+        print(f"\nWorkers: {workers['num_workers']} ({workers['num_forked']} forked)")
+        for key in ["startup_seconds", "model_load_seconds"]:
+            print(f"  {key:<20} p50 {_format_seconds(workers[key]['p50'])}, max {_format_seconds(workers[key]['max'])}")
+        for key in ["peak_rss_bytes", "private_bytes", "shared_bytes"]:
+            print(f"  {key:<20} p50 {_format_megabytes(workers[key]['p50'])}, max {_format_megabytes(workers[key]['max'])}")
+
+
+def main(args=None):
+    # python -m e2e_workflow.extraction.run_report METRICS_DIR [REPORT_JSON]
+    if args is None:
+        args = sys.argv[1:]
+    if not args:
+        print("Usage: python -m e2e_workflow.extraction.run_report METRICS_DIR [REPORT_JSON]")
+        return 1
+
+    report = build_run_report(load_metrics(args[0]), workers=load_worker_metrics(args[0]))
+    print_run_report(report)
+    if len(args) > 1:
+        with open(args[1], "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+import argparse
+import datetime
+import heapq
+import os
+import sys
+
+from e2e_workflow.extraction.corpus import DocumentSource
+from e2e_workflow.extraction.json_files import file_lock, read_json, write_json_atomically
+
+SCHEDULING_POLICIES = ["largest_first"]
+# Only used until we've timed some documents; only the relative ordering of
+# estimates matters for scheduling.
+DEFAULT_SECONDS_PER_BYTE = 1e-5
+# The features a document's cost is predicted from once it has been parsed.
+# Before then, only its size and format are known.
+PARSED_FEATURES = ["size_bytes", "num_tables", "num_paragraphs"]
+# How many timed documents of a format we need before fitting a model for it
+MIN_DOCUMENTS_TO_FIT = 20
+# Keeps the fit stable when a feature barely varies, e.g. papers without tables
+RIDGE_PENALTY = 1e-6
+
+
+def document_format(document_path):
+    return os.path.splitext(document_path)[1].lower().lstrip(".")
+
+
+def document_features(document_path):
+    # The features we can get without opening the document
+    try:
+        size_bytes = os.path.getsize(document_path)
+    except OSError:
+        size_bytes = 0
+    return {"size_bytes": size_bytes, "format": document_format(document_path)}
+
+
+def _solve(matrix, vector):
+    # Gaussian elimination with partial pivoting, for the small systems in fit_linear
+    n = len(vector)
+    rows = [list(matrix[i]) + [vector[i]] for i in range(n)]
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda row: abs(rows[row][col]))
+        if abs(rows[pivot][col]) < 1e-300:
+            return None
+        rows[col], rows[pivot] = rows[pivot], rows[col]
+        for row in range(col + 1, n):
+            factor = rows[row][col] / rows[col][col]
+            for k in range(col, n + 1):
+                rows[row][k] -= factor * rows[col][k]
+    solution = [0.] * n
+    for row in reversed(range(n)):
+        solution[row] = (rows[row][n] - sum(rows[row][k] * solution[k] for k in range(row + 1, n))) / rows[row][row]
+    return solution
+
+
+def fit_linear(rows, targets):
+    # Least squares fit of targets to an intercept plus the columns of rows, with
+    # the columns scaled to be comparable. Returns the intercept and coefficients.
+    num_features = len(rows[0])
+    scales = [max(max(abs(row[i]) for row in rows), 1e-12) for i in range(num_features)]
+    design = [[1.] + [row[i] / scales[i] for i in range(num_features)] for row in rows]
+    normal_matrix = [
+        [sum(x[i] * x[j] for x in design) + (RIDGE_PENALTY * len(rows) if i == j and i > 0 else 0.) for j in range(num_features + 1)]
+        for i in range(num_features + 1)
+    ]
+    normal_vector = [sum(x[i] * y for x, y in zip(design, targets)) for i in range(num_features + 1)]
+    solution = _solve(normal_matrix, normal_vector)
+    if solution is None:
+        return None
+    return solution[0], [solution[i + 1] / scales[i] for i in range(num_features)]
+
+
+class CostEstimator:
+    # Estimates how long a document will take to process. Documents we've timed
+    # before use their past timings. Other documents are predicted from their
+    # format and size, and from their number of tables and paragraphs if they've
+    # been parsed before (e.g. when warming the cache), using a linear model for
+    # each format fitted to the documents timed in past runs. Until there are
+    # enough of those, the average seconds per byte is used instead.
+    def __init__(self, history_path=None):
+        self.history_path = history_path
+        # The features and last timing (if any) of every document we've seen
+        self.documents = {}
+        self.total_seconds = 0.
+        self.total_bytes = 0
+        self._models = None
+        # The documents recorded since the history was loaded
+        self._updated_keys = set()
+        if history_path is not None and os.path.exists(history_path):
+            history = read_json(history_path)
+            if not isinstance(history, dict) or "total_seconds" not in history:
+                # e.g. it was truncated by a crash, which shouldn't stop the run starting
+                print(f"Ignoring the cost history in {history_path}, as it couldn't be read")
+                return
+            if "documents" in history:
+                self.documents = history["documents"]
+            else:
+                # Histories from before we kept any features
+                self.documents = {
+                    key: {**document_features(key), "elapsed": elapsed}
+                    for key, elapsed in history["document_timings"].items()
+                }
+            self.total_seconds = history["total_seconds"]
+            self.total_bytes = history["total_bytes"]
+
+    def seconds_per_byte(self, document_format=None):
+        if document_format is not None:
+            models = self._fitted_models()
+            if document_format in models:
+                return models[document_format]["seconds_per_byte"]
+        if self.total_bytes == 0 or self.total_seconds == 0:
+            return DEFAULT_SECONDS_PER_BYTE
+        return self.total_seconds / self.total_bytes
+
+    def estimate(self, document_path):
+        document = self.documents.get(self._key_for_document(document_path))
+        if document is not None and document.get("elapsed") is not None:
+            return document["elapsed"]
+        features = document_features(document_path)
+        if document is not None:
+            features = {**document, **features}
+        return self.predict(features)
+
+    def predict(self, features):
+        model = self._fitted_models().get(features["format"])
+        if model is not None:
+            if model["parsed"] is not None and all(features.get(name) is not None for name in PARSED_FEATURES):
+                intercept, coefficients = model["parsed"]
+                prediction = intercept + sum(c * features[name] for c, name in zip(coefficients, PARSED_FEATURES))
+                if prediction > 0:
+                    return prediction
+            if model["size"] is not None:
+                intercept, (coefficient,) = model["size"]
+                prediction = intercept + coefficient * features["size_bytes"]
+                if prediction > 0:
+                    return prediction
+        return features["size_bytes"] * self.seconds_per_byte(features["format"])
+
+    def record(self, document_path, elapsed, parsed_features=None):
+        key = self._key_for_document(document_path)
+        try:
+            size = os.path.getsize(document_path)
+        except OSError:
+            return
+        document = self.documents.get(key, {})
+        if document.get("elapsed") is not None:
+            self.total_seconds -= document["elapsed"]
+        else:
+            self.total_bytes += size
+        self._updated_keys.add(key)
+        self.documents[key] = {
+            **document,
+            **(parsed_features or {}),
+            "size_bytes": size,
+            "format": document_format(document_path),
+            "elapsed": elapsed,
+        }
+        self.total_seconds += elapsed
+        self._models = None
+
+    def record_features(self, document_path, parsed_features):
+        # For documents that were parsed but not timed, e.g. when warming the cache
+        key = self._key_for_document(document_path)
+        self._updated_keys.add(key)
+        self.documents[key] = {
+            **self.documents.get(key, {}),
+            **parsed_features,
+            **document_features(document_path),
+        }
+
+    def save(self):
+        if self.history_path is None:
+            return
+        # Several processes may share a history (e.g. with the file queue
+        # backend), each having timed different documents, so we merge with
+        # whatever has been saved since we loaded it, holding a lock so that
+        # processes saving at the same time don't lose each other's timings
+        with file_lock(self.history_path + ".lock"):
+            if os.path.exists(self.history_path):
+                saved = CostEstimator(self.history_path)
+                self.documents = {**saved.documents, **{key: self.documents[key] for key in self._updated_keys}}
+                timed = [document for document in self.documents.values() if document.get("elapsed") is not None]
+                self.total_seconds = sum(document["elapsed"] for document in timed)
+                self.total_bytes = sum(document["size_bytes"] for document in timed)
+                self._models = None
+            history = {
+                "documents": self.documents,
+                "total_seconds": self.total_seconds,
+                "total_bytes": self.total_bytes,
+            }
+            write_json_atomically(self.history_path, history)
+
+    def predict_run(self, document_paths, num_workers=None):
+        # The predicted total processing time and wall time of extracting
+        # document_paths with num_workers workers (if we know how many), largest first
+        costs = sorted((self.estimate(document_path) for document_path in document_paths), reverse=True)
+        num_timed = sum(
+            1 for document_path in document_paths
+            if self.documents.get(self._key_for_document(document_path), {}).get("elapsed") is not None
+        )
+        return {
+            "num_documents": len(costs),
+            "num_timed_before": num_timed,
+            "total_seconds": sum(costs),
+            "makespan_seconds": None if num_workers is None else simulated_makespan(costs, num_workers),
+            "num_workers": num_workers,
+        }
+
+    def _fitted_models(self):
+        if self._models is None:
+            self._models = self._fit_models()
+        return self._models
+
+    def _fit_models(self):
+        timed_by_format = {}
+        for document in self.documents.values():
+            if document.get("elapsed") is not None and document.get("format") is not None:
+                timed_by_format.setdefault(document["format"], []).append(document)
+
+        models = {}
+        for format_name, documents in timed_by_format.items():
+            total_bytes = sum(document["size_bytes"] for document in documents)
+            model = {
+                "seconds_per_byte": self.seconds_per_byte() if total_bytes == 0 else sum(document["elapsed"] for document in documents) / total_bytes,
+                "size": None,
+                "parsed": None,
+            }
+            if len(documents) >= MIN_DOCUMENTS_TO_FIT:
+                model["size"] = fit_linear([[document["size_bytes"]] for document in documents], [document["elapsed"] for document in documents])
+                parsed = [document for document in documents if all(document.get(name) is not None for name in PARSED_FEATURES)]
+                if len(parsed) >= MIN_DOCUMENTS_TO_FIT:
+                    model["parsed"] = fit_linear(
+                        [[document[name] for name in PARSED_FEATURES] for document in parsed],
+                        [document["elapsed"] for document in parsed]
+                    )
+            models[format_name] = model
+        return models
+
+    def _key_for_document(self, document_path):
+        return os.path.abspath(document_path)
+
+
+def order_largest_first(document_paths, estimator):
+    return sorted(document_paths, key=estimator.estimate, reverse=True)
+
+
+def simulated_makespan(costs, num_workers):
+    # Greedy list scheduling, i.e. each document goes to whichever worker frees
+    # up first, which is what the dispatchers do.
+    worker_finish_times = [0.] * max(num_workers, 1)
+    for cost in costs:
+        earliest = heapq.heappop(worker_finish_times)
+        heapq.heappush(worker_finish_times, earliest + cost)
+    return max(worker_finish_times)
+
+
+def simulated_idle_time(costs, num_workers):
+    return max(num_workers, 1) * simulated_makespan(costs, num_workers) - sum(costs)
+
+
+def scheduling_summary(original_order, scheduled_order, timings, num_workers):
+    # Compares idle time for the order we'd have used without scheduling and the
+    # scheduled order, using the actual timings from this run.
+    original_costs = [timings[path] for path in original_order if path in timings]
+    scheduled_costs = [timings[path] for path in scheduled_order if path in timings]
+    original_idle = simulated_idle_time(original_costs, num_workers)
+    scheduled_idle = simulated_idle_time(scheduled_costs, num_workers)
+    return {
+        "original_makespan": simulated_makespan(original_costs, num_workers),
+        "scheduled_makespan": simulated_makespan(scheduled_costs, num_workers),
+        "original_idle_time": original_idle,
+        "scheduled_idle_time": scheduled_idle,
+        "idle_time_saved": original_idle - scheduled_idle,
+    }
+
+
+def format_duration(seconds):
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
+def print_run_prediction(prediction, workers_per_node=None, margin=0.):
+    wall_time = ""
+    if prediction["makespan_seconds"] is not None:
+        wall_time = f", taking {format_duration(prediction['makespan_seconds'])} on {prediction['num_workers']} workers"
+    print(
+        f"Predicted {format_duration(prediction['total_seconds'])} of extraction for {prediction['num_documents']} papers "
+        f"({prediction['num_timed_before']} timed in earlier runs){wall_time}"
+    )
+    if workers_per_node is not None and prediction["makespan_seconds"] is not None:
+        num_nodes = -(-prediction["num_workers"] // workers_per_node)
+        node_hours = num_nodes * prediction["makespan_seconds"] * (1 + margin) / 3600
+        print(f"That's {node_hours:.1f} node-hours on {num_nodes} nodes (including a {margin:.0%} margin)")
+
+
+def main(args=None):
+    # Predicts how long extracting a corpus will take from a cost history, e.g. to
+    # decide how many node-hours to ask for before submitting a job
+    parser = argparse.ArgumentParser(prog="python -m e2e_workflow.extraction.scheduling")
+    parser.add_argument("cost_history", help="The cost_history_path of earlier runs")
+    parser.add_argument("--document-dir")
+    parser.add_argument("--manifest")
+    parser.add_argument("--recursive", action="store_true")
+    parser.add_argument("--workers", type=int, required=True, help="The number of workers extracting")
+    parser.add_argument("--workers-per-node", type=int)
+    parser.add_argument("--margin", type=float, default=0.2, help="Extra time to ask for, as a fraction of the prediction")
+    args = parser.parse_args(args)
+
+    document_paths = list(DocumentSource(document_dir=args.document_dir, manifest=args.manifest, recursive=args.recursive))
+    prediction = CostEstimator(args.cost_history).predict_run(document_paths, args.workers)
+    print_run_prediction(prediction, args.workers_per_node, args.margin)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,206 @@
+from cdedatabase import CDEDatabase, JSONCoder
+from chemdataextractor.model import ModelType, ListType, SetType
+from e2e_workflow.extraction.corpus import document_name
+from e2e_workflow.extraction.fingerprint import FINGERPRINT_SUFFIX
+from e2e_workflow.extraction.json_files import read_json, read_jsonl, write_json_atomically
+
+import glob
+import json
+import os
+import time
+
+SHARDS_DIR_NAME = "shards"
+INDEX_DIR_NAME = "index"
+OUTPUT_LAYOUTS = ["per_paper", "sharded"]
+
+
+def paper_name_for_file(filename, document_dir=None):
+    return document_name(filename, document_dir)
+
+
+def papers_list(directory):
+    return [folder for folder in os.listdir(directory) if os.path.isdir(os.path.join(directory, folder))]
+
+
+# Writes the records for many papers into a small number of CDEDatabases rather
+# than one per paper. Each writer (i.e. each rank, in each run) has its own
+# shards, starting a new one every papers_per_shard papers if that's set.
+#
+# Which records belong to which paper is kept in a per-writer index file. The
+# index entry is only written once the records have been written, so papers
+# that were only partially written never show up in the index.
+class ShardWriter:
+    def __init__(self, root_dir, writer_id, papers_per_shard=None):
+        self.root_dir = root_dir
+        self.writer_id = writer_id
+        self.papers_per_shard = papers_per_shard
+        self.num_papers_written = 0
+        os.makedirs(os.path.join(root_dir, SHARDS_DIR_NAME), exist_ok=True)
+        os.makedirs(os.path.join(root_dir, INDEX_DIR_NAME), exist_ok=True)
+        self.index_path = os.path.join(root_dir, INDEX_DIR_NAME, f"index-{writer_id}.jsonl")
+        self._index_file = open(self.index_path, "a")
+        self._databases = {}
+
+    def current_shard_name(self):
+        shard_number = 0
+        if self.papers_per_shard is not None:
+            shard_number = self.num_papers_written // self.papers_per_shard
+        return f"shard-{self.writer_id}-{shard_number:05d}"
+
+    def shard_path(self, shard_name):
+        return os.path.join(self.root_dir, SHARDS_DIR_NAME, shard_name)
+
+    def _database(self, shard_name):
+        if shard_name not in self._databases:
+            # Only keep the shard we're currently writing to open
+            self._databases = {}
+            self._databases[shard_name] = CDEDatabase(self.shard_path(shard_name), coder=JSONCoder())
+        return self._databases[shard_name]
+
+    def write(self, paper_name, records, fingerprint=None):
+        # Returns the paths that were written to
+        shard_name = self.current_shard_name()
+        self._database(shard_name).write(records)
+
+        ids = {}
+        for record in records:
+            ids.setdefault(type(record).__name__, []).append(getattr(record, "_id", None))
+        entry = {"paper": paper_name, "shard": shard_name, "ids": ids, "written_at": time.time()}
+        if fingerprint is not None:
+            entry["fingerprint"] = fingerprint
+        self._index_file.write(json.dumps(entry) + "\n")
+        self._index_file.flush()
+        self.num_papers_written += 1
+        return [self.shard_path(shard_name), self.index_path]
+
+    def close(self):
+        self._index_file.close()
+        self._databases = {}
+
+
+# Reads records back out of a sharded output directory. The index for all the
+# shards is read once, after which finding a paper's records is a single lookup.
+# If a paper has been written more than once (e.g. it was re-extracted after
+# its models changed), the latest entry wins.
+class ShardedStore:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.index = {}
+        self._records_by_id = {}
+        for entry in read_jsonl(sorted(glob.glob(os.path.join(root_dir, INDEX_DIR_NAME, "index-*.jsonl")))):
+            previous_entry = self.index.get(entry["paper"])
+            if previous_entry is None or entry.get("written_at", 0.) >= previous_entry.get("written_at", 0.):
+                self.index[entry["paper"]] = entry
+
+    def papers(self):
+        return sorted(self.index.keys())
+
+    def has_paper(self, paper_name):
+        return paper_name in self.index
+
+    def fingerprint_for_paper(self, paper_name):
+        return self.index[paper_name].get("fingerprint")
+
+    def shard_for_paper(self, paper_name):
+        return self.index[paper_name]["shard"]
+
+    def database_for_shard(self, shard_name):
+        return CDEDatabase(os.path.join(self.root_dir, SHARDS_DIR_NAME, shard_name), coder=JSONCoder())
+
+    def records_for_paper(self, paper_name, model, database=None):
+        entry = self.index[paper_name]
+        ids = entry["ids"].get(model.__name__, [])
+        if not ids:
+            return []
+        if database is None:
+            records_by_id = self._shard_records(entry["shard"], model)
+        else:
+            records_by_id = {record._id: record for record in database.records(model).all()}
+        return [records_by_id[record_id] for record_id in ids if record_id in records_by_id]
+
+    def _shard_records(self, shard_name, model):
+        # Each shard's records are only read once (for each model) rather than for
+        # every paper looked up in it, e.g. when re-extracting many papers
+        key = (shard_name, model.__name__)
+        if key not in self._records_by_id:
+            database = self.database_for_shard(shard_name)
+            self._records_by_id[key] = {record._id: record for record in database.records(model).all()}
+        return self._records_by_id[key]
+
+
+def add_duplicate_papers(root_dir, duplicates):
+    # duplicates maps the name of each duplicate paper to the name of the paper
+    # it duplicates, whose records it shares
+    store = ShardedStore(root_dir)
+    with open(os.path.join(root_dir, INDEX_DIR_NAME, "index-duplicates.jsonl"), "a") as index_file:
+        for paper_name, original_paper_name in duplicates.items():
+            if original_paper_name not in store.index:
+                continue
+            if paper_name in store.index:
+                entry = store.index[paper_name]
+                # Unless the original has been re-extracted since it was added
+                if entry.get("duplicate_of") != original_paper_name or entry.get("written_at") == store.index[original_paper_name].get("written_at"):
+                    continue
+            entry = dict(store.index[original_paper_name])
+            entry["paper"] = paper_name
+            entry["duplicate_of"] = original_paper_name
+            index_file.write(json.dumps(entry) + "\n")
+
+
+def strip_ids(record):
+    # So that records read from one database are written as new records in another
+    record.__dict__.pop("_id", None)
+    for field_name, field in record.fields.items():
+        value = record[field_name]
+        if not value:
+            continue
+        if isinstance(field, ModelType):
+            strip_ids(value)
+        elif (isinstance(field, ListType) or isinstance(field, SetType)) and isinstance(field.field, ModelType):
+            for item in value:
+                strip_ids(item)
+
+
+def convert_to_sharded(per_paper_dir, sharded_dir, models, papers_per_shard=None, writer_id="converted"):
+    writer = ShardWriter(sharded_dir, writer_id, papers_per_shard)
+    for paper_name in sorted(papers_list(per_paper_dir)):
+        db = CDEDatabase(os.path.join(per_paper_dir, paper_name), coder=JSONCoder())
+        records = []
+        for model in models:
+            records.extend(db.records(model).all())
+        for record in records:
+            strip_ids(record)
+        fingerprint = read_json(os.path.join(per_paper_dir, paper_name + FINGERPRINT_SUFFIX))
+        writer.write(paper_name, records, fingerprint)
+    writer.close()
+
+
+def convert_to_per_paper(sharded_dir, per_paper_dir, models):
+    store = ShardedStore(sharded_dir)
+    if not os.path.isdir(per_paper_dir):
+        os.makedirs(per_paper_dir)
+    papers_by_shard = {}
+    for paper_name in store.papers():
+        papers_by_shard.setdefault(store.shard_for_paper(paper_name), []).append(paper_name)
+
+    for shard_name, paper_names in papers_by_shard.items():
+        # Read each shard once rather than once per paper
+        shard_db = store.database_for_shard(shard_name)
+        records_by_id = {}
+        for model in models:
+            records_by_id[model.__name__] = {record._id: record for record in shard_db.records(model).all()}
+
+        for paper_name in paper_names:
+            records = []
+            for model in models:
+                model_records = records_by_id[model.__name__]
+                for record_id in store.index[paper_name]["ids"].get(model.__name__, []):
+                    if record_id in model_records:
+                        records.append(model_records[record_id])
+            for record in records:
+                strip_ids(record)
+            db = CDEDatabase(os.path.join(per_paper_dir, paper_name), coder=JSONCoder())
+            db.write(records)
+            fingerprint = store.fingerprint_for_paper(paper_name)
+            if fingerprint is not None:
+                write_json_atomically(os.path.join(per_paper_dir, paper_name + FINGERPRINT_SUFFIX), fingerprint)
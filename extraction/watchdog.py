@@ -0,0 +1,33 @@
+import contextlib
+import signal
+import threading
+
+TIMEOUT_POLICIES = ["quarantine", "requeue"]
+
+
+# Derives from BaseException rather than Exception so that it isn't swallowed
+# by the catch-all exception handlers in parsers etc.
+class DocumentTimeout(BaseException):
+    pass
+
+
+def _raise_document_timeout(signum, frame):
+    raise DocumentTimeout()
+
+
+@contextlib.contextmanager
+def time_limit(seconds):
+    # Uses SIGALRM, so it can only interrupt Python code running in the main
+    # thread. Long-running C calls (e.g. a single regex match) are interrupted
+    # as soon as they return control to Python.
+    if seconds is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    previous_handler = signal.signal(signal.SIGALRM, _raise_document_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
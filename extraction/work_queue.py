@@ -0,0 +1,221 @@
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+
+from e2e_workflow.extraction.json_files import write_json_atomically
+
+QUEUE_DIR_NAME = "queue"
+POPULATING_DIR_NAME = "populating"
+PENDING_DIR_NAME = "pending"
+CLAIMED_DIR_NAME = "claimed"
+DONE_DIR_NAME = "done"
+FAILED_DIR_NAME = "failed"
+# Separates the task name from its owner in the names of claimed tasks
+OWNER_SEPARATOR = "@"
+DEFAULT_LEASE_SECONDS = 10 * 60
+# A task whose lease has expired this many times is probably killing whoever
+# claims it (e.g. a paper that runs the node out of memory), so it's given up on
+MAX_RECLAIMS = 2
+
+
+def default_owner():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+# A queue of tasks in a directory on a shared filesystem, for any number of
+# independently launched processes to work through, e.g. array jobs on a
+# cluster without a working MPI. Processes can join at any time.
+#
+# One process populates the queue; the others wait for it. A task is a JSON
+# file in pending/, and is claimed by renaming it into claimed/ with the
+# claimer's name, which only one process can do. The claimer's lease on the
+# task is the file's mtime, which a heartbeat thread keeps touching. Any
+# process that runs out of pending tasks moves tasks whose leases have expired
+# (e.g. because their node crashed) back to pending/, so a task can be done
+# more than once if its claimer stalls for longer than the lease. Tasks that
+# have been reclaimed more than max_reclaims times are moved to failed/.
+class FileWorkQueue:
+    def __init__(self, queue_dir, lease_seconds=DEFAULT_LEASE_SECONDS, owner=None, poll_interval=5., max_reclaims=MAX_RECLAIMS):
+        self.queue_dir = queue_dir
+        self.lease_seconds = lease_seconds
+        self.max_reclaims = max_reclaims
+        self.owner = owner if owner is not None else default_owner()
+        self.poll_interval = poll_interval
+        self.num_claimed = 0
+        self.num_completed = 0
+        self.num_reclaimed = 0
+        os.makedirs(queue_dir, exist_ok=True)
+        self._queue_root = os.path.join(queue_dir, QUEUE_DIR_NAME)
+        self._listing = deque()
+        self._held = {}
+        self._lock = threading.Lock()
+        self._heartbeat_thread = None
+        self._stop_heartbeat = threading.Event()
+
+    def _path(self, dir_name, *names):
+        return os.path.join(self._queue_root, dir_name, *names)
+
+    def join(self, populate):
+        # populate returns the tasks to add to the queue (each a JSON-serialisable
+        # dict), and is only called in one of the processes that join the queue.
+        # Returns whether it was called in this one.
+        populating_dir = os.path.join(self.queue_dir, POPULATING_DIR_NAME)
+        while not os.path.isdir(self._queue_root):
+            try:
+                os.mkdir(populating_dir)
+            except FileExistsError:
+                if self._is_expired(populating_dir):
+                    # Whoever was populating the queue has died
+                    self._remove(populating_dir)
+                else:
+                    time.sleep(self.poll_interval)
+                continue
+
+            self._hold(POPULATING_DIR_NAME, populating_dir)
+            staging_dir = os.path.join(self.queue_dir, f"staging-{uuid.uuid4().hex}")
+            try:
+                for dir_name in [PENDING_DIR_NAME, CLAIMED_DIR_NAME, DONE_DIR_NAME, FAILED_DIR_NAME]:
+                    os.makedirs(os.path.join(staging_dir, dir_name))
+                for task_index, task in enumerate(populate()):
+                    with open(os.path.join(staging_dir, PENDING_DIR_NAME, f"{task_index:09d}.json"), "w") as f:
+                        json.dump(task, f)
+                try:
+                    os.rename(staging_dir, self._queue_root)
+                except OSError:
+                    # We took too long, and someone else took over and populated it
+                    return False
+                return True
+            finally:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                self._release(POPULATING_DIR_NAME)
+                try:
+                    os.rmdir(populating_dir)
+                except OSError:
+                    pass
+        return False
+
+    def claim(self):
+        # Returns the name and the task, or None if there are no pending tasks
+        for _ in range(2):
+            if not self._listing:
+                self._listing = deque(sorted(os.listdir(self._path(PENDING_DIR_NAME))))
+            while self._listing:
+                task_name = self._listing.popleft()
+                pending_path = self._path(PENDING_DIR_NAME, task_name)
+                claimed_path = self._path(CLAIMED_DIR_NAME, f"{task_name}{OWNER_SEPARATOR}{self.owner}")
+                try:
+                    # Start the lease before the task is claimed, or its old mtime
+                    # could make it look expired
+                    os.utime(pending_path)
+                    os.rename(pending_path, claimed_path)
+                except FileNotFoundError:
+                    # Someone else claimed it first
+                    continue
+                with open(claimed_path) as f:
+                    task = json.load(f)
+                self._hold(task_name, claimed_path)
+                self.num_claimed += 1
+                return task_name, task
+        return None
+
+    def complete(self, task_name):
+        self._release(task_name)
+        claimed_path = self._path(CLAIMED_DIR_NAME, f"{task_name}{OWNER_SEPARATOR}{self.owner}")
+        try:
+            os.rename(claimed_path, self._path(DONE_DIR_NAME, task_name))
+        except FileNotFoundError:
+            print(f"The lease on {task_name} expired before it was completed, so it may be done again")
+            return
+        self.num_completed += 1
+
+    def add(self, task):
+        # Added tasks are claimed after the tasks the queue was populated with
+        task_name = f"r{time.time_ns()}-{uuid.uuid4().hex[:8]}.json"
+        # Written outside pending/ so that nobody claims it half-written
+        write_json_atomically(self._path(PENDING_DIR_NAME, task_name), task, self.queue_dir)
+
+    def reclaim_expired(self):
+        # Returns how many tasks were moved back to pending
+        num_reclaimed = 0
+        for claimed_name in os.listdir(self._path(CLAIMED_DIR_NAME)):
+            claimed_path = self._path(CLAIMED_DIR_NAME, claimed_name)
+            if not self._is_expired(claimed_path):
+                continue
+            task_name = claimed_name.rsplit(OWNER_SEPARATOR, 1)[0]
+            # Moved out of claimed/ first, so that only one process reclaims it
+            reclaiming_path = os.path.join(self.queue_dir, f"reclaiming-{uuid.uuid4().hex}")
+            try:
+                os.rename(claimed_path, reclaiming_path)
+            except FileNotFoundError:
+                continue
+            with open(reclaiming_path) as f:
+                task = json.load(f)
+            task["num_reclaims"] = task.get("num_reclaims", 0) + 1
+            if task["num_reclaims"] > self.max_reclaims:
+                print(f"Giving up on {task_name}, as its lease has expired {task['num_reclaims']} times: {task}")
+                os.rename(reclaiming_path, self._path(FAILED_DIR_NAME, task_name))
+                continue
+            write_json_atomically(self._path(PENDING_DIR_NAME, task_name), task, self.queue_dir)
+            os.remove(reclaiming_path)
+            num_reclaimed += 1
+        self.num_reclaimed += num_reclaimed
+        return num_reclaimed
+
+    def is_finished(self):
+        return not os.listdir(self._path(PENDING_DIR_NAME)) and not os.listdir(self._path(CLAIMED_DIR_NAME))
+
+    def status(self):
+        return {
+            dir_name: len(os.listdir(self._path(dir_name)))
+            for dir_name in [PENDING_DIR_NAME, CLAIMED_DIR_NAME, DONE_DIR_NAME, FAILED_DIR_NAME]
+        }
+
+    def close(self):
+        self._stop_heartbeat.set()
+        if self._heartbeat_thread is not None:
+            self._heartbeat_thread.join()
+            self._heartbeat_thread = None
+
+    def _is_expired(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime > self.lease_seconds
+        except FileNotFoundError:
+            return False
+
+    def _remove(self, path):
+        # Renamed out of the way first, so that only one process removes it
+        removed_path = os.path.join(self.queue_dir, f"removed-{uuid.uuid4().hex}")
+        try:
+            os.rename(path, removed_path)
+        except OSError:
+            return
+        shutil.rmtree(removed_path, ignore_errors=True)
+
+    def _hold(self, name, path):
+        with self._lock:
+            self._held[name] = path
+        if self._heartbeat_thread is None:
+            self._stop_heartbeat.clear()
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, daemon=True)
+            self._heartbeat_thread.start()
+
+    def _release(self, name):
+        with self._lock:
+            self._held.pop(name, None)
+
+    def _heartbeat(self):
+        while not self._stop_heartbeat.wait(self.lease_seconds / 4):
+            with self._lock:
+                held = list(self._held.items())
+            for name, path in held:
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    # Someone else has reclaimed it
+                    with self._lock:
+                        self._held.pop(name, None)
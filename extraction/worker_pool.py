@@ -0,0 +1,236 @@
+from collections import deque
+from multiprocessing.connection import wait
+
+# Messages from workers to the pool
+_PROGRESS = "progress"
+_DONE = "done"
+
+# The connection to the pool, and the worker's number, in a worker process
+_worker_conn = None
+_worker_index = None
+
+
+class WorkerLost(Exception):
+    pass
+
+
+class _Worker:
+    def __init__(self, process, conn, index):
+        self.process = process
+        self.conn = conn
+        self.index = index
+
+
+def report_progress(item):
+    # Called by a task in a worker to send item to the pool before the task has
+    # finished. If the worker dies before it finishes, the items it reported are
+    # passed to on_lost_task.
+    _worker_conn.send((_PROGRESS, item))
+
+
+def worker_index():
+    # The number of the worker this is called in. Workers are numbered in the
+    # order they're started, so a recycled worker's replacement has a new number.
+    return _worker_index
+
+
+def _worker_main(conn, index, initializer, initargs, should_recycle, finalizer):
+    global _worker_conn, _worker_index
+    _worker_conn = conn
+    _worker_index = index
+    if initializer is not None:
+        initializer(*initargs)
+    reason = "closed"
+    while True:
+        task = conn.recv()
+        if task is None:
+            break
+        func, args = task
+        try:
+            result = (True, func(args))
+        except Exception as e:
+            result = (False, e)
+        recycle_reason = None
+        if should_recycle is not None:
+            recycle_reason = should_recycle(result[1] if result[0] else None)
+        conn.send((_DONE, result, recycle_reason))
+        if recycle_reason is not None:
+            reason = recycle_reason
+            break
+    if finalizer is not None:
+        finalizer(reason)
+
+
+# Like multiprocessing.Pool's imap_unordered, but workers can ask to be
+# recycled: after each task, a worker calls should_recycle with its result (or
+# None if it raised), and if that returns a reason, the worker sends back its result, calls finalizer and exits, and a
+# fresh worker is forked in its place. Forked workers share whatever the
+# process that created the pool had loaded, so recycling is cheap.
+#
+# If a worker dies in the middle of a task (e.g. it's killed by the OOM killer),
+# the result of that task is on_lost_task(args, exitcode, reported, index)
+# rather than the pool hanging, as multiprocessing.Pool would, where reported is
+# what the task sent with report_progress before the worker died, and index is
+# the number the worker had (see worker_index).
+#
+# Rather than imap_unordered, tasks can also be given to the pool with submit
+# as they come in, and their results picked up with collect, e.g. to keep the
+# workers busy with tasks from several chunks at once.
+class RecyclingPool:
+    def __init__(
+        self,
+        context,
+        num_workers,
+        initializer=None,
+        initargs=(),
+        should_recycle=None,
+        finalizer=None,
+        on_lost_task=None,
+    ):
+        self.context = context
+        self.initializer = initializer
+        self.initargs = initargs
+        self.should_recycle = should_recycle
+        self.finalizer = finalizer
+        self.on_lost_task = on_lost_task
+        self.num_recycled = 0
+        self.num_lost = 0
+        self._num_started = 0
+        self._workers = [self._start_worker() for _ in range(max(num_workers, 1))]
+        self._idle = list(self._workers)
+        self._in_flight = {}
+        self._reported = {}
+        # Submitted tasks waiting for a worker
+        self._pending = deque()
+
+    def _start_worker(self):
+        parent_conn, child_conn = self.context.Pipe()
+        process = self.context.Process(
+            target=_worker_main,
+            args=(child_conn, self._num_started, self.initializer, self.initargs, self.should_recycle, self.finalizer),
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        self._num_started += 1
+        return _Worker(process, parent_conn, self._num_started - 1)
+
+    def _replace_worker(self, worker):
+        worker.conn.close()
+        worker.process.join()
+        new_worker = self._start_worker()
+        self._workers[self._workers.index(worker)] = new_worker
+        return new_worker
+
+    def _send(self, func, args):
+        worker = self._idle.pop()
+        worker.conn.send((func, args))
+        self._in_flight[worker] = args
+
+    def _dispatch(self, func, tasks, is_exhausted):
+        # Gives the idle workers tasks from the iterator. Returns whether we've
+        # run out of tasks.
+        self._dispatch_pending()
+        while self._idle and not is_exhausted:
+            try:
+                args = next(tasks)
+            except StopIteration:
+                return True
+            self._send(func, args)
+        return is_exhausted
+
+    def _dispatch_pending(self):
+        while self._idle and self._pending:
+            self._send(*self._pending.popleft())
+
+    def submit(self, func, args):
+        # Runs func(args) on the next free worker
+        self._pending.append((func, args))
+        self._dispatch_pending()
+
+    def num_pending(self):
+        # How many submitted tasks are waiting for a worker
+        return len(self._pending)
+
+    def num_unfinished(self):
+        return len(self._pending) + len(self._in_flight)
+
+    def collect(self):
+        # Waits for at least one task to finish, and returns the results of
+        # those that have. Their workers are given the next submitted tasks.
+        results = []
+        while not results and self._in_flight:
+            ready = wait([worker.conn for worker in self._in_flight] + [worker.process.sentinel for worker in self._in_flight])
+            for worker in list(self._in_flight):
+                if worker.conn not in ready and worker.process.sentinel not in ready:
+                    continue
+                try:
+                    message = worker.conn.recv()
+                except (EOFError, OSError):
+                    # The worker died before it could send its result
+                    args = self._in_flight.pop(worker)
+                    worker.process.join()
+                    self.num_lost += 1
+                    exitcode = worker.process.exitcode
+                    if self.on_lost_task is None:
+                        raise WorkerLost(f"Worker exited with code {exitcode} while working on {args}")
+                    results.append(self.on_lost_task(args, exitcode, self._reported.pop(worker, []), worker.index))
+                    self._idle.append(self._replace_worker(worker))
+                    continue
+
+                if message[0] == _PROGRESS:
+                    self._reported.setdefault(worker, []).append(message[1])
+                    continue
+                self._in_flight.pop(worker)
+                self._reported.pop(worker, None)
+                _, (is_ok, result), recycle_reason = message
+                if recycle_reason is not None:
+                    self.num_recycled += 1
+                    self._idle.append(self._replace_worker(worker))
+                else:
+                    self._idle.append(worker)
+                if not is_ok:
+                    raise result
+                results.append(result)
+        self._dispatch_pending()
+        return results
+
+    def imap_unordered(self, func, iterable):
+        tasks = iter(iterable)
+        is_exhausted = False
+        while True:
+            is_exhausted = self._dispatch(func, tasks, is_exhausted)
+            if not self._in_flight:
+                return
+            results = self.collect()
+            # The idle workers are given their next tasks before the results are
+            # handed back, so they aren't waiting while the caller deals with them
+            is_exhausted = self._dispatch(func, tasks, is_exhausted)
+            yield from results
+
+    def close(self):
+        for worker in self._workers:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+
+    def join(self):
+        for worker in self._workers:
+            worker.process.join()
+            worker.conn.close()
+
+    def terminate(self):
+        for worker in self._workers:
+            worker.process.terminate()
+        self.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+            self.join()
+        else:
+            self.terminate()
@@ -0,0 +1,128 @@
+import os
+import queue
+import threading
+import time
+
+# Put on the queue to make the writer thread exit
+_STOP = object()
+
+
+def fsync_path(path):
+    # fsyncs a file, or every file in a directory and the directory itself
+    if os.path.isdir(path):
+        for dir_path, _, filenames in os.walk(path):
+            for filename in filenames:
+                fsync_path(os.path.join(dir_path, filename))
+            _fsync(dir_path, os.O_RDONLY)
+    elif os.path.exists(path):
+        _fsync(path, os.O_RDONLY)
+
+
+def _fsync(path, flags):
+    try:
+        fd = os.open(path, flags)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class _WriteJob:
+    def __init__(self, write, stage, summary, on_done, on_error):
+        self.write = write
+        self.stage = stage
+        self.summary = summary
+        self.on_done = on_done
+        self.on_error = on_error
+
+
+# Persists records and cache payloads in a background thread so that workers
+# can get on with the next document.
+#
+# Jobs are handled in the order they're submitted, in batches of up to
+# batch_size. Every path written in a batch is fsynced once before the on_done
+# callbacks for the batch are called, so a callback only runs once everything
+# submitted before it is durable. At most max_pending jobs can be waiting, after
+# which submit blocks until the writer catches up.
+class BackgroundWriter:
+    def __init__(self, max_pending=16, batch_size=8, should_fsync=True):
+        self.batch_size = max(batch_size, 1)
+        self.should_fsync = should_fsync
+        self._queue = queue.Queue(maxsize=max(max_pending, 1))
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.num_batches = 0
+        self.num_writes = 0
+        self.time_blocked = 0.
+
+    def submit(self, write=None, stage=None, summary=None, on_done=None, on_error=None):
+        # write should return the paths it wrote to, so that they can be fsynced.
+        # A job without a write can be used to find out when everything
+        # submitted before it has been written.
+        start_time = time.perf_counter()
+        self._queue.put(_WriteJob(write, stage, summary, on_done, on_error))
+        self.time_blocked += time.perf_counter() - start_time
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            should_stop = any(job is _STOP for job in jobs)
+            jobs = [job for job in jobs if job is not _STOP]
+            try:
+                self._write_batch(jobs)
+            finally:
+                for _ in range(len(jobs) + (1 if should_stop else 0)):
+                    self._queue.task_done()
+            if should_stop:
+                return
+
+    def _write_batch(self, jobs):
+        paths_to_sync = set()
+        for job in jobs:
+            if job.write is None:
+                continue
+            start_time = time.perf_counter()
+            try:
+                written_paths = job.write()
+                if written_paths is not None:
+                    paths_to_sync.update(written_paths)
+            except Exception as e:
+                if job.on_error is not None:
+                    job.on_error(e)
+                else:
+                    print(f"BACKGROUND WRITE FAILED DUE TO: {e}")
+            self.num_writes += 1
+            if job.summary is not None and job.stage is not None:
+                stages = job.summary.setdefault("stages", {})
+                stages[job.stage] = stages.get(job.stage, 0.) + time.perf_counter() - start_time
+
+        if self.should_fsync and paths_to_sync:
+            for path in paths_to_sync:
+                fsync_path(path)
+        self.num_batches += 1
+
+        for job in jobs:
+            if job.on_done is not None:
+                try:
+                    job.on_done()
+                except Exception as e:
+                    # Keep the writer going, otherwise anything waiting on it would hang
+                    print(f"BACKGROUND WRITE CALLBACK FAILED DUE TO: {e}")
@@ -0,0 +1,77 @@
+from e2e_workflow.extraction.batch_tagging import BatchTagger
+
+
+class _Token:
+    def __init__(self, text):
+        self.text = text
+        self._tags = {}
+
+
+class _BatchTagger:
+    tag_type = "ner_tag"
+
+    def __init__(self):
+        self.batches = []
+
+    def can_tag(self, tag_type):
+        return tag_type == self.tag_type
+
+    def can_batch_tag(self, tag_type):
+        return tag_type == self.tag_type
+
+    def tag_for_type(self, tokens, tag_type):
+        raise AssertionError("Should have been tagged in a batch")
+
+    def batch_tag_for_type(self, batch, tag_type):
+        self.batches.append(batch)
+        return [[(token, token.text.upper()) for token in tokens] for tokens in batch]
+
+
+class _LazyTagger:
+    tag_type = "pos_tag"
+
+    def can_tag(self, tag_type):
+        return tag_type == self.tag_type
+
+    def tag_for_type(self, tokens, tag_type):
+        return [(token, "NN") for token in tokens]
+
+
+class _Sentence:
+    def __init__(self, text, taggers):
+        self.tokens = [_Token(word) for word in text.split()]
+        self.taggers = taggers
+
+
+class _Document:
+    def __init__(self, texts, taggers):
+        self.sentences = [_Sentence(text, taggers) for text in texts]
+
+
+def test_sentences_of_several_documents_are_tagged_together():
+    ner_tagger = _BatchTagger()
+    taggers = [_LazyTagger(), ner_tagger]
+    docs = [_Document(["a b", "c", "d e f"], taggers), _Document(["g", "h i"], taggers)]
+    # Already tagged sentences are left alone
+    docs[1].sentences[0].tokens[0]._tags["ner_tag"] = "G"
+
+    batch_tagger = BatchTagger(batch_size=2)
+    tagging_info = batch_tagger.tag(docs)
+
+    assert [len(batch) for batch in ner_tagger.batches] == [2, 2]
+    assert batch_tagger.batch_sizes == [2, 2]
+    assert [info["num_sentences"] for info in tagging_info] == [3, 1]
+    for doc in docs:
+        for sentence in doc.sentences:
+            for token in sentence.tokens:
+                assert "pos_tag" not in token._tags
+    assert [token._tags["ner_tag"] for token in docs[0].sentences[2].tokens] == ["D", "E", "F"]
+    assert batch_tagger.stats()["num_sentences"] == 4
+
+
+def test_only_the_given_tag_types_are_tagged():
+    ner_tagger = _BatchTagger()
+    docs = [_Document(["a b"], [ner_tagger])]
+    tagging_info = BatchTagger(batch_size=8, tag_types=["pos_tag"]).tag(docs)
+    assert ner_tagger.batches == []
+    assert tagging_info == [{"num_sentences": 0, "mean_batch_size": None, "tagging_time": 0.}]
@@ -0,0 +1,46 @@
+from e2e_workflow.extraction.corpus import DocumentSource, document_name
+
+
+def test_document_name_without_document_dir_is_the_filename():
+    assert document_name("/corpus/a/paper.html") == "paper"
+
+
+def test_recursive_walk_with_duplicate_basenames(tmp_path):
+    for relative_path in ["a/paper.html", "b/paper.html", "paper.html"]:
+        document_path = tmp_path / relative_path
+        document_path.parent.mkdir(parents=True, exist_ok=True)
+        document_path.write_text("<p>text</p>")
+
+    document_paths = list(DocumentSource(document_dir=str(tmp_path), recursive=True))
+    names = {document_name(document_path, str(tmp_path)) for document_path in document_paths}
+    assert names == {"a%2Fpaper", "b%2Fpaper", "paper"}
+
+
+def test_escaped_names_dont_collide():
+    assert document_name("/corpus/a%2Fb/c.html", "/corpus") != document_name("/corpus/a/b%2Fc.html", "/corpus")
+
+
+def test_recursive_extraction_with_duplicate_basenames(tmp_path):
+    from .utils import make_extractor, outputs, write_documents
+
+    document_dir = write_documents(tmp_path / "documents", ["a/paper.html", "b/paper.html"])
+    make_extractor(tmp_path).extract(document_dir, recursive=True)
+    assert outputs(tmp_path) == ["a%2Fpaper", "b%2Fpaper"]
+
+
+def test_manifest_extraction_with_duplicate_basenames(tmp_path):
+    from .utils import make_extractor, outputs, write_documents
+
+    document_dir = write_documents(tmp_path / "documents", ["x/paper.html", "y/paper.html"])
+    manifest_path = tmp_path / "manifest.txt"
+    manifest_path.write_text("x/paper.html\ny/paper.html\n")
+    make_extractor(tmp_path).extract(document_dir, manifest=str(manifest_path))
+    assert outputs(tmp_path) == ["x%2Fpaper", "y%2Fpaper"]
+
+
+def test_manifest_without_document_dir_is_named_relative_to_its_root(tmp_path):
+    manifest_path = tmp_path / "manifest.txt"
+    manifest_path.write_text(f"{tmp_path}/corpus/x/paper.html\n{tmp_path}/corpus/y/paper.html\n")
+    source = DocumentSource(manifest=str(manifest_path))
+    assert source.names_dir() == str(tmp_path / "corpus")
+    assert {document_name(document_path, source.names_dir()) for document_path in source} == {"x%2Fpaper", "y%2Fpaper"}
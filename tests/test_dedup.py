@@ -0,0 +1,36 @@
+import os
+
+from .utils import make_extractor, outputs, write_documents
+
+# After utils, which skips these tests if CDE isn't installed
+from e2e_workflow.extraction.dedup import find_duplicates
+
+
+def _write(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_text_mode_ignores_markup_case_and_whitespace(tmp_path):
+    original = _write(tmp_path / "original.html", "<html><body><p>Melting point: 300 K</p></body></html>")
+    reformatted = _write(tmp_path / "reformatted.xml", "<article>\n  <sec>melting   POINT 300&nbsp;K.</sec>\n</article>")
+    different = _write(tmp_path / "different.html", "<p>Melting point: 301 K</p>")
+
+    assert find_duplicates([original, reformatted, different], "content") == ([original, reformatted, different], {})
+    assert find_duplicates([original, reformatted, different], "text") == ([original, different], {original: [reformatted]})
+
+
+def test_missing_documents_are_left_for_extraction(tmp_path):
+    missing = str(tmp_path / "missing.html")
+    assert find_duplicates([missing, missing], "content") == ([missing, missing], {})
+
+
+def test_duplicates_are_given_the_original_output(tmp_path):
+    document_dir = write_documents(tmp_path / "documents", ["a.html", "b.html"])
+    (tmp_path / "documents" / "copy_of_a.html").write_text((tmp_path / "documents" / "a.html").read_text())
+    extractor = make_extractor(tmp_path, deduplicate="content")
+    extractor.extract(document_dir)
+
+    assert outputs(tmp_path) == ["a", "b", "copy_of_a"]
+    # Only a and b were extracted
+    assert sorted(os.path.basename(summary["document_path"]) for summary in extractor.run_summaries) == ["a.html", "b.html"]
@@ -0,0 +1,41 @@
+from e2e_workflow.extraction.dispatch import ChunkDispatcher
+
+
+def _drain(dispatcher):
+    chunks = []
+    while dispatcher.has_work():
+        chunks.append(dispatcher.next_chunk())
+    return chunks
+
+
+def test_chunks_shrink_towards_the_end():
+    dispatcher = ChunkDispatcher(range(100), num_workers=2, chunk_size=10, min_chunk_size=2)
+    chunks = _drain(dispatcher)
+    sizes = [len(chunk) for chunk in chunks]
+    assert sorted(sum(chunks, [])) == list(range(100))
+    assert sizes[0] == 10
+    assert sizes == sorted(sizes, reverse=True)
+    assert sizes[-1] < 10
+    assert all(size >= 2 for size in sizes[:-1])
+    assert dispatcher.total_documents() == 100
+    assert dispatcher.num_chunks_sent == len(chunks)
+
+
+def test_paths_are_read_lazily():
+    def document_paths():
+        for i in range(1000):
+            read.append(i)
+            yield i
+
+    read = []
+    dispatcher = ChunkDispatcher(document_paths(), num_workers=2, chunk_size=5)
+    assert dispatcher.next_chunk() == [0, 1, 2, 3, 4]
+    assert len(read) < 100
+    assert dispatcher.total_documents() is None
+
+
+def test_requeued_paths_are_sent_again():
+    dispatcher = ChunkDispatcher(["a", "b"], num_workers=1, chunk_size=2, tail_factor=1)
+    assert dispatcher.next_chunk() == ["a", "b"]
+    dispatcher.requeue(["b"])
+    assert _drain(dispatcher) == [["b"]]
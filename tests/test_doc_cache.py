@@ -0,0 +1,65 @@
+import os
+
+from .utils import make_extractor, write_documents
+
+# After utils, which skips these tests if CDE isn't installed
+from e2e_workflow.extraction.doc_cache import ENTRIES_DIR_NAME, EVICT_TO_FRACTION, _dir_size, content_hash
+
+
+def test_warm_cache_twice(tmp_path):
+    document_dir = write_documents(tmp_path / "documents", ["a.html", "b.html"])
+    cache_dir = str(tmp_path / "cache")
+
+    extractor = make_extractor(tmp_path, cache_dir=cache_dir)
+    extractor.warm_cache(document_dir)
+    assert extractor.document_cache.writes == 2
+
+    extractor = make_extractor(tmp_path, cache_dir=cache_dir)
+    extractor.warm_cache(document_dir)
+    assert extractor.document_cache.writes == 0
+    assert extractor.document_cache.hits == 2
+
+
+def test_cache_stats_are_added_up_from_worker_processes(tmp_path):
+    document_dir = write_documents(tmp_path / "documents", ["a.html", "b.html", "c.html"])
+    cache_dir = str(tmp_path / "cache")
+
+    extractor = make_extractor(tmp_path, cache_dir=cache_dir, backend="processes", workers=2)
+    extractor.warm_cache(document_dir)
+    assert extractor._cache_stats["writes"] == 3
+
+    extractor = make_extractor(tmp_path, cache_dir=cache_dir, backend="processes", workers=2)
+    extractor.warm_cache(document_dir)
+    assert extractor._cache_stats["hits"] == 3
+    # The workers did the work, not the process that reports it
+    assert extractor.document_cache.hits == 0
+
+
+def _entry_sizes(cache_dir):
+    entries_dir = os.path.join(cache_dir, ENTRIES_DIR_NAME)
+    return {
+        entry.name: _dir_size(entry.path)
+        for fingerprint_entry in os.scandir(entries_dir)
+        for entry in os.scandir(fingerprint_entry.path)
+    }
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    document_dir = write_documents(tmp_path / "documents", [f"paper{i}.html" for i in range(5)])
+    # The size of one entry, as it depends on how CDE tokenises the documents
+    measure_dir = write_documents(tmp_path / "measure", ["paper0.html"])
+    make_extractor(tmp_path, cache_dir=str(tmp_path / "measure_cache")).warm_cache(measure_dir)
+    entry_size = max(_entry_sizes(str(tmp_path / "measure_cache")).values())
+
+    cache_dir = str(tmp_path / "cache")
+    max_size_bytes = int(entry_size * 3.5)
+    extractor = make_extractor(tmp_path, cache_dir=cache_dir, cache_max_bytes=max_size_bytes)
+    extractor.warm_cache(document_dir)
+
+    sizes = _entry_sizes(cache_dir)
+    assert extractor.document_cache.evictions == 5 - len(sizes)
+    assert 0 < sum(sizes.values()) <= max_size_bytes * EVICT_TO_FRACTION + entry_size
+    # The papers are cached in order, so the last one is the most recently used
+    last_hash = content_hash(os.path.join(document_dir, "paper4.html"))
+    assert last_hash in sizes
+    assert content_hash(os.path.join(document_dir, "paper0.html")) not in sizes
@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip("chemdataextractor")
+
+from e2e_workflow.extraction.fingerprint import extraction_fingerprint, stale_models
+
+
+class Temperature:
+    parsers = []
+    fields = {}
+
+
+def _pressure_in_bar():
+    class Pressure:
+        parsers = []
+        fields = {}
+        units = "bar"
+    return Pressure
+
+
+def _pressure_in_pascals():
+    class Pressure:
+        parsers = []
+        fields = {}
+        units = "Pa"
+    return Pressure
+
+
+class Tagger:
+    def __init__(self, lexicon):
+        self.lexicon = lexicon
+
+
+def test_only_changed_models_are_stale():
+    stored_fingerprint = extraction_fingerprint([Temperature, _pressure_in_bar()])
+    assert stale_models(stored_fingerprint, extraction_fingerprint([Temperature, _pressure_in_bar()])) == []
+    assert stale_models(stored_fingerprint, extraction_fingerprint([Temperature, _pressure_in_pascals()])) == ["Pressure"]
+
+
+def test_changed_settings_make_every_model_stale():
+    stored_fingerprint = extraction_fingerprint([Temperature], document_args={"skip_elements": []})
+    fingerprint = extraction_fingerprint([Temperature], document_args={"skip_elements": ["table"]})
+    assert stale_models(stored_fingerprint, fingerprint) == ["Temperature"]
+
+
+def test_settings_with_cycles_and_large_objects():
+    document_args = {"tagger": Tagger(list(range(100000)))}
+    document_args["self"] = document_args
+    fingerprint = extraction_fingerprint([Temperature], document_args=document_args)
+
+    # Only the class of an object without its own repr is described
+    other_args = {"tagger": Tagger([])}
+    other_args["self"] = other_args
+    assert fingerprint == extraction_fingerprint([Temperature], document_args=other_args)
+
+
+def _without_source(definition, name):
+    # As if it had been defined in an interactive session
+    namespace = {}
+    exec(definition, namespace)
+    return namespace[name]
+
+
+def test_models_without_source_are_always_stale():
+    Humidity = _without_source("class Humidity:\n    parsers = []\n    fields = {}\n", "Humidity")
+    fingerprint = extraction_fingerprint([Temperature, Humidity])
+    assert stale_models(fingerprint, extraction_fingerprint([Temperature, Humidity])) == ["Humidity"]
+
+    is_valid_document = _without_source("def is_valid_document(document):\n    return True\n", "is_valid_document")
+    fingerprint = extraction_fingerprint([Temperature], is_valid_document=is_valid_document)
+    assert stale_models(fingerprint, extraction_fingerprint([Temperature], is_valid_document=is_valid_document)) == ["Temperature"]
@@ -0,0 +1,24 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("chemdataextractor")
+pytest.importorskip("cdedatabase")
+
+
+def test_extraction_doesnt_import_optional_packages():
+    # In a fresh process, as other tests may already have imported them
+    code = (
+        "import json, sys\n"
+        "import e2e_workflow.extraction.base_extractor\n"
+        "import e2e_workflow.extraction.extractor\n"
+        "print(json.dumps(sorted(sys.modules)))"
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, sys.path)))
+    completed = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    modules = json.loads(completed.stdout.strip().splitlines()[-1])
+    for package_name in ["wandb", "mpi4py", "photocatalyst_models"]:
+        assert not any(module == package_name or module.startswith(package_name + ".") for module in modules)
@@ -0,0 +1,45 @@
+import os
+
+from e2e_workflow.extraction.journal import COMPLETED, RunJournal
+
+from .utils import make_extractor, write_documents
+
+
+def test_journal_with_single_backend(tmp_path):
+    document_dir = write_documents(tmp_path / "documents", ["a.html", "b.html"])
+    journal_dir = str(tmp_path / "journal")
+
+    make_extractor(tmp_path, journal_dir=journal_dir).extract(document_dir)
+    statuses = RunJournal(journal_dir).read_statuses()
+    assert {os.path.basename(path): entry["status"] for path, entry in statuses.items()} == {"a.html": COMPLETED, "b.html": COMPLETED}
+    assert all(entry.get("output_fingerprint") for entry in statuses.values())
+
+    extractor = make_extractor(tmp_path, journal_dir=journal_dir)
+    extractor.extract(document_dir)
+    assert extractor.run_summaries == []
+
+
+def _keep_every_record(records):
+    return records
+
+
+def test_workers_get_journalled_fingerprints_from_the_master(tmp_path):
+    from chemdataextractor.model import MeltingPoint
+
+    document_dir = write_documents(tmp_path / "documents", ["a.html", "b.html"])
+    journal_dir = str(tmp_path / "journal")
+    make_extractor(tmp_path, models=[MeltingPoint], journal_dir=journal_dir, backend="processes", workers=2).extract(document_dir)
+
+    # A different filter changes the fingerprint, so the papers are extracted
+    # again. The workers only know that they're being re-extracted, rather than
+    # extracted for the first time, from what the master sent them.
+    extractor = make_extractor(
+        tmp_path,
+        models=[MeltingPoint],
+        journal_dir=journal_dir,
+        backend="processes",
+        workers=2,
+        filter_results=_keep_every_record,
+    )
+    extractor.extract(document_dir)
+    assert [summary.get("reextracted_models") for summary in extractor.run_summaries] == [["MeltingPoint"]] * 2
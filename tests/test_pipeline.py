@@ -0,0 +1,31 @@
+from .utils import make_extractor, outputs, write_documents
+
+
+def test_pipelined_extraction_extracts_every_paper(tmp_path):
+    names = [f"paper{i}.html" for i in range(6)]
+    document_dir = write_documents(tmp_path / "documents", names)
+    extractor = make_extractor(tmp_path, pipeline_depth=2)
+    extractor.extract(document_dir)
+
+    assert outputs(tmp_path) == [f"paper{i}" for i in range(6)]
+    assert sorted(summary["document_path"] for summary in extractor.run_summaries) == sorted(
+        str(tmp_path / "documents" / name) for name in names
+    )
+    assert {summary["status"] for summary in extractor.run_summaries} == {"completed"}
+
+
+def test_failures_in_one_stage_dont_stop_the_pipeline(tmp_path):
+    document_dir = write_documents(tmp_path / "documents", ["a.html", "b.html", "c.html"])
+    extractor = make_extractor(tmp_path, pipeline_depth=2)
+    postprocess_records = extractor.postprocess_records
+
+    def fail_on_b(document_records, document_path):
+        if document_path.endswith("b.html"):
+            raise ValueError("b")
+        postprocess_records(document_records, document_path)
+
+    extractor.postprocess_records = fail_on_b
+    extractor.extract(document_dir)
+
+    statuses = {summary["document_path"][-6:]: summary["status"] for summary in extractor.run_summaries}
+    assert statuses == {"a.html": "completed", "b.html": "failed", "c.html": "completed"}
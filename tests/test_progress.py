@@ -0,0 +1,57 @@
+import pytest
+
+from e2e_workflow.extraction.progress import ProgressAggregator
+
+
+class _ListSink:
+    def __init__(self):
+        self.updates = []
+
+    def write(self, metrics):
+        self.updates.append(metrics)
+
+
+def _summary(document_path, status="completed", rank=1, elapsed=1.):
+    return {"document_path": document_path, "status": status, "rank": rank, "elapsed": elapsed, "stages": {"records": elapsed}}
+
+
+def test_updates_are_throttled():
+    sink = _ListSink()
+    progress = ProgressAggregator([sink], interval=3600.)
+    for i in range(100):
+        progress.record(_summary(f"paper{i}"))
+    assert sink.updates == []
+    progress.close()
+    assert len(sink.updates) == 1
+    assert sink.updates[0]["num_papers_processed"] == 100
+
+
+def test_retried_papers_are_only_counted_once_finished():
+    sink = _ListSink()
+    progress = ProgressAggregator([sink], interval=3600.)
+    progress.set_total_documents(2)
+    progress.record(_summary("a", status="timed_out"), will_retry=True)
+    progress.record(_summary("a", status="failed"))
+    progress.record(_summary("b", rank=2))
+    progress.close()
+
+    metrics = sink.updates[-1]
+    assert metrics["num_papers_processed"] == 2
+    assert metrics["num_papers_failed"] == 1
+    assert metrics["num_papers_completed"] == 1
+    assert metrics["num_papers_timed_out"] == 0
+    assert metrics["total_papers"] == 2
+    assert {"busy_fraction/rank1", "busy_fraction/rank2", "stages/records/p50"} <= set(metrics)
+
+
+def test_eta_follows_the_predicted_costs():
+    sink = _ListSink()
+    progress = ProgressAggregator([sink], interval=3600.)
+    progress.set_total_documents(2)
+    progress.set_predicted_costs({"small": 1., "large": 9.})
+    progress.record(_summary("small"))
+    progress.close()
+
+    assert sink.updates[-1]["predicted_fraction_done"] == pytest.approx(0.1)
+    # Nine times as long again, rather than as long again as half the papers would suggest
+    assert sink.updates[-1]["eta_seconds"] == pytest.approx(9 * sink.updates[-1]["elapsed_seconds"])
@@ -0,0 +1,80 @@
+import multiprocessing
+import os
+
+from e2e_workflow.extraction.scheduling import CostEstimator
+
+
+def _time_documents(history_path, document_paths):
+    estimator = CostEstimator(history_path)
+    for document_path in document_paths:
+        estimator.record(document_path, 1.)
+    estimator.save()
+
+
+def _write_documents(directory, num_documents):
+    document_paths = []
+    for i in range(num_documents):
+        document_path = directory / f"paper{i}.html"
+        document_path.write_text("<p>text</p>")
+        document_paths.append(str(document_path))
+    return document_paths
+
+
+def test_concurrent_saves_keep_every_timing(tmp_path):
+    document_paths = _write_documents(tmp_path, 80)
+    history_path = str(tmp_path / "history.json")
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=_time_documents, args=(history_path, document_paths[i::8]))
+        for i in range(8)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    estimator = CostEstimator(history_path)
+    assert len(estimator.documents) == len(document_paths)
+    assert estimator.total_seconds == len(document_paths)
+
+
+def test_corrupt_history_is_treated_as_empty(tmp_path):
+    document_paths = _write_documents(tmp_path, 2)
+    history_path = tmp_path / "history.json"
+    history_path.write_text('{"documents": {')
+
+    assert CostEstimator(str(history_path)).documents == {}
+    _time_documents(str(history_path), document_paths)
+    assert len(CostEstimator(str(history_path)).documents) == 2
+
+
+
+def _elapsed(history_path):
+    return {os.path.basename(key): document.get("elapsed") for key, document in CostEstimator(history_path).documents.items()}
+
+
+def test_skipped_documents_keep_their_timings(tmp_path):
+    from .utils import make_extractor, write_documents
+
+    document_dir = write_documents(tmp_path / "documents", ["a.html"])
+    history_path = str(tmp_path / "history.json")
+    make_extractor(tmp_path, cost_history_path=history_path).extract(document_dir)
+    elapsed = _elapsed(history_path)["a.html"]
+    assert elapsed > 0
+
+    # It's already been extracted, so it's skipped the second time
+    make_extractor(tmp_path, cost_history_path=history_path).extract(document_dir)
+    assert _elapsed(history_path)["a.html"] == elapsed
+
+
+def test_failed_documents_arent_timed(tmp_path):
+    from .utils import make_extractor, write_documents
+
+    def is_valid_document(doc):
+        raise ValueError("can't extract this")
+
+    document_dir = write_documents(tmp_path / "documents", ["a.html"])
+    history_path = str(tmp_path / "history.json")
+    make_extractor(tmp_path, cost_history_path=history_path, is_valid_document=is_valid_document).extract(document_dir)
+    assert _elapsed(history_path).get("a.html") is None
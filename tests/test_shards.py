@@ -0,0 +1,25 @@
+import os
+
+from .utils import make_extractor, write_documents
+
+# After utils, which skips these tests if CDE isn't installed
+from e2e_workflow.extraction.shards import INDEX_DIR_NAME, SHARDS_DIR_NAME, ShardedStore
+
+
+def test_resumed_runs_write_new_shards(tmp_path):
+    write_documents(tmp_path / "documents", ["a.html", "b.html"])
+    extractor = make_extractor(tmp_path, output_layout="sharded", papers_per_shard=2)
+    extractor.extract(str(tmp_path / "documents"))
+    assert extractor._shard_writers == {}
+
+    write_documents(tmp_path / "documents", ["c.html"])
+    extractor = make_extractor(tmp_path, output_layout="sharded", papers_per_shard=2)
+    extractor.extract(str(tmp_path / "documents"))
+
+    output_dir = tmp_path / "output"
+    assert len(os.listdir(output_dir / INDEX_DIR_NAME)) == 2
+    shards = sorted(os.listdir(output_dir / SHARDS_DIR_NAME))
+    assert len(shards) == 2
+    store = ShardedStore(str(output_dir))
+    assert store.papers() == ["a", "b", "c"]
+    assert store.shard_for_paper("a") == store.shard_for_paper("b") != store.shard_for_paper("c")
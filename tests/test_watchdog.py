@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+from e2e_workflow.extraction.watchdog import DocumentTimeout, time_limit
+
+
+def test_time_limit_interrupts_python_code():
+    start_time = time.perf_counter()
+    with pytest.raises(DocumentTimeout):
+        with time_limit(0.1):
+            while True:
+                pass
+    assert time.perf_counter() - start_time < 5
+
+
+def test_time_limit_is_cancelled_on_exit():
+    with time_limit(0.1):
+        pass
+    # The alarm would go off during this if it were still set
+    time.sleep(0.2)
+
+
+def _slow_down(extractor, name, seconds):
+    extract_paper = extractor.extract_paper
+
+    def slow_extract_paper(document_path):
+        if name in document_path:
+            time.sleep(seconds)
+        extract_paper(document_path)
+
+    extractor.extract_paper = slow_extract_paper
+
+
+@pytest.mark.parametrize("timeout_policy, num_attempts", [("quarantine", 1), ("requeue", 2)])
+def test_papers_that_time_out_are_quarantined(tmp_path, timeout_policy, num_attempts):
+    from .utils import make_extractor, outputs, write_documents
+
+    document_dir = write_documents(tmp_path / "documents", ["fast.html", "slow.html"])
+    extractor = make_extractor(tmp_path, document_timeout=0.2, timeout_policy=timeout_policy, timeout_retries=1)
+    _slow_down(extractor, "slow", 10)
+    extractor.extract(document_dir)
+
+    assert [summary["document_path"] for summary in extractor._quarantined] == [str(tmp_path / "documents" / "slow.html")]
+    assert extractor._timeout_counts == {str(tmp_path / "documents" / "slow.html"): num_attempts}
+    assert outputs(tmp_path) == ["fast"]
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+
+from e2e_workflow.extraction.scheduling import CostEstimator
+from e2e_workflow.extraction.work_queue import FileWorkQueue
+
+
+def _expire_lease(queue, task_name):
+    # As if the claimer had stopped heartbeating a while ago
+    queue.close()
+    claimed_path = queue._held[task_name]
+    os.utime(claimed_path, (0, 0))
+
+
+def test_expired_leases_are_reclaimed(tmp_path):
+    crashed = FileWorkQueue(str(tmp_path), lease_seconds=60, owner="crashed", poll_interval=0.01)
+    assert crashed.join(lambda: [{"chunk": 0}, {"chunk": 1}])
+    task_name, task = crashed.claim()
+    _expire_lease(crashed, task_name)
+
+    other = FileWorkQueue(str(tmp_path), lease_seconds=60, owner="other", poll_interval=0.01)
+    assert not other.join(lambda: [])
+    claimed = [other.claim(), other.claim()]
+    assert claimed[0][1] == {"chunk": 1}
+    assert claimed[1] is None
+    assert other.reclaim_expired() == 1
+    reclaimed_name, reclaimed_task = other.claim()
+    assert reclaimed_name == task_name
+    assert reclaimed_task == {"chunk": 0, "num_reclaims": 1}
+    for name in [claimed[0][0], reclaimed_name]:
+        other.complete(name)
+    other.close()
+
+    # Too late, as it's already been done
+    crashed.complete(task_name)
+    assert crashed.num_completed == 0
+    assert other.is_finished()
+    assert other.status() == {"pending": 0, "claimed": 0, "done": 2, "failed": 0}
+
+
+def test_tasks_that_keep_expiring_are_given_up_on(tmp_path):
+    queue = FileWorkQueue(str(tmp_path), lease_seconds=60, poll_interval=0.01, max_reclaims=1)
+    queue.join(lambda: [{"chunk": 0}])
+    for num_reclaimed in [1, 0]:
+        task_name, _ = queue.claim()
+        _expire_lease(queue, task_name)
+        assert queue.reclaim_expired() == num_reclaimed
+    assert queue.claim() is None
+    assert queue.is_finished()
+    assert queue.status()["failed"] == 1
+
+
+def _extract_from_queue(tmp_path, document_dir):
+    from .utils import make_extractor
+
+    make_extractor(
+        tmp_path,
+        backend="file_queue",
+        queue_dir=str(tmp_path / "queue"),
+        cost_history_path=str(tmp_path / "history.json"),
+    ).extract(document_dir)
+
+
+def test_file_queue_processes_share_a_cost_history(tmp_path):
+    from .utils import outputs, write_documents
+
+    relative_paths = [f"paper{i}.html" for i in range(12)]
+    document_dir = write_documents(tmp_path / "documents", relative_paths)
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_extract_from_queue, args=(tmp_path, document_dir)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    assert outputs(tmp_path) == sorted(os.path.splitext(relative_path)[0] for relative_path in relative_paths)
+    assert len(CostEstimator(str(tmp_path / "history.json")).documents) == len(relative_paths)
@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+import time
+
+from e2e_workflow.extraction.worker_pool import RecyclingPool, report_progress
+
+
+def _report_each_item(items):
+    for item in items:
+        if item == "die":
+            os._exit(1)
+        report_progress(item)
+    return items
+
+
+def _lost_task(args, exitcode, reported, index):
+    return ("lost", exitcode, reported, index)
+
+
+def test_lost_task_is_given_what_was_reported():
+    with RecyclingPool(multiprocessing.get_context("fork"), 1, on_lost_task=_lost_task) as pool:
+        results = list(pool.imap_unordered(_report_each_item, [["a", "b", "die", "c"], ["d"]]))
+    # The only worker there was, the first one started
+    assert ("lost", 1, ["a", "b"], 0) in results
+    assert ["d"] in results
+    assert pool.num_lost == 1
+
+
+def _touch(path):
+    open(path, "w").close()
+    return path
+
+
+def _wait_for_file(path):
+    while not os.path.exists(path):
+        time.sleep(0.01)
+    return path
+
+
+def test_submitted_tasks_start_while_others_are_running(tmp_path):
+    # The second task can only finish if it's started while the first is still
+    # waiting for it, rather than after it
+    flag_path = str(tmp_path / "flag")
+    with RecyclingPool(multiprocessing.get_context("fork"), 2) as pool:
+        pool.submit(_wait_for_file, flag_path)
+        pool.submit(_touch, flag_path)
+        assert pool.num_pending() == 0
+        results = []
+        while pool.num_unfinished():
+            results.extend(pool.collect())
+    assert results == [flag_path, flag_path]
+
+
+def test_lost_papers_are_recorded_under_the_lost_worker(tmp_path):
+    from .utils import make_extractor, write_documents
+
+    document_dir = write_documents(tmp_path / "documents", ["a.html", "b.html", "c_dies.html"])
+    # A new worker for every paper, so each paper should have its own rank
+    extractor = make_extractor(tmp_path, backend="processes", workers=1, max_documents_per_worker=1)
+    extract_paper = extractor.extract_paper
+
+    def die_on_c(document_path):
+        if "dies" in document_path:
+            os._exit(1)
+        extract_paper(document_path)
+
+    extractor.extract_paper = die_on_c
+    extractor.extract(document_dir)
+
+    assert sorted(summary["rank"] for summary in extractor.run_summaries) == [0, 1, 2]
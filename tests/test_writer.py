@@ -0,0 +1,41 @@
+from e2e_workflow.extraction import writer
+from e2e_workflow.extraction.writer import BackgroundWriter
+
+
+def test_callbacks_run_in_order_after_their_writes_are_synced(tmp_path, monkeypatch):
+    events = []
+    monkeypatch.setattr(writer, "fsync_path", lambda path: events.append(("fsync", path)))
+
+    def write(i):
+        path = str(tmp_path / f"{i}.txt")
+        with open(path, "w") as f:
+            f.write(str(i))
+        events.append(("write", path))
+        return [path]
+
+    background_writer = BackgroundWriter(batch_size=3)
+    for i in range(7):
+        background_writer.submit(lambda i=i: write(i), on_done=lambda i=i: events.append(("done", i)))
+    background_writer.close()
+
+    assert [event[1] for event in events if event[0] == "done"] == list(range(7))
+    for i in range(7):
+        path = str(tmp_path / f"{i}.txt")
+        assert events.index(("write", path)) < events.index(("fsync", path)) < events.index(("done", i))
+
+
+def test_failed_writes_dont_stop_later_ones(tmp_path):
+    errors = []
+    done = []
+
+    def fail():
+        raise OSError("disk full")
+
+    background_writer = BackgroundWriter(should_fsync=False)
+    background_writer.submit(fail, on_error=errors.append, on_done=lambda: done.append("fail"))
+    background_writer.submit(lambda: None, on_done=lambda: done.append("ok"))
+    background_writer.flush()
+    background_writer.close()
+
+    assert [str(e) for e in errors] == ["disk full"]
+    assert done == ["fail", "ok"]
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+pytest.importorskip("chemdataextractor")
+pytest.importorskip("cdedatabase")
+
+from e2e_workflow.extraction.extractor import CDEDatabaseExtractor
+
+
+def write_documents(document_dir, relative_paths):
+    for relative_path in relative_paths:
+        document_path = document_dir / relative_path
+        document_path.parent.mkdir(parents=True, exist_ok=True)
+        document_path.write_text(f"<html><body><p>The sample in {relative_path} was heated to 300 K.</p></body></html>")
+    return str(document_dir)
+
+
+def make_extractor(tmp_path, models=(), **kwargs):
+    return CDEDatabaseExtractor(models=list(models), save_root_dir=str(tmp_path / "output"), use_mpi=False, **kwargs)
+
+
+def outputs(tmp_path):
+    # The names of the per-paper databases
+    output_dir = tmp_path / "output"
+    return sorted(name for name in os.listdir(output_dir) if os.path.isdir(output_dir / name))